@@ -1,21 +1,28 @@
+import asyncio
 from contextlib import asynccontextmanager
 from pathlib import Path
 import hashlib
+import heapq
 import uuid
 import os
-from typing import Optional
+import sys
+from typing import Awaitable, Optional
 import time
 
 from fastapi import FastAPI, UploadFile, status
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 import httpx
 import aiofiles
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from ollama_proxy import OllamaProxy
 
 import api_models
+import metrics
 import remotes.datastore as datastore
 import remotes.document_converter as document_converter
+from remotes.replicas import ReplicaSet
+from remotes.shards import HashRing
 
 
 # Path to the directory where uploaded files are stored
@@ -28,15 +35,106 @@ async def lifespan(app: FastAPI):
     # Start the app, connect to the datastore, etc.
     app.state.ollama_proxy = await OllamaProxy.create("ollama", 11434)
     app.state.httpx_client = httpx.AsyncClient()
+    # The datastore shards, each document is stored on the one owning its
+    # UUID
+    app.state.shards = HashRing(datastore.get_shard_urls())
+    # The reads of each shard go to its healthy read replicas, if any
+    app.state.replicas = ReplicaSet(datastore.get_shard_replicas())
+    replica_health_task = None
+    if any(app.state.replicas.replicas.values()):
+        replica_health_task = asyncio.create_task(app.state.replicas.monitor(
+            app.state.httpx_client,
+            datastore.HEALTH_PATH,
+            datastore.get_replica_health_interval()
+        ))
     
     app.state.startup_time = time.time()
     yield
 
+    if replica_health_task is not None:
+        replica_health_task.cancel()
+
 
 app = FastAPI(
     lifespan=lifespan,
     title="Backend API",
 )
+metrics.instrument(app)
+
+
+async def gather_responses(
+    requests: list[Awaitable[httpx.Response]]
+) -> list[Optional[httpx.Response]]:
+    """
+    Sends the given requests, one per datastore shard, concurrently.
+
+    Returns:
+    - list[Optional[httpx.Response]]: The response of each request, in the
+        same order, None if it failed.
+    """
+    responses = await asyncio.gather(*requests, return_exceptions=True)
+    results = []
+    for response in responses:
+        if isinstance(response, Exception):
+            print(f"Datastore shard request failed: {response}", file=sys.stderr)
+            results.append(None)
+        elif response.status_code != status.HTTP_200_OK:
+            results.append(None)
+        else:
+            results.append(response)
+    return results
+
+def shard_url(document_uuid: str, path: str) -> str:
+    """
+    Returns the URL of the given endpoint on the shard owning the document.
+    """
+    shards: HashRing = app.state.shards
+    return f"{shards.shard_for(document_uuid)}{path}"
+
+def all_shard_urls(path: str) -> list[str]:
+    """
+    Returns the URL of the given endpoint on every shard.
+    """
+    shards: HashRing = app.state.shards
+    return [f"{shard}{path}" for shard in shards.shards]
+
+def read_url(shard: str, path: str) -> str:
+    """
+    Returns the URL of the given read endpoint on a replica of the given
+    shard, or on its leader if it has no healthy replica.
+    """
+    replicas: ReplicaSet = app.state.replicas
+    return f"{replicas.read_url(shard)}{path}"
+
+async def read_shard(
+    client: httpx.AsyncClient,
+    method: str,
+    shard: str,
+    path: str,
+    **kwargs
+) -> httpx.Response:
+    """
+    Sends a read of the given endpoint to a replica of the given shard, see
+    read_url. Replicas apply the writes of their leader asynchronously, so
+    a replica answers 404 for a document it does not have yet: the read is
+    then sent again to the leader.
+    """
+    url = read_url(shard, path)
+    response = await client.request(method, url, **kwargs)
+    if (
+        response.status_code == status.HTTP_404_NOT_FOUND
+        and url != f"{shard}{path}"
+    ):
+        response = await client.request(method, f"{shard}{path}", **kwargs)
+    return response
+
+def all_read_shard_urls(path: str) -> list[str]:
+    """
+    Returns the URL of the given read endpoint on a replica of every shard,
+    see read_url.
+    """
+    shards: HashRing = app.state.shards
+    return [read_url(shard, path) for shard in shards.shards]
 
 
 @app.get("/health", response_model=api_models.ServiceHealth)
@@ -49,6 +147,13 @@ async def health():
         status="healthy"
     )
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the metrics of the backend in the Prometheus text format.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/services_health", response_model=api_models.HealthCheckResponse)
 async def services_health():
     """
@@ -56,19 +161,20 @@ async def services_health():
     datastore and document_converter services.
     """
     client: httpx.AsyncClient = app.state.httpx_client
+    # The datastore is healthy if all its shards are
     datastore_uptime = 0
     datastore_status_str = "unhealthy"
-    try:
-        datastore_health_response = await client.get(
-            datastore.HEALTH_URL)
-        if datastore_health_response.status_code == status.HTTP_200_OK:
-            datastore_health = datastore.HealthCheckResponse(
-                **datastore_health_response.json()
-            )
-            datastore_uptime = datastore_health.up_time
-            datastore_status_str = datastore_health.status
-    except httpx.ConnectTimeout:
-        pass
+    datastore_health_responses = await gather_responses([
+        client.get(url) for url in all_shard_urls(datastore.HEALTH_PATH)
+    ])
+    if all(datastore_health_responses):
+        datastore_healths = [
+            datastore.HealthCheckResponse(**response.json())
+            for response in datastore_health_responses
+        ]
+        datastore_uptime = min(health.up_time for health in datastore_healths)
+        if all(health.status == "healthy" for health in datastore_healths):
+            datastore_status_str = "healthy"
     
     document_converter_uptime = 0
     document_converter_status_str = "unhealthy"
@@ -107,7 +213,7 @@ async def has_document_uuid(document_uuid: str):
     client: httpx.AsyncClient = app.state.httpx_client
 
     has_document_response = await client.get(
-        datastore.HAS_DOCUMENT_UUID_URL,
+        shard_url(document_uuid, datastore.HAS_DOCUMENT_UUID_PATH),
         params={"document_uuid": document_uuid}
     )
     has_document_json = has_document_response.json()
@@ -144,24 +250,22 @@ async def add_document(document: UploadFile):
     document_ext = document.filename.split(".")[-1]
     document_name = f"{document_hash}.{document_ext}"
 
-    has_document_response = await client.get(
-        datastore.HAS_DOCUMENT_URL,
-        params={"document_hash": document_hash}
-    )
-    if(
-        not has_document_response 
-        or has_document_response.status_code != status.HTTP_200_OK
-    ):
+    # The shard of a document depends on its UUID, not its hash, so every
+    # shard is checked
+    has_document_responses = await gather_responses([
+        client.get(url, params={"document_hash": document_hash})
+        for url in all_shard_urls(datastore.HAS_DOCUMENT_PATH)
+    ])
+    if not all(has_document_responses):
         return api_models.UploadFileResponse(
             is_success=False, 
             message="Datastore failed to check if document exists"
         )
     
-    has_document = datastore.HasDocumentResponse(
-        **has_document_response.json()
-    )
-
-    if has_document.has_document:
+    if any(
+        datastore.HasDocumentResponse(**response.json()).has_document
+        for response in has_document_responses
+    ):
         return api_models.UploadFileResponse(
             is_success=False, 
             message="Document already exists"
@@ -173,12 +277,13 @@ async def add_document(document: UploadFile):
         await f.write(document_bytes)
  
     # Parse the document's content
-    document_parse_response = await client.post(
-        url=document_converter.CONVERT_DOCUMENT_URL,
-        json=document_converter.ConvertDocumentRequest(
-            document_name=document_name).model_dump(),
-        timeout=None
-    )
+    with metrics.stage("conversion"):
+        document_parse_response = await client.post(
+            url=document_converter.CONVERT_DOCUMENT_URL,
+            json=document_converter.ConvertDocumentRequest(
+                document_name=document_name).model_dump(),
+            timeout=None
+        )
     if document_parse_response.status_code != status.HTTP_200_OK: 
         os.remove(document_full_path)
         return api_models.UploadFileResponse(
@@ -191,31 +296,42 @@ async def add_document(document: UploadFile):
         **document_parse_response_json).text_chunks
     
     # Prepare the document for storage in the datastore
-    embeddings = await ollama_proxy.embed(text_chunks)
-    document_summary = await ollama_proxy.summarize(text_chunks)
-    summary_embedding = await ollama_proxy.embed(document_summary)
-
+    with metrics.stage("document_embed"):
+        embeddings = await ollama_proxy.embed(text_chunks)
+    with metrics.stage("summarization"):
+        document_summary = await ollama_proxy.summarize(text_chunks)
+    with metrics.stage("document_embed"):
+        summary_embedding = await ollama_proxy.embed(document_summary)
+
+    # In the binary format all the chunk embeddings are sent as a single
+    # matrix instead of one JSON list per chunk
+    binary_embeddings = datastore.get_binary_embeddings()
     datastore_request = datastore.AddDocumentRequest(
         document_uuid=document_uuid,
         document_hash_str=document_hash,
         document_filename=document_name,
-        document_embedding=summary_embedding[0],
+        document_embedding=datastore.to_wire_embedding(summary_embedding[0]),
         document_summary=document_summary,
         document_chunks=[
             datastore.AddDocumentChunk(
                 text=chunk,
                 page_number=i,
-                embedding=embedding
+                embedding=None if binary_embeddings else embedding
             )
             for i, (chunk, embedding) in enumerate(zip(text_chunks, embeddings))
-        ]
+        ],
+        chunks_embeddings=(
+            datastore.encode_embeddings(embeddings) 
+            if binary_embeddings else None
+        )
     )
 
-    datastore_response = await client.post(
-        datastore.ADD_DOCUMENT_URL,
-        json=datastore_request.model_dump(),
-        timeout=None
-    )
+    with metrics.stage("datastore_add"):
+        datastore_response = await client.post(
+            shard_url(document_uuid, datastore.ADD_DOCUMENT_PATH),
+            json=datastore_request.model_dump(exclude_none=True),
+            timeout=None
+        )
     if datastore_response.status_code != status.HTTP_200_OK:
         os.remove(document_full_path)
         return api_models.UploadFileResponse(is_success=False, message="Datastore failed to add document")
@@ -223,6 +339,121 @@ async def add_document(document: UploadFile):
     return api_models.UploadFileResponse(is_success=True)
 
 
+async def query_lexical(
+    client: httpx.AsyncClient,
+    text: str,
+    document_uuids: Optional[list[str]],
+    top_k: int
+) -> Optional[list[datastore.DocumentChunk]]:
+    """
+    Retrieves the chunks of an identifier or exact phrase query with a
+    full-text search only, skipping the embedding of the query. Returns
+    None if the query is not such a query, or nothing matches, so that the
+    vector search is used instead.
+    """
+    phrase = datastore.lexical_query(text)
+    if phrase is None or not datastore.get_lexical_fast_path():
+        return None
+    if document_uuids is None:
+        shard_uuids = {shard: None for shard in app.state.shards.shards}
+    else:
+        shard_uuids = app.state.shards.group(document_uuids)
+    with metrics.stage("lexical_search"):
+        responses = await gather_responses([
+            read_shard(
+                client,
+                "POST",
+                shard,
+                datastore.QUERY_LEXICAL_PATH,
+                json=datastore.LexicalQueryRequest(
+                    query_text=phrase,
+                    document_uuids=uuids,
+                    top_k=top_k,
+                    phrase=True
+                ).model_dump()
+            )
+            for shard, uuids in shard_uuids.items()
+        ])
+    chunks = heapq.nlargest(
+        top_k,
+        (
+            datastore.DocumentChunk(**chunk)
+            for response in responses if response is not None
+            for chunk in response.json()
+        ),
+        key=lambda chunk: chunk.score
+    )
+    return chunks or None
+
+def document_query_request(
+    document_uuids: list[str],
+    query_embedding: list[float],
+    text: str
+) -> datastore.DocumentQueryRequest:
+    """
+    Builds the request retrieving the chunks of the given documents, in the
+    configured retrieval and merge modes.
+    """
+    hybrid = datastore.get_retrieval_mode() == "hybrid"
+    merge = datastore.get_merge_mode()
+    return datastore.DocumentQueryRequest(
+        document_uuids=document_uuids,
+        query_embedding=datastore.to_wire_embedding(query_embedding),
+        min_score=datastore.get_min_score(),
+        top_k=datastore.get_chunk_top_k(),
+        merge=merge,
+        limit=datastore.get_chunk_limit() if merge == "global" else None,
+        mode="hybrid" if hybrid else "vector",
+        query_text=text if hybrid else None
+    )
+
+async def query_documents(
+    client: httpx.AsyncClient,
+    document_uuids: list[str],
+    query_embedding: list[float],
+    text: str
+) -> Optional[list[datastore.DocumentChunk]]:
+    """
+    Retrieves the chunks of the given documents, querying each shard for
+    the documents it owns concurrently. Returns None if a shard fails.
+    """
+    request = document_query_request([], query_embedding, text)
+    groups = app.state.shards.group(document_uuids)
+    with metrics.stage("chunk_search"):
+        responses = await gather_responses([
+            read_shard(
+                client,
+                "POST",
+                shard,
+                datastore.QUERY_DOCUMENT_PATH,
+                json=request.model_copy(
+                    update={"document_uuids": uuids}).model_dump()
+            )
+            for shard, uuids in groups.items()
+        ])
+    if not all(responses):
+        return None
+    chunks = [
+        datastore.DocumentChunk(**chunk)
+        for response in responses
+        for chunk in response.json()
+    ]
+    if request.merge == "global" and len(groups) > 1:
+        # Each shard returned its best chunks, the best overall are kept
+        chunks = heapq.nlargest(
+            request.limit, chunks, key=lambda chunk: chunk.score)
+    return chunks
+
+def chunk_count(document_count: int) -> int:
+    """
+    Returns the maximum number of chunks retrieved from the given number
+    of documents.
+    """
+    if datastore.get_merge_mode() == "global":
+        return datastore.get_chunk_limit()
+    return document_count * datastore.get_chunk_top_k()
+
+
 @app.post("/query")
 async def query(request: api_models.QueryRequest):
     """
@@ -233,38 +464,21 @@ async def query(request: api_models.QueryRequest):
     reranked based on the user's query and the chat model is used to
     generate a response. The response is returned as a stream of json
     objects separated by newlines. 
-    Right now the number of root documents and the number of chunks for each 
-    document are fixed at 5 and 5 respectively.
+    The number of root documents and the number of chunks for each document
+    are set by RETRIEVAL_ROOT_TOP_K and RETRIEVAL_CHUNK_TOP_K, 5 and 5 by
+    default. With RETRIEVAL_MERGE=global only the RETRIEVAL_CHUNK_LIMIT best
+    chunks across all the documents are kept.
+    Queries that look like identifiers or exact phrases are answered with
+    a full-text search of all the chunks instead, when it finds any.
     """
     ollama_proxy: OllamaProxy = app.state.ollama_proxy
     client: httpx.AsyncClient = app.state.httpx_client
 
-    embedded_query = await ollama_proxy.embed(request.text)
-
-    # Query the root datastore
-    documents_response = await client.post(
-        datastore.QUERY_ROOT_URL,
-        json=datastore.RootQueryRequest(
-            query_embedding=embedded_query[0]
-        ).model_dump()
-    )
-    if documents_response.status_code != status.HTTP_200_OK:
-        return {"message": {"content": "No relevant documents found", "type": "error"}}
-    
-    root_documents = [
-        datastore.RootQueryResult(**doc) for doc in documents_response.json()
-    ]
-    document_query_request = datastore.DocumentQueryRequest(
-        document_uuids=[doc.uuid for doc in root_documents],
-        query_embedding=embedded_query[0]
-    )
-
-    # Query each of the retrieved documents to get the relevant chunks
-    chunks_text_response = await client.post(
-        datastore.QUERY_DOCUMENT_URL,
-        json=document_query_request.model_dump()
-    )
-    if chunks_text_response.status_code != status.HTTP_200_OK:
+    chunk_texts = await query_lexical(
+        client, request.text, None, chunk_count(datastore.get_root_top_k()))
+    if chunk_texts is None:
+        chunk_texts = await query_vector(client, ollama_proxy, request.text)
+    if chunk_texts is None:
         return {
             "message": {
                 "content": "No relevant documents found", 
@@ -272,12 +486,6 @@ async def query(request: api_models.QueryRequest):
             }
         }
     
-    # The chunks for each document retrieved from the datastore. Right
-    # now there is no relation between the chunk and the file to which it 
-    # belongs
-    chunk_texts = [
-        datastore.DocumentChunk(**chunk) for chunk in chunks_text_response.json()]
-    
     text_chunks = [doc_info.text for doc_info in chunk_texts]
     reranked_chunk_texts = await ollama_proxy.filter_out_irrelevant_chunks(
         request.text, 
@@ -300,6 +508,56 @@ async def query(request: api_models.QueryRequest):
         media_type="application/x-ndjson"
     )
 
+async def query_vector(
+    client: httpx.AsyncClient,
+    ollama_proxy: OllamaProxy,
+    text: str
+) -> Optional[list[datastore.DocumentChunk]]:
+    """
+    Retrieves the chunks relevant to the given text by first querying the
+    root datastore for the relevant documents, then the chunks of these
+    documents. Returns None if the datastore fails.
+    """
+    with metrics.stage("query_embed"):
+        embedded_query = await ollama_proxy.embed(text)
+
+    # Query the root index of every shard, a shard that fails only loses
+    # its documents
+    root_top_k = datastore.get_root_top_k()
+    root_request = datastore.RootQueryRequest(
+        query_embedding=datastore.to_wire_embedding(embedded_query[0]),
+        min_score=datastore.get_min_score(),
+        top_k=root_top_k
+    ).model_dump()
+    with metrics.stage("root_search"):
+        documents_responses = await gather_responses([
+            client.post(url, json=root_request)
+            for url in all_read_shard_urls(datastore.QUERY_ROOT_PATH)
+        ])
+    if not any(documents_responses):
+        return None
+    
+    # The top-k of each shard are merged into the overall top-k
+    root_documents = heapq.nlargest(
+        root_top_k,
+        (
+            datastore.RootQueryResult(**doc)
+            for response in documents_responses if response is not None
+            for doc in response.json()
+        ),
+        key=lambda doc: doc.score
+    )
+
+    # Query each of the retrieved documents to get the relevant chunks.
+    # Right now there is no relation between the chunk and the file to
+    # which it belongs
+    return await query_documents(
+        client,
+        [doc.uuid for doc in root_documents],
+        embedded_query[0],
+        text
+    )
+
 @app.post("/query_document")
 async def query_document(request: api_models.QueryDocumentRequest):
     """
@@ -313,26 +571,34 @@ async def query_document(request: api_models.QueryDocumentRequest):
     ollama_proxy: OllamaProxy = app.state.ollama_proxy
     client: httpx.AsyncClient = app.state.httpx_client
 
-    query_embedding = await ollama_proxy.embed(request.query_str)
-    document_query_request = datastore.DocumentQueryRequest(
-        document_uuids=[request.document_uuid],
-        query_embedding=query_embedding[0]
-    )
-    document_query_response = await client.post(
-        datastore.QUERY_DOCUMENT_URL,
-        json=document_query_request.model_dump()
-    )
+    chunk_texts = await query_lexical(
+        client, request.query_str, [request.document_uuid], chunk_count(1))
+    if chunk_texts is None:
+        with metrics.stage("query_embed"):
+            query_embedding = await ollama_proxy.embed(request.query_str)
+        with metrics.stage("chunk_search"):
+            document_query_response = await read_shard(
+                client,
+                "POST",
+                app.state.shards.shard_for(request.document_uuid),
+                datastore.QUERY_DOCUMENT_PATH,
+                json=document_query_request(
+                    [request.document_uuid],
+                    query_embedding[0],
+                    request.query_str
+                ).model_dump()
+            )
 
-    if document_query_response.status_code != status.HTTP_200_OK:
-        return {
-            "message": {
-                "content": "No relevant documents found", 
-                "type": "error"
+        if document_query_response.status_code != status.HTTP_200_OK:
+            return {
+                "message": {
+                    "content": "No relevant documents found", 
+                    "type": "error"
+                }
             }
-        }
-    
-    chunk_texts = [
-        datastore.DocumentChunk(**chunk) for chunk in document_query_response.json()]
+        
+        chunk_texts = [
+            datastore.DocumentChunk(**chunk) for chunk in document_query_response.json()]
     
     text_chunks = [doc_info.text for doc_info in chunk_texts]
     reranked_chunk_texts = await ollama_proxy.filter_out_irrelevant_chunks(
@@ -365,10 +631,11 @@ async def delete_all():
     """
     client: httpx.AsyncClient = app.state.httpx_client
 
-    delete_all_response = await client.delete(
-        datastore.DELETE_ALL_DOCUMENTS_URL
-    )
-    if not delete_all_response or delete_all_response.status_code != status.HTTP_200_OK:
+    delete_all_responses = await gather_responses([
+        client.delete(url)
+        for url in all_shard_urls(datastore.DELETE_ALL_DOCUMENTS_PATH)
+    ])
+    if not all(delete_all_responses):
         return api_models.DeleteDocumentResponse(
             is_success=False, 
             error_message="Datastore failed to delete all documents"
@@ -388,7 +655,7 @@ async def delete_document(document_uuid: str):
     client: httpx.AsyncClient = app.state.httpx_client
 
     delete_document_response = await client.delete(
-        datastore.DELETE_DOCUMENT_URL,
+        shard_url(document_uuid, datastore.DELETE_DOCUMENT_PATH),
         params={"document_uuid": document_uuid}
     )
 
@@ -425,25 +692,86 @@ async def delete_document(document_uuid: str):
     return api_models.DeleteDocumentResponse(is_success=True)
 
 
-@app.get("/document_info", response_model=datastore.DocumentInfoResponse)
-async def available_documents(document_uuid: Optional[str] = None):
+@app.get(
+    "/document_info",
+    response_model=datastore.DocumentInfoResponse,
+    response_model_exclude_none=True
+)
+async def available_documents(
+    document_uuid: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    filename_prefix: Optional[str] = None,
+    filename_contains: Optional[str] = None,
+    count_only: bool = False
+):
     """
     Returns information about the documents in the datastore. If a document
     UUID is provided, the information for that specific document is returned. 
-    Otherwise, the information for all documents is returned.
+    Otherwise, the information for all documents is returned. The listing
+    parameters are passed through to the datastore, see its /document_info.
     """
     client: httpx.AsyncClient = app.state.httpx_client
 
-    documents_info_response = await client.get(
-        datastore.DOCUMENT_INFO_URL,
-        params={"document_uuid": document_uuid} if document_uuid else None
+    params = {
+        "document_uuid": document_uuid,
+        "limit": limit,
+        "after": after,
+        "fields": fields,
+        "filename_prefix": filename_prefix,
+        "filename_contains": filename_contains,
+        "count_only": count_only or None
+    }
+    params = {key: value for key, value in params.items() if value}
+    requests = (
+        [read_shard(
+            client,
+            "GET",
+            app.state.shards.shard_for(document_uuid),
+            datastore.DOCUMENT_INFO_PATH,
+            params=params
+        )]
+        if document_uuid
+        else [
+            client.get(url, params=params)
+            for url in all_read_shard_urls(datastore.DOCUMENT_INFO_PATH)
+        ]
     )
+    documents_info_responses = await gather_responses(requests)
 
-    if documents_info_response.status_code != status.HTTP_200_OK:
+    if not all(documents_info_responses):
         return datastore.DocumentInfoResponse(
             document_count=0, 
             documents_info=[]
         )
     
-    response = datastore.DocumentInfoResponse(**documents_info_response.json())
-    return response
+    responses = [
+        datastore.DocumentInfoResponse(**response.json())
+        for response in documents_info_responses
+    ]
+    if len(responses) == 1:
+        return responses[0]
+    if count_only:
+        return datastore.DocumentInfoResponse(
+            document_count=sum(response.document_count for response in responses),
+            documents_info=[]
+        )
+    # Every shard lists its documents ordered by UUID from the same cursor,
+    # so the page is the first ones of the merged lists
+    documents_info = list(heapq.merge(
+        *(response.documents_info for response in responses),
+        key=lambda document_info: document_info.document_uuid
+    ))
+    next_cursor = None
+    if limit is not None and (
+        len(documents_info) > limit
+        or any(response.next_cursor for response in responses)
+    ):
+        documents_info = documents_info[:limit]
+        next_cursor = documents_info[-1].document_uuid if documents_info else None
+    return datastore.DocumentInfoResponse(
+        document_count=len(documents_info),
+        documents_info=documents_info,
+        next_cursor=next_cursor
+    )
@@ -0,0 +1,75 @@
+"""
+Prometheus metrics of the backend, served by /metrics: the count and
+latency of the requests of each endpoint, and the latency of the stages of
+the queries and of the document additions.
+"""
+import time
+
+from fastapi import FastAPI, Request
+from prometheus_client import Counter, Histogram
+
+
+# Latency buckets in seconds, from the datastore searches to the model
+# calls of the summarization of long documents
+BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 120.0, 300.0, 600.0
+)
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Number of HTTP requests, by endpoint and status code.",
+    ["method", "endpoint", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the HTTP requests, by endpoint. Streamed responses are "
+    "timed until their first byte.",
+    ["method", "endpoint"],
+    buckets=BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds",
+    "Latency of the stages of the requests: query_embed, root_search, "
+    "chunk_search, lexical_search, rerank (each call), chat_ttft, chat, "
+    "conversion, document_embed, summarization and datastore_add.",
+    ["stage"],
+    buckets=BUCKETS
+)
+
+
+def stage(name: str):
+    """
+    Returns a context manager timing the given stage.
+    """
+    return STAGE_DURATION.labels(name).time()
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """
+    Records a duration of the given stage, for stages that do not fit in a
+    single block such as the time to the first token of a stream.
+    """
+    STAGE_DURATION.labels(name).observe(seconds)
+
+
+def instrument(app: FastAPI) -> None:
+    """
+    Counts and times every request of the given app by endpoint. The
+    endpoint is the path template of the route, so that path parameters
+    do not create a time series each.
+    """
+    @app.middleware("http")
+    async def observe_request(request: Request, call_next):
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            REQUESTS.labels(request.method, endpoint, str(status_code)).inc()
+            REQUEST_DURATION.labels(request.method, endpoint).observe(
+                time.perf_counter() - start)
@@ -1,5 +1,6 @@
 import json
 import asyncio
+import time
 from typing import AsyncGenerator
 from itertools import batched
 from ollama import AsyncClient
@@ -7,6 +8,7 @@ from ollama import AsyncClient
 from . import utils
 from . import prompts
 import api_models
+import metrics
 
 
 class OllamaProxy:
@@ -135,15 +137,22 @@ class OllamaProxy:
                 "content": utils.format_query(context, user_input)
             }
         ]
+        start = time.perf_counter()
         response = await self.client.chat(
             model=self.chat_model_name,
             messages=_query_with_context, 
             stream = True,
         )
 
-        # Yield the response as a stream of json objects
+        # Yield the response as a stream of json objects, timing the first
+        # token and the whole answer
+        first_chunk = True
         async for chunk in response:
+            if first_chunk:
+                metrics.observe_stage("chat_ttft", time.perf_counter() - start)
+                first_chunk = False
             yield json.dumps(chunk) + '\n'
+        metrics.observe_stage("chat", time.perf_counter() - start)
 
     async def summarize(
         self, 
@@ -225,10 +234,11 @@ class OllamaProxy:
                     )}
             ]
 
-            rerank_response = await self.client.chat(
-                model=self.instruct_model_name,
-                messages=_rerank_task,
-            )
+            with metrics.stage("rerank"):
+                rerank_response = await self.client.chat(
+                    model=self.instruct_model_name,
+                    messages=_rerank_task,
+                )
 
             is_relevant: bool = "yes" in rerank_response["message"]["content"]
             if is_relevant:
@@ -2,58 +2,211 @@
 Objects for interacting with the datastore service.
 """
 
+import base64
+import os
+import re
+from typing import Literal, Optional
+
+import numpy as np
 from pydantic import BaseModel
 
 
 DATASTORE_BASE_URL = "http://datastore:8000"
-HAS_DOCUMENT_URL = f"{DATASTORE_BASE_URL}/has_document"
-HAS_DOCUMENT_UUID_URL = f"{DATASTORE_BASE_URL}/has_document_uuid"
-ADD_DOCUMENT_URL = f"{DATASTORE_BASE_URL}/add_document"
-DELETE_ALL_DOCUMENTS_URL = f"{DATASTORE_BASE_URL}/delete_all"
-DELETE_DOCUMENT_URL = f"{DATASTORE_BASE_URL}/delete_document"
-DOCUMENT_INFO_URL = f"{DATASTORE_BASE_URL}/document_info"
-QUERY_ROOT_URL = f"{DATASTORE_BASE_URL}/query_root"
-QUERY_DOCUMENT_URL = f"{DATASTORE_BASE_URL}/query_document"
+# Paths of the datastore endpoints, relative to the base URL of a shard
+HAS_DOCUMENT_PATH = "/has_document"
+HAS_DOCUMENT_UUID_PATH = "/has_document_uuid"
+ADD_DOCUMENT_PATH = "/add_document"
+EXPORT_DOCUMENT_PATH = "/export_document"
+DELETE_ALL_DOCUMENTS_PATH = "/delete_all"
+DELETE_DOCUMENT_PATH = "/delete_document"
+DOCUMENT_INFO_PATH = "/document_info"
+QUERY_ROOT_PATH = "/query_root"
+QUERY_DOCUMENT_PATH = "/query_document"
+QUERY_LEXICAL_PATH = "/query_lexical"
+
+HEALTH_PATH = "/health"
+
+
+def _get_shards() -> list[list[str]]:
+    shards = os.getenv("DATASTORE_SHARDS", DATASTORE_BASE_URL)
+    return [
+        [url.strip().rstrip("/") for url in shard.split("|") if url.strip()]
+        for shard in shards.split(",") if shard.strip()
+    ]
+
+def get_shard_urls() -> list[str]:
+    """
+    Returns the base URLs of the datastore shards, a comma-separated list
+    in DATASTORE_SHARDS, the single datastore service by default. The
+    documents are spread over the shards by UUID, see shards.HashRing.
+    Each shard may list its read replicas after its leader, separated by
+    "|", the leader receives the writes.
+    """
+    return [shard[0] for shard in _get_shards()]
+
+def get_shard_replicas() -> dict[str, list[str]]:
+    """
+    Returns the base URLs of the read replicas of each shard, keyed by the
+    base URL of its leader, see get_shard_urls.
+    """
+    return {shard[0]: shard[1:] for shard in _get_shards()}
+
+def get_replica_health_interval() -> float:
+    """
+    Returns the interval in seconds between two health checks of the read
+    replicas.
+    """
+    return float(os.getenv("REPLICA_HEALTH_INTERVAL", 5))
+
+def get_min_score() -> Optional[float]:
+    """
+    Returns the minimum cosine similarity a document or chunk must have
+    with the query to be retrieved, None if no threshold is set.
+    """
+    min_score = os.getenv("RETRIEVAL_MIN_SCORE")
+    return float(min_score) if min_score else None
+
+def get_binary_embeddings() -> bool:
+    """
+    Returns whether the embeddings are sent to the datastore in the binary
+    format instead of JSON lists of floats.
+    """
+    return os.getenv("DATASTORE_BINARY_EMBEDDINGS", "true").lower() in ("1", "true", "yes")
+
+def get_root_top_k() -> int:
+    """
+    Returns the number of documents retrieved from the root index.
+    """
+    return int(os.getenv("RETRIEVAL_ROOT_TOP_K", 5))
+
+def get_chunk_top_k() -> int:
+    """
+    Returns the number of candidate chunks searched in each document.
+    """
+    return int(os.getenv("RETRIEVAL_CHUNK_TOP_K", 5))
 
-HEALTH_URL = f"{DATASTORE_BASE_URL}/health"
+def get_merge_mode() -> str:
+    """
+    Returns how the chunks of the documents are selected: "per_document"
+    keeps the best chunks of each document, "global" only the best ones
+    across all the documents.
+    """
+    return os.getenv("RETRIEVAL_MERGE", "per_document")
+
+def get_chunk_limit() -> int:
+    """
+    Returns the number of chunks retrieved overall in the "global" merge
+    mode.
+    """
+    return int(os.getenv("RETRIEVAL_CHUNK_LIMIT", 10))
+
+def get_retrieval_mode() -> str:
+    """
+    Returns how the chunks of the documents are retrieved: "vector" for
+    the embedding search only, "hybrid" to fuse it with a full-text search.
+    """
+    return os.getenv("RETRIEVAL_MODE", "vector")
+
+def get_lexical_fast_path() -> bool:
+    """
+    Returns whether queries that look like identifiers or exact phrases
+    are answered with a full-text search only, without embedding them.
+    """
+    return os.getenv("RETRIEVAL_LEXICAL_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+# A single token made of word characters and separators, that is an
+# identifier if it also has a digit, an inner separator or an inner capital
+# letter
+_IDENTIFIER_RE = re.compile(r"^[\w.\-/:#]+$")
+_IDENTIFIER_HINT_RE = re.compile(r"\d|\w[_.\-/:#]\w|[a-z][A-Z]")
+
+def lexical_query(text: str) -> Optional[str]:
+    """
+    Returns the phrase to search for if the given query is an exact phrase,
+    written between double quotes, or looks like an identifier (error code,
+    function name, version number...), None otherwise. Such queries are
+    better served by a full-text search than by semantic similarity.
+    """
+    text = text.strip()
+    if len(text) > 2 and text.startswith('"') and text.endswith('"'):
+        return text[1:-1].strip() or None
+    if _IDENTIFIER_RE.match(text) and _IDENTIFIER_HINT_RE.search(text):
+        return text
+    return None
+
+def encode_embeddings(embeddings: list[list[float]]) -> str:
+    """
+    Encodes the given embeddings in the binary format understood by the
+    datastore: the base64 string of the row-major little-endian float32 
+    values.
+    """
+    return base64.b64encode(
+        np.asarray(embeddings, dtype="<f4").tobytes()
+    ).decode("ascii")
+
+def to_wire_embedding(embedding: list[float]) -> list[float] | str:
+    """
+    Returns the given embedding in the format to send to the datastore.
+    """
+    return encode_embeddings([embedding]) if get_binary_embeddings() else embedding
 
 class DocumentChunk(BaseModel):
     text: str
     page_number: int
+    score: float = 0.0
+    # The scale of the score, see the datastore DocumentChunk
+    score_type: Literal["cosine", "bm25", "rrf"] = "cosine"
 
 class RootQueryResult(BaseModel):
     uuid: str
     summary: str
+    score: float = 0.0
 
 class RootQueryRequest(BaseModel):
-    query_embedding: list[float]
+    query_embedding: list[float] | str
+    min_score: Optional[float] = None
+    top_k: int = 5
 
 class DocumentQueryRequest(BaseModel):
     document_uuids: list[str]
-    query_embedding: list[float]
+    query_embedding: list[float] | str
+    min_score: Optional[float] = None
+    top_k: int = 5
+    merge: Literal["per_document", "global"] = "per_document"
+    limit: Optional[int] = None
+    mode: Literal["vector", "hybrid"] = "vector"
+    query_text: Optional[str] = None
+
+class LexicalQueryRequest(BaseModel):
+    query_text: str
+    document_uuids: Optional[list[str]] = None
+    top_k: int = 5
+    phrase: bool = False
 
 class AddDocumentChunk(BaseModel):
     text: str
     page_number: int
-    embedding: list[float]
+    embedding: Optional[list[float]] = None
 
 class AddDocumentRequest(BaseModel):
     document_uuid: str
     document_hash_str: str
     document_filename: str
-    document_embedding: list[float]
+    document_embedding: list[float] | str
     document_summary: str
     document_chunks: list[AddDocumentChunk]
+    chunks_embeddings: Optional[str] = None
 
 class DocumentInfo(BaseModel):
     document_uuid: str
-    document_hash_str: str
-    document_filename: str
-    document_summary: str
+    document_hash_str: Optional[str] = None
+    document_filename: Optional[str] = None
+    document_summary: Optional[str] = None
 
 class DocumentInfoResponse(BaseModel):
     document_count: int
     documents_info: list[DocumentInfo]
+    next_cursor: Optional[str] = None
 
 class HasDocumentResponse(BaseModel):
     has_document: bool
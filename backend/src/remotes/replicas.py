@@ -0,0 +1,104 @@
+"""
+Routing of the datastore reads to the read replicas of the shards.
+"""
+
+import asyncio
+import itertools
+import sys
+
+import httpx
+
+
+class ReplicaSet:
+    """
+    Tracks the health of the read replicas of the datastore shards and
+    spreads the reads of each shard over its healthy replicas in turn. A
+    shard without a healthy replica is read from its leader. Replicas are
+    unhealthy until their first health check, and while they catch up
+    with their leader.
+    """
+
+    def __init__(self, replicas: dict[str, list[str]]) -> None:
+        """
+        Initializes the ReplicaSet object with the given parameters.
+
+        Args:
+        - replicas (dict[str, list[str]]): The base URLs of the replicas of
+            each shard, keyed by the base URL of its leader.
+        """
+        self.replicas = {
+            leader: list(dict.fromkeys(urls))
+            for leader, urls in replicas.items()
+        }
+        self._healthy: dict[str, list[str]] = {
+            leader: [] for leader in self.replicas}
+        self._turns = {leader: itertools.count() for leader in self.replicas}
+
+    def read_url(self, leader: str) -> str:
+        """
+        Returns the base URL to send the next read of the given shard to.
+
+        Args:
+        - leader (str): The base URL of the shard leader.
+
+        Returns:
+        - str: The base URL of a healthy replica of the shard, or of its
+            leader if there is none.
+        """
+        healthy = self._healthy.get(leader)
+        if not healthy:
+            return leader
+        return healthy[next(self._turns[leader]) % len(healthy)]
+
+    async def _is_healthy(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        health_path: str
+    ) -> bool:
+        try:
+            response = await client.get(f"{url}{health_path}")
+            return (
+                response.status_code == 200
+                and response.json().get("status") == "healthy"
+            )
+        except Exception as e:
+            print(f"Datastore replica {url} is unreachable: {e}", file=sys.stderr)
+            return False
+
+    async def check_health(
+        self,
+        client: httpx.AsyncClient,
+        health_path: str
+    ) -> None:
+        """
+        Checks the health of every replica concurrently and only routes
+        the reads to the healthy ones.
+        """
+        urls = [
+            (leader, url)
+            for leader, replicas in self.replicas.items()
+            for url in replicas
+        ]
+        results = await asyncio.gather(*(
+            self._is_healthy(client, url, health_path) for _, url in urls
+        ))
+        healthy: dict[str, list[str]] = {leader: [] for leader in self.replicas}
+        for (leader, url), is_healthy in zip(urls, results):
+            if is_healthy:
+                healthy[leader].append(url)
+        self._healthy = healthy
+
+    async def monitor(
+        self,
+        client: httpx.AsyncClient,
+        health_path: str,
+        interval: float
+    ) -> None:
+        """
+        Checks the health of the replicas every interval seconds, until
+        cancelled.
+        """
+        while True:
+            await self.check_health(client, health_path)
+            await asyncio.sleep(interval)
@@ -0,0 +1,62 @@
+"""
+Consistent hashing of the documents over the datastore shards.
+"""
+
+import bisect
+import hashlib
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Assigns each document UUID to a datastore shard with consistent
+    hashing. Every shard owns many points of a 64-bit ring and a UUID
+    belongs to the shard owning the first point after its hash, so adding
+    a shard only moves about 1/n of the documents, all of them to the new
+    shard. Shards are identified by their base URL.
+    """
+
+    def __init__(self, shards: list[str], points_per_shard: int = 128) -> None:
+        """
+        Initializes the HashRing object with the given parameters.
+
+        Args:
+        - shards (list[str]): The base URLs of the datastore shards.
+        - points_per_shard (int): The number of points of each shard on the
+            ring, more points spread the documents more evenly.
+        """
+        self.shards = list(dict.fromkeys(shards))
+        if not self.shards:
+            raise ValueError("At least one datastore shard is needed!")
+        points = sorted(
+            (_hash(f"{shard}#{i}"), shard)
+            for shard in self.shards
+            for i in range(points_per_shard)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, document_uuid: str) -> str:
+        """
+        Returns the base URL of the shard owning the given document.
+        """
+        position = bisect.bisect(self._points, _hash(document_uuid))
+        return self._owners[position % len(self._points)]
+
+    def group(self, document_uuids: list[str]) -> dict[str, list[str]]:
+        """
+        Groups the given documents by owning shard, keeping their order.
+
+        Returns:
+        - dict[str, list[str]]: The UUIDs owned by each shard, keyed by its
+            base URL. Shards owning none of them are omitted.
+        """
+        groups: dict[str, list[str]] = {}
+        for document_uuid in document_uuids:
+            groups.setdefault(self.shard_for(document_uuid), []).append(
+                document_uuid)
+        return groups
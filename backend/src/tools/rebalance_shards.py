@@ -0,0 +1,131 @@
+"""
+Moves the documents stored on the wrong datastore shard to the shard that
+owns them, after shards were added to (or removed from) DATASTORE_SHARDS.
+
+Documents are exported from their current shard with their embeddings, so
+nothing is embedded again, added to their owner then deleted from the
+current shard. Uploads should be stopped while it runs, and the backend
+restarted with the new DATASTORE_SHARDS once it is done. From the src
+directory of the backend:
+
+    python -m tools.rebalance_shards --shards http://datastore:8000,http://datastore_2:8000 [--dry-run]
+
+The shards listed must include the ones that currently store documents.
+Moving a document is idempotent, so the tool can be run again after an
+interruption.
+"""
+import argparse
+
+import httpx
+
+import remotes.datastore as datastore
+from remotes.shards import HashRing
+
+
+def move_document(
+    client: httpx.Client,
+    document_uuid: str,
+    source: str,
+    target: str
+) -> None:
+    """
+    Moves the document with the given UUID from the source shard to the
+    target shard. The document is only deleted from the source once the
+    target stores it.
+
+    Args:
+    - client (httpx.Client): The HTTP client.
+    - document_uuid (str): The UUID of the document.
+    - source (str): The base URL of the shard storing the document.
+    - target (str): The base URL of the shard owning the document.
+    """
+    params = {"document_uuid": document_uuid}
+    has_document = datastore.HasDocumentResponse(**client.get(
+        f"{target}{datastore.HAS_DOCUMENT_UUID_PATH}", params=params
+    ).raise_for_status().json())
+    if not has_document.has_document:
+        document = client.get(
+            f"{source}{datastore.EXPORT_DOCUMENT_PATH}", params=params
+        ).raise_for_status().json()
+        client.post(
+            f"{target}{datastore.ADD_DOCUMENT_PATH}", json=document
+        ).raise_for_status()
+    deleted = datastore.DocumentDeleteResponse(**client.delete(
+        f"{source}{datastore.DELETE_DOCUMENT_PATH}", params=params
+    ).raise_for_status().json())
+    if not deleted.is_success:
+        raise RuntimeError(
+            f"Could not delete {document_uuid} from {source}: "
+            f"{deleted.error_message}")
+
+
+def rebalance(
+    shards: list[str],
+    page_size: int = 100,
+    dry_run: bool = False
+) -> tuple[int, int]:
+    """
+    Moves every document not stored on the shard owning it, according to
+    the consistent hashing of the given shards.
+
+    Args:
+    - shards (list[str]): The base URLs of all the datastore shards.
+    - page_size (int): The number of documents listed per request.
+    - dry_run (bool): Whether to only count the documents to move.
+
+    Returns:
+    - tuple[int, int]: The number of documents checked and moved.
+    """
+    ring = HashRing(shards)
+    checked = moved = 0
+    with httpx.Client(timeout=None) as client:
+        for shard in ring.shards:
+            params = {"limit": page_size, "fields": "document_filename"}
+            while True:
+                page = datastore.DocumentInfoResponse(**client.get(
+                    f"{shard}{datastore.DOCUMENT_INFO_PATH}", params=params
+                ).raise_for_status().json())
+                for document_info in page.documents_info:
+                    checked += 1
+                    owner = ring.shard_for(document_info.document_uuid)
+                    if owner == shard:
+                        continue
+                    if not dry_run:
+                        move_document(
+                            client, document_info.document_uuid, shard, owner)
+                    moved += 1
+                # The listing is ordered by UUID, moving documents already
+                # listed does not shift the next page
+                if page.next_cursor is None:
+                    break
+                params["after"] = page.next_cursor
+            print(f"Checked {shard}, {moved}/{checked} documents to move so far")
+    return checked, moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Moves the documents to the datastore shard owning them."
+    )
+    parser.add_argument(
+        "--shards",
+        default=",".join(datastore.get_shard_urls()),
+        help="Comma-separated base URLs of all the shards, DATASTORE_SHARDS "
+             "by default."
+    )
+    parser.add_argument("--page-size", default=100, type=int)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the documents to move."
+    )
+    args = parser.parse_args()
+
+    shards = [shard.strip().rstrip("/") for shard in args.shards.split(",") if shard.strip()]
+    checked, moved = rebalance(shards, args.page_size, args.dry_run)
+    action = "To move" if args.dry_run else "Moved"
+    print(f"{action}: {moved} of {checked} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,158 @@
-from pydantic import BaseModel
+import base64
+from typing import Literal, Optional
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+
+# Embeddings can be sent either as JSON lists of floats or, more compactly,
+# as a base64 string of little-endian float32 values. A string holding many
+# embeddings is the row-major concatenation of all of them.
+Embedding = list[float] | str
+Embeddings = list[list[float]] | str
+
+
+def decode_embeddings(
+    embeddings: Embeddings,
+    embedding_length: int
+) -> list[list[float]] | np.ndarray:
+    """
+    Decodes the given embeddings if they are in the binary format, without
+    copying them, otherwise returns them as they are.
+
+    Args:
+    - embeddings (Embeddings): The embeddings as lists or base64 string.
+    - embedding_length (int): The length of each embedding.
+
+    Returns:
+    - list[list[float]] | np.ndarray: The embeddings, one per row.
+    """
+    if not isinstance(embeddings, str):
+        return embeddings
+    data = base64.b64decode(embeddings, validate=True)
+    if len(data) % (4 * embedding_length) != 0:
+        raise ValueError(
+            f"Binary embeddings size is not a multiple of {embedding_length} float32")
+    return np.frombuffer(data, dtype="<f4").reshape(-1, embedding_length)
+
+def encode_embeddings(embeddings: np.ndarray) -> str:
+    """
+    Encodes the given embeddings in the binary format, the inverse of
+    decode_embeddings.
+    """
+    return base64.b64encode(
+        np.asarray(embeddings, dtype="<f4").tobytes()
+    ).decode("ascii")
+
+def decode_embedding(
+    embedding: Embedding,
+    embedding_length: int
+) -> list[float] | np.ndarray:
+    """
+    Same as decode_embeddings, for a single embedding.
+    """
+    if not isinstance(embedding, str):
+        return embedding
+    embeddings = decode_embeddings(embedding, embedding_length)
+    if len(embeddings) != 1:
+        raise ValueError("Expected a single binary embedding")
+    return embeddings[0]
+
 
 class DocumentChunk(BaseModel):
     text: str
     page_number: int
+    score: float = 0.0
+    # The scale of the score: the cosine similarity of a vector search, the
+    # BM25 relevance of a full-text search or the reciprocal rank fusion
+    # of both in the hybrid mode. Scores of different types do not compare.
+    score_type: Literal["cosine", "bm25", "rrf"] = "cosine"
 
 class RootQueryResult(BaseModel):
     uuid: str
     summary: str
+    score: float = 0.0
 
 class RootQueryRequest(BaseModel):
-    query_embedding: list[float]
+    query_embedding: Embedding
+    min_score: Optional[float] = None
+    top_k: int = Field(5, ge=1)
 
 class DocumentQueryRequest(BaseModel):
     document_uuids: list[str]
-    query_embedding: list[float]
+    query_embedding: Embedding
+    min_score: Optional[float] = None
+    # Number of candidate chunks searched in each document
+    top_k: int = Field(5, ge=1)
+    # "global" returns the best limit chunks across all the documents
+    # instead of top_k chunks per document
+    merge: Literal["per_document", "global"] = "per_document"
+    limit: Optional[int] = Field(None, ge=1)
+    # "hybrid" fuses the vector search with a full-text search of query_text
+    mode: Literal["vector", "hybrid"] = "vector"
+    query_text: Optional[str] = None
+
+class LexicalQueryRequest(BaseModel):
+    query_text: str
+    # All the documents are searched if not given
+    document_uuids: Optional[list[str]] = None
+    top_k: int = Field(5, ge=1)
+    phrase: bool = False
+
+class RootBatchQueryRequest(BaseModel):
+    query_embeddings: Embeddings
+    min_score: Optional[float] = None
+    top_k: int = Field(5, ge=1)
+
+class DocumentBatchQueryRequest(BaseModel):
+    document_uuids: list[str]
+    query_embeddings: Embeddings
+    min_score: Optional[float] = None
+    top_k: int = Field(5, ge=1)
 
 class AddDocumentChunk(BaseModel):
     text: str
     page_number: int
-    embedding: list[float]
+    # Omitted when the embeddings are sent in AddDocumentRequest.chunks_embeddings
+    embedding: Optional[list[float]] = None
 
 class AddDocumentRequest(BaseModel):
     document_uuid: str
     document_hash_str: str
     document_filename: str
-    document_embedding: list[float]
+    document_embedding: Embedding
     document_summary: str
     document_chunks: list[AddDocumentChunk]
+    # Binary embeddings of all the chunks, in the same order
+    chunks_embeddings: Optional[str] = None
+
+class Change(BaseModel):
+    # Sequence number of the change in the leader change log
+    seq: int
+    operation: Literal["add", "delete", "clear"]
+    # The document added or deleted, followers fetch an added document
+    # from the leader /export_document
+    document_uuid: Optional[str] = None
+
+class ChangesResponse(BaseModel):
+    changes: list[Change]
+    # Sequence number of the oldest change kept, a follower that did not
+    # apply the changes before it must resynchronize
+    first_seq: int
+    last_seq: int
 
 class DocumentInfo(BaseModel):
     document_uuid: str
-    document_hash_str: str
-    document_filename: str
-    document_summary: str
+    # None when the field is not requested, see /document_info
+    document_hash_str: Optional[str] = None
+    document_filename: Optional[str] = None
+    document_summary: Optional[str] = None
 
 class DocumentInfoResponse(BaseModel):
     document_count: int
     documents_info: list[DocumentInfo]
+    # UUID to pass as `after` to get the next page, None on the last page
+    next_cursor: Optional[str] = None
 
 class HasDocumentResponse(BaseModel):
     has_document: bool
@@ -45,6 +161,28 @@ class HealthCheckResponse(BaseModel):
     up_time: float
     status: str
 
+class CacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    entries: int
+    size_bytes: int
+    max_size_bytes: int
+
+class StoreManifest(BaseModel):
+    # Version of the manifest format, see storage.manifest
+    manifest_version: int
+    embedding_length: int
+    root_index_type: str
+    chunk_index_mode: str
+    encoding: str
+    chunk_store: str
+    # Version of the root metadata database schema, see migrations.py
+    metadata_schema_version: int
+    document_count: int
+    # Only set when the chunks are stored in the global chunk index
+    chunk_count: Optional[int] = None
+    updated_at: float
+
 class DocumentDeleteResponse(BaseModel):
     is_success: bool
     document_filename: str = ""
@@ -6,50 +6,372 @@ from typing import Optional
 import time
 import sys
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, Response, status
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 
 import api_models
-from storage import DataStore
+import metrics
+from storage import DataStore, replication
+from storage.utils import (
+    get_checkpoint_interval,
+    get_compaction_interval,
+    get_compaction_tombstone_ratio,
+    get_executor_workers,
+    get_leader_url,
+    get_replication_batch_size,
+    get_replication_poll_interval
+)
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+async def run_in_executor(func, *args):
+    """
+    Runs the given blocking function in the worker pool shared by all the
+    requests, created once in lifespan.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.executor, func, *args)
+
+
+async def checkpoint_periodically(datastore: DataStore, interval: float):
+    """
+    Periodically writes the in-memory indexes to disk in the background,
+    the changes in between are already persisted in the index logs.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_executor(datastore.checkpoint)
+        except Exception as e:
+            print(f"Error while checkpointing the indexes: {e}", file=sys.stderr)
+
+
+async def compact_periodically(
+    datastore: DataStore,
+    interval: float,
+    min_ratio: float
+):
+    """
+    Periodically removes the deleted documents from the indexes in the
+    background once they make up min_ratio of an index, deletions only
+    tombstone them. The root index is also promoted to its approximate
+    type there once it is large enough, rather than by the addition that
+    crosses the threshold.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_executor(datastore.promote_root)
+        except Exception as e:
+            print(f"Error while promoting the root index: {e}", file=sys.stderr)
+        try:
+            await run_in_executor(datastore.compact, min_ratio)
+        except Exception as e:
+            print(f"Error while compacting the indexes: {e}", file=sys.stderr)
+
+
+async def fetch_leader_document(
+    client: httpx.AsyncClient,
+    leader_url: str,
+    document_uuid: str
+) -> Optional[api_models.AddDocumentRequest]:
+    """
+    Returns the document with the given UUID as exported by the leader,
+    None if the leader deleted it since.
+    """
+    response = await client.get(
+        f"{leader_url}/export_document",
+        params={"document_uuid": document_uuid}
+    )
+    if response.status_code == status.HTTP_404_NOT_FOUND:
+        return None
+    response.raise_for_status()
+    return api_models.AddDocumentRequest.model_validate(response.json())
+
+
+async def resync_from_leader(
+    datastore: DataStore,
+    client: httpx.AsyncClient,
+    leader_url: str,
+    page_size: int
+) -> int:
+    """
+    Replaces the documents of a follower with a copy of the documents of
+    its leader, when the changes it missed are no longer in the leader
+    change log. Changes published during the copy are applied afterwards,
+    applying them twice is harmless.
+
+    Returns:
+    - int: The sequence number of the last change included in the copy.
+    """
+    response = await client.get(
+        f"{leader_url}/changes", params={"after": 0, "limit": 1})
+    response.raise_for_status()
+    last_seq = response.json()["last_seq"]
 
-    embeddings_length = 0
+    await run_in_executor(
+        datastore.apply_change,
+        api_models.Change(seq=last_seq, operation=replication.CLEAR)
+    )
+    after = None
+    while True:
+        # The UUID is always returned, the smallest other field is asked for
+        params = {"limit": page_size, "fields": "document_filename"}
+        if after is not None:
+            params["after"] = after
+        response = await client.get(
+            f"{leader_url}/document_info", params=params)
+        response.raise_for_status()
+        page = api_models.DocumentInfoResponse.model_validate(response.json())
+        for info in page.documents_info:
+            document = await fetch_leader_document(
+                client, leader_url, info.document_uuid)
+            # Deleted since the page was listed
+            if document is None:
+                continue
+            await run_in_executor(
+                datastore.apply_change,
+                api_models.Change(
+                    seq=last_seq,
+                    operation=replication.ADD,
+                    document_uuid=info.document_uuid
+                ),
+                document
+            )
+        if page.next_cursor is None:
+            return last_seq
+        after = page.next_cursor
+
+
+async def replicate_periodically(
+    datastore: DataStore,
+    leader_url: str,
+    interval: float,
+    batch_size: int
+):
+    """
+    Applies the change log of the leader to a follower in the background.
+    The follower polls the changes after the last one it applied, and
+    re-polls right away while it is behind. It reports itself healthy once
+    it caught up.
+    """
+    cursor = await run_in_executor(datastore.replication_cursor)
+    # A new follower copies the documents of its leader first, it may have
+    # stored documents before publishing its changes
+    needs_resync = cursor == 0
+    async with httpx.AsyncClient(timeout=30) as client:
+        while True:
+            full_batch = False
+            try:
+                response = await client.get(
+                    f"{leader_url}/changes",
+                    params={"after": cursor, "limit": batch_size}
+                )
+                response.raise_for_status()
+                changes = api_models.ChangesResponse.model_validate(
+                    response.json())
+                if cursor < changes.first_seq - 1 or cursor > changes.last_seq:
+                    # The missed changes were dropped from the log, or the
+                    # leader lost its log
+                    needs_resync = True
+                if needs_resync:
+                    print(
+                        f"Copying the leader documents, the follower is at "
+                        f"change {cursor} and the leader log holds changes "
+                        f"{changes.first_seq} to {changes.last_seq}",
+                        file=sys.stderr
+                    )
+                    app.state.replica_synced = False
+                    cursor = await resync_from_leader(
+                        datastore, client, leader_url, batch_size)
+                    needs_resync = False
+                    await run_in_executor(
+                        datastore.set_replication_cursor, cursor)
+                    continue
+                for change in changes.changes:
+                    # The log only has the UUID of an added document, a
+                    # document deleted since is skipped and its deletion
+                    # follows in the log
+                    document = None
+                    if (
+                        change.operation == replication.ADD
+                        and not await run_in_executor(
+                            datastore.has_document_uuid, change.document_uuid)
+                    ):
+                        document = await fetch_leader_document(
+                            client, leader_url, change.document_uuid)
+                    await run_in_executor(
+                        datastore.apply_change, change, document)
+                    cursor = change.seq
+                if changes.changes:
+                    await run_in_executor(
+                        datastore.set_replication_cursor, cursor)
+                app.state.replica_synced = cursor >= changes.last_seq
+                full_batch = len(changes.changes) == batch_size
+            except Exception as e:
+                print(f"Error while replicating the leader: {e}", file=sys.stderr)
+            if full_batch:
+                continue
+            await asyncio.sleep(interval)
+
+
+async def get_embedding_length(max_retries: Optional[int] = 5) -> int:
+    """
+    Retrieves the embedding length from the backend, retrying every 5s
+    until it responds.
+
+    Args:
+    - max_retries (Optional[int]): The number of attempts, None to retry
+        forever.
+
+    Returns:
+    - int: The embedding length of the backend embedding model.
+    """
     curr_retry = 0
-    max_retries = 5
-    # Initializing the datastore requires to know the embedding length
-    # which is retrieved from the backend
-    # If retrieval fails just crash the app
-    while curr_retry < max_retries:
+    while max_retries is None or curr_retry < max_retries:
         try:
             async with httpx.AsyncClient() as client:
                 response = await client.get("http://backend:8000/embedding_length")
-                embeddings_length = response.json()["embedding_length"]
-                break # break loop, response was successful
+                return response.json()["embedding_length"]
         except Exception as e:
             curr_retry += 1
             print(
                 f"[{curr_retry}] Error getting embedding length from backend"
                 f", retrying in 5s: {e}", file=sys.stderr)
             await asyncio.sleep(5)
-    
-    if embeddings_length == 0:
-        raise RuntimeError("Could not get embedding length from backend")
+    raise RuntimeError("Could not get embedding length from backend")
+
+
+async def validate_embedding_length(embedding_length: int):
+    """
+    Checks in the background that the backend embedding model still
+    produces embeddings of the length of the stored indexes. The datastore
+    reports itself unhealthy otherwise, since every query would fail.
+    """
+    backend_length = await get_embedding_length(max_retries=None)
+    if backend_length != embedding_length:
+        app.state.embedding_length_error = (
+            f"The backend embedding length {backend_length} does not match "
+            f"the stored indexes embedding length {embedding_length}")
+        print(app.state.embedding_length_error, file=sys.stderr)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+
+    app.state.embedding_length_error = None
+    # Once indexes are stored, their manifest records the embedding length
+    # so the datastore starts serving right away, without waiting for the
+    # backend which waits for its models
+    manifest = DataStore.read_manifest()
+    if manifest is not None:
+        embeddings_length = manifest.embedding_length
+    else:
+        # If retrieval fails just crash the app
+        embeddings_length = await get_embedding_length()
 
     app.state.datastore = DataStore(embeddings_length)
+    metrics_collector = metrics.register_datastore(app.state.datastore)
+    # Bounded pool running the blocking datastore calls, so that no thread
+    # is started per request
+    app.state.executor = ThreadPoolExecutor(
+        max_workers=get_executor_workers(),
+        thread_name_prefix="datastore"
+    )
+    checkpoint_task = asyncio.create_task(checkpoint_periodically(
+        app.state.datastore,
+        get_checkpoint_interval()
+    ))
+    compaction_task = asyncio.create_task(compact_periodically(
+        app.state.datastore,
+        get_compaction_interval(),
+        get_compaction_tombstone_ratio()
+    ))
+
+    # A follower reports itself unhealthy until it caught up with its
+    # leader, so that it does not serve stale reads
+    app.state.replica_synced = (
+        app.state.datastore.role != replication.FOLLOWER)
+    replication_task = None
+    if app.state.datastore.role == replication.FOLLOWER:
+        replication_task = asyncio.create_task(replicate_periodically(
+            app.state.datastore,
+            get_leader_url(),
+            get_replication_poll_interval(),
+            get_replication_batch_size()
+        ))
+
+    validation_task = None
+    if manifest is not None:
+        validation_task = asyncio.create_task(
+            validate_embedding_length(embeddings_length))
 
     app.state.startup_time = time.time()
     
     yield
 
+    if validation_task is not None:
+        validation_task.cancel()
+    if replication_task is not None:
+        replication_task.cancel()
+    checkpoint_task.cancel()
+    compaction_task.cancel()
+    app.state.executor.shutdown(wait=True)
+    REGISTRY.unregister(metrics_collector)
     app.state.datastore.close()
 
 
+def decode_embeddings(
+    embeddings: api_models.Embeddings,
+    embedding_length: int,
+    single: bool = False
+):
+    """
+    Decodes the request embeddings, see api_models.decode_embeddings, 
+    raising a 400 error if they are malformed.
+    """
+    try:
+        if single:
+            return api_models.decode_embedding(embeddings, embedding_length)
+        return api_models.decode_embeddings(embeddings, embedding_length)
+    except ValueError as e:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+def check_writable():
+    """
+    Raises a 403 error on a follower datastore, which only applies the
+    writes of its leader.
+    """
+    datastore: DataStore = app.state.datastore
+    if datastore.role == replication.FOLLOWER:
+        raise HTTPException(
+            status.HTTP_403_FORBIDDEN,
+            detail="Follower datastores are read-only, write to the leader"
+        )
+
+
+def check_found(result):
+    """
+    Returns the given query result, raising a 404 error if it is None:
+    a queried document is missing from this follower, which might not have
+    replicated it yet, so the backend retries the read on the leader.
+    """
+    if result is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    return result
+
+
 app = FastAPI(
     lifespan=lifespan,
     title="Datastore API",
 )
+metrics.instrument(app)
 
 @app.get("/health", response_model=api_models.HealthCheckResponse)
 async def health():
@@ -58,16 +380,71 @@ async def health():
     """
     return api_models.HealthCheckResponse(
         up_time=time.time() - app.state.startup_time,
-        status="healthy"
+        status=(
+            "healthy"
+            if app.state.embedding_length_error is None
+            and app.state.replica_synced
+            else "unhealthy"
+        )
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the metrics of the datastore in the Prometheus text format.
+    """
+    return Response(
+        await run_in_executor(generate_latest),
+        media_type=CONTENT_TYPE_LATEST
     )
 
+@app.get("/manifest", response_model=api_models.StoreManifest)
+async def store_manifest():
+    """
+    Returns the manifest of the stored indexes, with up-to-date counts.
+    """
+    datastore: DataStore = app.state.datastore
+    return await run_in_executor(datastore.manifest)
+
+@app.get("/changes", response_model=api_models.ChangesResponse)
+async def changes(
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """
+    Returns the changes of a leader datastore following the given sequence
+    number, polled by its followers.
+    """
+    datastore: DataStore = app.state.datastore
+    try:
+        return await run_in_executor(datastore.changes, after, limit)
+    except ValueError as e:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+@app.get("/cache_stats", response_model=api_models.CacheStatsResponse)
+async def cache_stats():
+    """
+    Returns the hit/miss counters and memory usage of the sub-index cache.
+    """
+    datastore: DataStore = app.state.datastore
+    return datastore.cache_stats()
+
 @app.get("/has_document_uuid")
 async def has_document_uuid(document_uuid: str):
     """
     Checks if a document with the given UUID exists in the datastore.
     """
     datastore: DataStore = app.state.datastore
-    return api_models.HasDocumentResponse(has_document=datastore.has_document_uuid(document_uuid))
+    # Answered from memory, the database is only checked when the Bloom
+    # filter cannot tell
+    has_document = datastore.membership.contains_uuid(document_uuid)
+    if has_document is None:
+        has_document = await run_in_executor(
+            datastore.has_document_uuid, document_uuid)
+    return api_models.HasDocumentResponse(has_document=has_document)
 
 @app.get("/has_document", response_model=api_models.HasDocumentResponse)
 async def has_document(document_hash: str):
@@ -75,7 +452,11 @@ async def has_document(document_hash: str):
     Checks if a document with the given hash exists in the datastore.
     """
     datastore: DataStore = app.state.datastore
-    return api_models.HasDocumentResponse(has_document=datastore.has_document(document_hash))
+    has_document = datastore.membership.contains_hash(document_hash)
+    if has_document is None:
+        has_document = await run_in_executor(
+            datastore.has_document, document_hash)
+    return api_models.HasDocumentResponse(has_document=has_document)
 
 @app.get("/has_document_uuid", response_model=api_models.HasDocumentResponse)
 async def has_document_uuid(document_uuid: str):
@@ -83,49 +464,92 @@ async def has_document_uuid(document_uuid: str):
     Checks if a document with the given UUID exists in the datastore.
     """
     datastore: DataStore = app.state.datastore
-    return api_models.HasDocumentResponse(has_document=datastore.has_document_uuid(document_uuid))
+    # Answered from memory, the database is only checked when the Bloom
+    # filter cannot tell
+    has_document = datastore.membership.contains_uuid(document_uuid)
+    if has_document is None:
+        has_document = await run_in_executor(
+            datastore.has_document_uuid, document_uuid)
+    return api_models.HasDocumentResponse(has_document=has_document)
 
 @app.post("/add_document")
 async def add_document(request: api_models.AddDocumentRequest):
     """
     Adds a document to the datastore.
     """
+    check_writable()
     datastore: DataStore = app.state.datastore
+    chunks_embeddings = None
+    if request.chunks_embeddings is not None:
+        chunks_embeddings = decode_embeddings(
+            request.chunks_embeddings, datastore.embedding_length)
     
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor() as pool:
-        add_document_args = [
-            request.document_uuid,
-            request.document_hash_str,
-            request.document_filename,
+    add_document_args = [
+        request.document_uuid,
+        request.document_hash_str,
+        request.document_filename,
+        decode_embeddings(
             request.document_embedding,
-            request.document_summary,
-            request.document_chunks
-        ]
-        try:
-            await loop.run_in_executor(
-                pool,
-                datastore.add_document,
-                *add_document_args
-            )
-        except ValueError as e:
-            raise HTTPException(
-                status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=str(e)
-            )
+            datastore.embedding_length,
+            single=True
+        ),
+        request.document_summary,
+        request.document_chunks,
+        chunks_embeddings
+    ]
+    try:
+        await run_in_executor(datastore.add_document, *add_document_args)
+    except ValueError as e:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@app.get(
+    "/export_document",
+    response_model=api_models.AddDocumentRequest,
+    response_model_exclude_none=True
+)
+async def export_document(document_uuid: str):
+    """
+    Returns the document with the given UUID as the /add_document request
+    that adds it, used to move documents between datastore shards.
+    """
+    datastore: DataStore = app.state.datastore
+    document = await run_in_executor(datastore.export_document, document_uuid)
+    if document is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    return document
 
 @app.delete("/delete_document", response_model=api_models.DocumentDeleteResponse)
 async def delete_document(document_uuid: str):
     """
     Deletes a document from the datastore.
     """
+    check_writable()
     datastore: DataStore = app.state.datastore
-    if not datastore.has_document_uuid(document_uuid):
+    # See has_document_uuid, a concurrent deletion can still remove the
+    # document first, delete_document then raises a ValueError
+    has_document = datastore.membership.contains_uuid(document_uuid)
+    if has_document is None:
+        has_document = await run_in_executor(
+            datastore.has_document_uuid, document_uuid)
+    if not has_document:
         return api_models.DocumentDeleteResponse(
             is_success=False, 
             error_message="Document not found"
         )
-    document_filename = datastore.delete_document(document_uuid)
+    try:
+        document_filename = await run_in_executor(
+            datastore.delete_document, document_uuid)
+    except ValueError as e:
+        return api_models.DocumentDeleteResponse(
+            is_success=False,
+            error_message=str(e)
+        )
     return api_models.DocumentDeleteResponse(
         is_success=True, 
         document_filename=document_filename
@@ -136,10 +560,15 @@ async def delete_all():
     """
     Deletes all documents from the datastore.
     """
+    check_writable()
     datastore: DataStore = app.state.datastore
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor() as pool:
-        await loop.run_in_executor(pool, datastore.clear)
+    try:
+        await run_in_executor(datastore.clear)
+    except ValueError as e:
+        return api_models.DocumentDeleteResponse(
+            is_success=False,
+            error_message=str(e)
+        )
     return api_models.DocumentDeleteResponse(is_success=True)
 
 @app.post("/query_root", response_model=list[api_models.RootQueryResult])
@@ -149,43 +578,164 @@ async def query_root(request: api_models.RootQueryRequest):
     """
     datastore: DataStore = app.state.datastore
 
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(
-            pool,
-            datastore.query_root,
-            request.query_embedding
-        )
+    return await run_in_executor(
+        datastore.query_root,
+        decode_embeddings(
+            request.query_embedding,
+            datastore.embedding_length,
+            single=True
+        ),
+        request.min_score,
+        request.top_k
+    )
     
 
 @app.post("/query_document", response_model=list[api_models.DocumentChunk])
 async def query_document(request: api_models.DocumentQueryRequest):
     """
     Queries the datastore with the given document UUIDs and embedding.
+    In the hybrid mode, the chunks are ranked by fusing the vector search
+    with a full-text search of the query text. In the global merge mode, 
+    the best chunks across all the documents are returned instead of a
+    fixed number of chunks per document.
     """
     datastore: DataStore = app.state.datastore
+    query_embedding = decode_embeddings(
+        request.query_embedding,
+        datastore.embedding_length,
+        single=True
+    )
 
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(
-            pool,
-            datastore.query_documents,
+    if request.mode == "hybrid":
+        if not request.query_text:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                detail="The hybrid mode requires the query text"
+            )
+        try:
+            return check_found(await run_in_executor(
+                datastore.query_documents_hybrid,
+                request.document_uuids,
+                query_embedding,
+                request.query_text,
+                request.min_score,
+                request.top_k,
+                request.limit
+            ))
+        except ValueError as e:
+            raise HTTPException(
+                status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+
+    if request.merge == "global":
+        return check_found(await run_in_executor(
+            datastore.query_documents_global,
             request.document_uuids,
-            request.query_embedding
+            query_embedding,
+            request.min_score,
+            request.top_k,
+            request.limit or request.top_k
+        ))
+
+    return check_found(await run_in_executor(
+        datastore.query_documents,
+        request.document_uuids,
+        query_embedding,
+        request.min_score,
+        request.top_k
+    ))
+
+@app.post("/query_lexical", response_model=list[api_models.DocumentChunk])
+async def query_lexical(request: api_models.LexicalQueryRequest):
+    """
+    Searches the chunks matching the query text with the BM25 full-text
+    index, no embedding is needed.
+    """
+    datastore: DataStore = app.state.datastore
+    try:
+        return check_found(await run_in_executor(
+            datastore.query_lexical,
+            request.query_text,
+            request.document_uuids,
+            request.top_k,
+            request.phrase
+        ))
+    except ValueError as e:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
         )
 
-@app.get("/document_info", response_model=api_models.DocumentInfoResponse)
-async def documents_info(document_uuid: Optional[str] = None):
+@app.post("/query_root_batch", response_model=list[list[api_models.RootQueryResult]])
+async def query_root_batch(request: api_models.RootBatchQueryRequest):
+    """
+    Queries the root index with all the given embeddings in a single search.
+    Returns the results of each query, in the same order as the embeddings.
+    """
+    datastore: DataStore = app.state.datastore
+
+    return await run_in_executor(
+        datastore.query_root_batch,
+        decode_embeddings(
+            request.query_embeddings, datastore.embedding_length),
+        request.min_score,
+        request.top_k
+    )
+
+@app.post("/query_document_batch", response_model=list[list[api_models.DocumentChunk]])
+async def query_document_batch(request: api_models.DocumentBatchQueryRequest):
+    """
+    Queries the datastore with the given document UUIDs and all the given
+    embeddings, with a single search per document. Returns the results of 
+    each query, in the same order as the embeddings.
+    """
+    datastore: DataStore = app.state.datastore
+
+    return check_found(await run_in_executor(
+        datastore.query_documents_batch,
+        request.document_uuids,
+        decode_embeddings(
+            request.query_embeddings, datastore.embedding_length),
+        request.min_score,
+        request.top_k
+    ))
+
+@app.get(
+    "/document_info",
+    response_model=api_models.DocumentInfoResponse,
+    response_model_exclude_none=True
+)
+async def documents_info(
+    document_uuid: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    filename_prefix: Optional[str] = None,
+    filename_contains: Optional[str] = None,
+    count_only: bool = False
+):
     """
     Gets the metadata for the document with the given UUID. If no UUID is
-    provided, gets the metadata for all documents in the datastore.
+    provided, gets the metadata for all documents in the datastore. The
+    documents can be paginated (limit, after), filtered by filename, 
+    restricted to some fields (comma-separated) or only counted.
     """
     datastore: DataStore = app.state.datastore
     
-    loop = asyncio.get_running_loop()
-    with ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(
-            pool, 
+    try:
+        return check_found(await run_in_executor(
             datastore.get_document_info,
-            document_uuid   
-        )
\ No newline at end of file
+            document_uuid,
+            limit,
+            after,
+            [field.strip() for field in fields.split(",")] if fields else None,
+            filename_prefix,
+            filename_contains,
+            count_only
+        ))
+    except ValueError as e:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
@@ -0,0 +1,160 @@
+"""
+Prometheus metrics of the datastore, served by /metrics: the count and
+latency of the requests of each endpoint, the latency of the internal
+stages of the queries, and the sizes of the indexes and of the sub-index
+cache.
+"""
+import time
+
+from fastapi import FastAPI, Request
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# The storage package times its stages with this module, so only its
+# index utilities are imported here
+from storage.index.utils import index_size_bytes
+
+
+# Latency buckets in seconds, from sub-millisecond index searches to slow
+# document additions
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Number of HTTP requests, by endpoint and status code.",
+    ["method", "endpoint", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the HTTP requests, by endpoint.",
+    ["method", "endpoint"],
+    buckets=BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds",
+    "Latency of the internal stages of the requests: root_search, "
+    "chunk_search, lexical_search and sqlite_fetch.",
+    ["stage"],
+    buckets=BUCKETS
+)
+
+
+def stage(name: str):
+    """
+    Returns a context manager timing the given stage.
+    """
+    return STAGE_DURATION.labels(name).time()
+
+
+def instrument(app: FastAPI) -> None:
+    """
+    Counts and times every request of the given app by endpoint. The
+    endpoint is the path template of the route, so that path parameters
+    do not create a time series each.
+    """
+    @app.middleware("http")
+    async def observe_request(request: Request, call_next):
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            REQUESTS.labels(request.method, endpoint, str(status_code)).inc()
+            REQUEST_DURATION.labels(request.method, endpoint).observe(
+                time.perf_counter() - start)
+
+
+class DataStoreCollector:
+    """
+    Collects the sizes of the indexes and the counters of the sub-index
+    cache of a datastore when the metrics are scraped.
+    """
+
+    def __init__(self, datastore) -> None:
+        """
+        Initializes the DataStoreCollector object with the given parameters.
+
+        Args:
+        - datastore (DataStore): The datastore whose metrics are collected.
+        """
+        self.datastore = datastore
+
+    def collect(self):
+        datastore = self.datastore
+        yield GaugeMetricFamily(
+            "root_index_documents",
+            "Number of documents in the root index.",
+            value=datastore.vector_index.root_index_size()
+        )
+        yield GaugeMetricFamily(
+            "root_index_bytes",
+            "Estimated memory used by the embeddings of the root index.",
+            value=index_size_bytes(datastore.vector_index.root_index)
+        )
+        yield GaugeMetricFamily(
+            "root_index_tombstone_ratio",
+            "Fraction of deleted embeddings of the root index, removed by "
+            "the next compaction.",
+            value=datastore.vector_index.tombstone_ratio()
+        )
+        if datastore.chunk_index is not None:
+            yield GaugeMetricFamily(
+                "chunk_index_chunks",
+                "Number of chunks in the global chunk index.",
+                value=datastore.chunk_index.size()
+            )
+            yield GaugeMetricFamily(
+                "chunk_index_bytes",
+                "Estimated memory used by the embeddings of the global "
+                "chunk index.",
+                value=index_size_bytes(datastore.chunk_index.index)
+            )
+            yield GaugeMetricFamily(
+                "chunk_index_tombstone_ratio",
+                "Fraction of deleted chunks of the global chunk index.",
+                value=datastore.chunk_index.tombstone_ratio()
+            )
+
+        cache_stats = datastore.vector_index.cache_stats()
+        yield CounterMetricFamily(
+            "sub_index_cache_hits",
+            "Number of sub-index lookups served from the cache.",
+            value=cache_stats["hits"]
+        )
+        yield CounterMetricFamily(
+            "sub_index_cache_misses",
+            "Number of sub-index lookups read from disk.",
+            value=cache_stats["misses"]
+        )
+        yield GaugeMetricFamily(
+            "sub_index_cache_entries",
+            "Number of sub-indexes in the cache.",
+            value=cache_stats["entries"]
+        )
+        yield GaugeMetricFamily(
+            "sub_index_cache_bytes",
+            "Memory used by the sub-indexes in the cache.",
+            value=cache_stats["size_bytes"]
+        )
+        yield GaugeMetricFamily(
+            "sub_index_cache_max_bytes",
+            "Memory budget of the sub-index cache.",
+            value=cache_stats["max_size_bytes"]
+        )
+
+
+def register_datastore(datastore) -> DataStoreCollector:
+    """
+    Registers the gauges of the given datastore, see DataStoreCollector.
+    The returned collector must be unregistered when the datastore closes.
+    """
+    collector = DataStoreCollector(datastore)
+    REGISTRY.register(collector)
+    return collector
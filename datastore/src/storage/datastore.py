@@ -1,29 +1,95 @@
+import heapq
+import itertools
 import os
 import shutil
+import sys
+import threading
+import time
 from typing import Optional
 
-from .metadata import MetadataDB
-from .index import VectorIndex
+import numpy as np
 
-from api_models import AddDocumentChunk, RootQueryResult, DocumentInfoResponse, DocumentChunk, DocumentInfo
+from .metadata import MetadataDB, DOCUMENT_INFO_COLUMNS
+from .index import VectorIndex, ChunkIndex
+from .membership import MembershipIndex
+from .manifest import MANIFEST_VERSION, read_manifest, write_manifest
+from . import replication
+from .index import root_index
+from . import utils
 
+import metrics
+from api_models import (
+    AddDocumentChunk,
+    AddDocumentRequest,
+    Change,
+    ChangesResponse,
+    RootQueryResult,
+    DocumentInfoResponse,
+    DocumentChunk,
+    CacheStatsResponse,
+    StoreManifest,
+    decode_embedding,
+    decode_embeddings,
+    encode_embeddings
+)
 
-_DATA_ROOT = "/vector_index"
+
+_DATA_ROOT = utils.get_data_root()
 _ROOT_INDEX_NAME = "root_index"
 _ROOT_METADATA_NAME = "root_medatata"
-_SUB_INDEX_PATH = "/vector_index/sub_index"
-_UPLOADED_FILES_PATH = "/uploaded_files"
+_CHUNK_INDEX_NAME = "chunk_index"
+_CHUNK_METADATA_NAME = "chunk_metadata"
+_CHUNK_FTS_NAME = "chunk_fts"
+_CHANGE_LOG_NAME = "changelog"
+_SUB_INDEX_PATH = os.path.join(_DATA_ROOT, "sub_index")
+_UPLOADED_FILES_PATH = utils.get_uploaded_files_path()
 
 _vector_db_config = {
     "data_root": _DATA_ROOT,
     "root_index_name": _ROOT_INDEX_NAME,
-    "sub_index_path": _SUB_INDEX_PATH 
+    "sub_index_path": _SUB_INDEX_PATH,
+    "sub_index_cache_size": utils.get_sub_index_cache_size(),
+    "read_only": utils.get_index_read_only(),
+    "root_index_type": utils.get_root_index_type(),
+    "root_index_promotion_threshold": utils.get_root_index_promotion_threshold(),
+    "root_index_params": utils.get_root_index_params(),
+    "encoding": utils.get_index_encoding(),
+    "rerank_factor": utils.get_index_rerank_factor(),
+    "pq_m": utils.get_index_pq_m()
+}
+
+_chunk_index_config = {
+    "data_root": _DATA_ROOT,
+    "chunk_index_name": _CHUNK_INDEX_NAME,
+    "read_only": utils.get_index_read_only(),
+    "encoding": utils.get_index_encoding()
 }
 
 _metadata_db_config = {
     "data_root": _DATA_ROOT,
     "root_db_name": _ROOT_METADATA_NAME,
-    "sub_index_path": _SUB_INDEX_PATH
+    "sub_index_path": _SUB_INDEX_PATH,
+    "max_connections": utils.get_metadata_max_connections(),
+    "mmap_size": utils.get_sqlite_mmap_size(),
+    "cache_size": utils.get_sqlite_cache_size(),
+    "chunk_store": utils.get_chunk_store_mode(),
+    "chunk_db_name": _CHUNK_METADATA_NAME,
+    "lexical_index": utils.get_lexical_index(),
+    "lexical_db_name": _CHUNK_FTS_NAME
+}
+
+_change_log_config = {
+    "data_root": _DATA_ROOT,
+    "change_log_name": _CHANGE_LOG_NAME,
+    "retention": utils.get_replication_log_retention(),
+    "mmap_size": utils.get_sqlite_mmap_size(),
+    "cache_size": utils.get_sqlite_cache_size()
+}
+
+_membership_config = {
+    "bloom_filter": utils.get_membership_bloom_filter(),
+    "bloom_capacity": utils.get_membership_bloom_capacity(),
+    "bloom_error_rate": utils.get_membership_bloom_error_rate()
 }
 
 class DataStore:
@@ -49,6 +115,18 @@ class DataStore:
     Using the combination of metadata and vector index is therefore possible
     to retrieve either the embedding or the metadata of a document or a
     document chunk.
+
+    When CHUNK_INDEX_MODE is "global", the per-document sub-indexes are
+    replaced by a single chunk index shared by all documents, where each
+    chunk is keyed by the root index ID of its document and its position
+    in the document.
+
+    When CHUNK_STORE_MODE is "consolidated", the per-document sub-metadata
+    dbs are replaced by a single chunk metadata db keyed by document UUID
+    and faiss ID.
+
+    When LEXICAL_INDEX is enabled, the chunk text is also stored in a BM25
+    full-text index, used by the lexical and hybrid queries.
     """
     def __init__(self, embedding_length: int) -> None:
         """
@@ -67,7 +145,67 @@ class DataStore:
             os.makedirs(_SUB_INDEX_PATH)
         self.embedding_length = embedding_length
         self.vector_index = VectorIndex(embedding_length, **_vector_db_config)
+        if self.vector_index.root_index.d != embedding_length:
+            raise RuntimeError(
+                f"The stored indexes have embedding length "
+                f"{self.vector_index.root_index.d}, not {embedding_length}!")
+        self.chunk_index = (
+            ChunkIndex(embedding_length, **_chunk_index_config)
+            if utils.get_chunk_index_mode() == "global"
+            else None
+        )
         self.metadata_db = MetadataDB(**_metadata_db_config) 
+        # Answers the existence checks without querying the metadata db
+        self.membership = MembershipIndex(**_membership_config)
+        self.membership.build(self.metadata_db.get_document_keys())
+
+        self.role = utils.get_datastore_role()
+        if self.role not in replication.ROLES:
+            raise ValueError(f"Unknown datastore role {self.role}!")
+        # A leader publishes its writes, in the order they become visible
+        self.change_log = (
+            replication.ChangeLog(**_change_log_config)
+            if self.role == replication.LEADER else None
+        )
+        self._publish_lock = threading.Lock()
+        if not self.vector_index.read_only:
+            self.write_manifest()
+
+    @staticmethod
+    def read_manifest() -> Optional[StoreManifest]:
+        """
+        Returns the manifest of the stored indexes, None on the first start.
+        It lets the datastore start without asking the backend for the
+        embedding length.
+        """
+        return read_manifest(_DATA_ROOT)
+
+    def manifest(self) -> StoreManifest:
+        return StoreManifest(
+            manifest_version=MANIFEST_VERSION,
+            embedding_length=self.embedding_length,
+            root_index_type=root_index.index_type(self.vector_index.root_index),
+            chunk_index_mode=utils.get_chunk_index_mode(),
+            encoding=self.vector_index.encoding,
+            chunk_store=_metadata_db_config["chunk_store"],
+            metadata_schema_version=self.metadata_db.schema_version(),
+            document_count=self.vector_index.root_index_size(),
+            chunk_count=(
+                self.chunk_index.size() if self.chunk_index is not None
+                else None
+            ),
+            updated_at=time.time()
+        )
+
+    def write_manifest(self) -> None:
+        write_manifest(_DATA_ROOT, self.manifest())
+
+    def _check_writable(self) -> None:
+        # Checked before touching the metadata so that a rejected write
+        # does not leave the metadata and the indexes out of sync
+        if self.vector_index.read_only:
+            raise ValueError(
+                "The datastore is in read-only mode!")
 
     def has_document(
         self,
@@ -82,7 +220,10 @@ class DataStore:
         Returns:
         - bool: True if the document is in the datastore, False otherwise.
         """
-        return self.metadata_db.has_document(document_hash_str)
+        has_document = self.membership.contains_hash(document_hash_str)
+        if has_document is None:
+            return self.metadata_db.has_document(document_hash_str)
+        return has_document
     
     def has_document_uuid(
         self,
@@ -97,7 +238,10 @@ class DataStore:
         Returns:
         - bool: True if the document is in the datastore, False otherwise.
         """
-        return self.metadata_db.has_document_uuid(document_uuid)
+        has_document = self.membership.contains_uuid(document_uuid)
+        if has_document is None:
+            return self.metadata_db.has_document_uuid(document_uuid)
+        return has_document
 
     def add_document(
         self,
@@ -106,12 +250,14 @@ class DataStore:
         document_filename: str,
         document_embedding: list[float],
         document_summary: str,
-        document_chunks: list[AddDocumentChunk]
+        document_chunks: list[AddDocumentChunk],
+        chunks_embeddings: Optional[list[list[float]] | np.ndarray] = None
     ) -> None:
         """
         Adds the given document to the datastore. The document is added to the
         root index and the sub-indexes. The metadata for the document is also
-        added to the metadata database.
+        added to the metadata database. If any of these writes fails, the
+        previous ones are undone before the error is raised.
 
         Args:
         - document_uuid (str): The UUID of the document.
@@ -120,28 +266,23 @@ class DataStore:
         - document_embedding (list[float]): The embedding of the document.
         - document_summary (str): The summary of the document.
         - document_chunks (list[AddDocumentChunk]): The chunks of the document.
+        - chunks_embeddings (Optional[list[list[float]] | np.ndarray]): The
+            embeddings of the chunks, in the same order, when they are not
+            stored in document_chunks.
         """
-        if self.metadata_db.has_document(document_hash_str):
+        self._check_writable()
+        if self.has_document(document_hash_str):
             raise ValueError("Document already exists in the datastore!")
+        if chunks_embeddings is None:
+            if any(chunk.embedding is None for chunk in document_chunks):
+                raise ValueError("Missing embeddings for the document chunks!")
+            chunks_embeddings = [
+                chunk.embedding for chunk in document_chunks
+            ]
+        if len(chunks_embeddings) != len(document_chunks):
+            raise ValueError(
+                "The number of embeddings does not match the number of chunks!")
         
-        root_index_id = self.vector_index.add_to_root(document_embedding)
-        self.metadata_db.add_root_metadata(
-            root_index_id,
-            document_uuid,
-            document_hash_str,
-            document_filename,
-            document_summary
-        )
-
-        chunks_embeddings = [
-            chunk.embedding for chunk in document_chunks
-        ]
-        
-        sub_index_ids = self.vector_index.add(
-            document_uuid,
-            chunks_embeddings
-        )
-
         chunks_text = [
             chunk.text for chunk in document_chunks
         ]
@@ -149,13 +290,152 @@ class DataStore:
             chunk.page_number for chunk in document_chunks
         ]
 
-        self.metadata_db.add(
-            document_uuid,
-            sub_index_ids,
-            chunks_page,
-            chunks_text
-        )   
+        # The writes are undone in reverse order if any of them fails, the
+        # root metadata comes last so that the document is only visible
+        # once all its data is stored
+        root_index_id = None
+        sub_index_added = False
+        chunks_added = False
+        root_metadata_added = False
+        try:
+            root_index_id = self.vector_index.add_to_root(document_embedding)
+            if self.chunk_index is not None:
+                sub_index_ids = self.chunk_index.add(
+                    root_index_id,
+                    chunks_embeddings
+                )
+            else:
+                sub_index_ids = self.vector_index.add(
+                    document_uuid,
+                    chunks_embeddings
+                )
+            sub_index_added = True
+
+            # Set before the call since removing chunks that were not
+            # written is a no-op
+            chunks_added = True
+            self.metadata_db.add(
+                document_uuid,
+                sub_index_ids,
+                chunks_page,
+                chunks_text
+            )
+
+            with self._publish_lock:
+                self.metadata_db.add_root_metadata(
+                    root_index_id,
+                    document_uuid,
+                    document_hash_str,
+                    document_filename,
+                    document_summary
+                )
+                root_metadata_added = True
+                if self.change_log is not None:
+                    # Followers fetch the document itself from the leader
+                    self.change_log.append(replication.ADD, document_uuid)
+            self.membership.add(document_uuid, document_hash_str)
+        except Exception:
+            self._rollback_add(
+                document_uuid,
+                root_index_id,
+                sub_index_added,
+                chunks_added,
+                root_metadata_added
+            )
+            raise
+
+    def _rollback_add(
+        self,
+        document_uuid: str,
+        root_index_id: Optional[int],
+        sub_index_added: bool,
+        chunks_added: bool,
+        root_metadata_added: bool = False
+    ) -> None:
+        """
+        Undoes the writes of a failed add_document, in reverse order. Every
+        step is attempted even if a previous one fails, so that as little
+        as possible is left behind.
+
+        Args:
+        - document_uuid (str): The UUID of the document being added.
+        - root_index_id (Optional[int]): The root index ID of the document,
+            None if it was not added to the root index.
+        - sub_index_added (bool): Whether the chunk embeddings were added.
+        - chunks_added (bool): Whether the chunk metadata was added.
+        - root_metadata_added (bool): Whether the root metadata was added,
+            when publishing the change failed.
+        """
+        steps = []
+        if root_metadata_added:
+            steps.append(
+                lambda: self.metadata_db.remove_from_root(document_uuid))
+        if chunks_added:
+            steps.append(lambda: self.metadata_db.remove(document_uuid))
+        if sub_index_added:
+            if self.chunk_index is not None:
+                steps.append(lambda: self.chunk_index.remove(root_index_id))
+            else:
+                steps.append(lambda: self.vector_index.remove(document_uuid))
+        if root_index_id is not None:
+            steps.append(
+                lambda: self.vector_index.remove_from_root(root_index_id))
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                print(
+                    f"Error while rolling back document {document_uuid}: {e}",
+                    file=sys.stderr
+                )
     
+    def export_document(
+        self,
+        document_uuid: str
+    ) -> Optional[AddDocumentRequest]:
+        """
+        Exports the document with the given UUID as the request that adds
+        it, with its stored embeddings, so that it can be moved to another
+        datastore without being embedded again. The embeddings of lossy
+        encodings are their approximation.
+
+        Args:
+        - document_uuid (str): The UUID of the document.
+
+        Returns:
+        - Optional[AddDocumentRequest]: The document, None if it does not
+            exist.
+        """
+        root_id = self.metadata_db.get_root_ids([document_uuid]).get(
+            document_uuid)
+        if root_id is None:
+            return None
+        document_info = self.metadata_db.get_document_info(document_uuid)[0]
+        document_embedding = self.vector_index.reconstruct_root(root_id)
+        if document_embedding is None:
+            return None
+        if self.chunk_index is not None:
+            chunk_ids, chunks_embeddings = self.chunk_index.reconstruct(root_id)
+        else:
+            chunks_embeddings = self.vector_index.reconstruct(document_uuid)
+            chunk_ids = list(range(len(chunks_embeddings)))
+        chunks = self.metadata_db.query_by_id(document_uuid, chunk_ids)
+        return AddDocumentRequest(
+            document_uuid=document_uuid,
+            document_hash_str=document_info.document_hash_str,
+            document_filename=document_info.document_filename,
+            document_embedding=encode_embeddings(document_embedding[None]),
+            document_summary=document_info.document_summary,
+            document_chunks=[
+                AddDocumentChunk(
+                    text=chunks[chunk_id][1],
+                    page_number=chunks[chunk_id][0]
+                )
+                for chunk_id in chunk_ids
+            ],
+            chunks_embeddings=encode_embeddings(chunks_embeddings)
+        )
+
     def delete_document(
         self,
         document_uuid: str
@@ -172,17 +452,28 @@ class DataStore:
         Returns:
         - str: The filename of the deleted document.
         """
-        faiss_id, document_filename = self.metadata_db.remove_from_root(document_uuid)
-        self.vector_index.remove_from_root(faiss_id)
-        self.metadata_db.remove(document_uuid)
-        self.vector_index.remove(document_uuid)
+        self._check_writable()
+        with self._publish_lock:
+            faiss_id, document_filename, document_hash = (
+                self.metadata_db.remove_from_root(document_uuid))
+            self.membership.remove(document_uuid, document_hash)
+            self.vector_index.remove_from_root(faiss_id)
+            self.metadata_db.remove(document_uuid)
+            if self.chunk_index is not None:
+                self.chunk_index.remove(faiss_id)
+            else:
+                self.vector_index.remove(document_uuid)
+            if self.change_log is not None:
+                self.change_log.append(replication.DELETE, document_uuid)
 
         return document_filename
         
 
     def query_root(
         self,
-        query_embedding: list[float]
+        query_embedding: list[float],
+        min_score: Optional[float] = None,
+        top_k: int = 5
     ) -> list[RootQueryResult]:
         """
         Queries the root index with the given embedding and returns the
@@ -190,23 +481,23 @@ class DataStore:
 
         Args:
         - query_embedding (list[float]): The embedding to query the index with.
+        - min_score (Optional[float]): If given, only the documents with at
+            least this cosine similarity to the query are returned.
+        - top_k (int): The number of documents to return.
 
         Returns:
-        - list[RootQueryResult]: The top-k nearest neighbors of the query.
+        - list[RootQueryResult]: The top-k nearest neighbors of the query,
+            closest first.
         """
-        root_ids = self.vector_index.query_root(query_embedding)
-        query_result = self.metadata_db.query_root(root_ids)
-        result = [
-            RootQueryResult(uuid=row[0], summary=row[1])
-            for row in query_result
-        ]
-        return result
+        return self.query_root_batch([query_embedding], min_score, top_k)[0]
     
     def query_documents(
         self,
         document_uuids: str | list[str],
-        query_embedding: list[float]
-    ) -> list[DocumentChunk]:
+        query_embedding: list[float],
+        min_score: Optional[float] = None,
+        top_k: int = 5
+    ) -> Optional[list[DocumentChunk]]:
         """
         Queries the sub-indexes with the given document UUIDs and returns the
         top-k nearest neighbors for each document.
@@ -215,55 +506,654 @@ class DataStore:
         - document_uuids (str | list[str]): The UUID or list of UUIDs of the
             documents to query.
         - query_embedding (list[float]): The embedding to query the index with.
+        - min_score (Optional[float]): If given, only the chunks with at
+            least this cosine similarity to the query are returned.
+        - top_k (int): The number of chunks to return for each document.
 
         Returns:
-        - list[DocumentChunk]: The top-k nearest neighbors of the query for each
+        - Optional[list[DocumentChunk]]: The top-k nearest neighbors of the
+            query for each document, None if a document is missing from a
+            follower, see _stored_documents.
+        """
+        results = self.query_documents_batch(
+            document_uuids, [query_embedding], min_score, top_k)
+        return None if results is None else results[0]
+
+    def query_documents_global(
+        self,
+        document_uuids: str | list[str],
+        query_embedding: list[float],
+        min_score: Optional[float] = None,
+        top_k: int = 5,
+        limit: int = 5
+    ) -> Optional[list[DocumentChunk]]:
+        """
+        Queries the sub-indexes with the given document UUIDs and returns the
+        best chunks across all the documents, instead of a fixed number of
+        chunks per document. The candidates of each document, already sorted
+        by score, are merged with a heap and only the chunks kept are looked
+        up in the metadata database.
+
+        Args:
+        - document_uuids (str | list[str]): The UUID or list of UUIDs of the
+            documents to query.
+        - query_embedding (list[float]): The embedding to query the index with.
+        - min_score (Optional[float]): If given, only the chunks with at
+            least this cosine similarity to the query are returned.
+        - top_k (int): The number of candidate chunks searched in each
             document.
+        - limit (int): The number of chunks to return overall.
+
+        Returns:
+        - Optional[list[DocumentChunk]]: The limit nearest chunks of all the
+            documents, closest first. None if a document is missing from a
+            follower, see _stored_documents.
         """
         if isinstance(document_uuids, str):
             document_uuids = [document_uuids]
-        
-        result = []
-        for document_uuid in document_uuids:
-            faiss_ids = self.vector_index.query(document_uuid, query_embedding)
-            query_result = self.metadata_db.query(document_uuid, faiss_ids)
-            result.extend([
-                DocumentChunk(text=row[1], page_number=row[0])
-                for row in query_result
-            ])
-            
+        candidates = self._vector_candidates(
+            document_uuids, query_embedding, min_score, top_k, limit)
+        if candidates is None:
+            return None
+        faiss_ids: dict[str, list[int]] = {}
+        for document_uuid, faiss_id, _ in candidates:
+            faiss_ids.setdefault(document_uuid, []).append(faiss_id)
+        with metrics.stage("sqlite_fetch"):
+            rows = self.metadata_db.query_many(faiss_ids)
+        return [
+            DocumentChunk(
+                text=rows[document_uuid][faiss_id][1],
+                page_number=rows[document_uuid][faiss_id][0],
+                score=score
+            )
+            for document_uuid, faiss_id, score in candidates
+            if faiss_id in rows[document_uuid]
+        ]
+
+    def query_root_batch(
+        self,
+        query_embeddings: list[list[float]],
+        min_score: Optional[float] = None,
+        top_k: int = 5
+    ) -> list[list[RootQueryResult]]:
+        """
+        Queries the root index with all the given embeddings in a single
+        search and returns the top-k nearest neighbors of each.
+
+        Args:
+        - query_embeddings (list[list[float]]): The embeddings to query the
+            index with.
+        - min_score (Optional[float]): If given, only the documents with at
+            least this cosine similarity to the query are returned.
+        - top_k (int): The number of documents to return for each query.
+
+        Returns:
+        - list[list[RootQueryResult]]: For each query, its top-k nearest
+            neighbors, closest first.
+        """
+        if len(query_embeddings) == 0:
+            return []
+        with metrics.stage("root_search"):
+            root_results = self.vector_index.query_root_batch(
+                query_embeddings, top_k, min_score)
+        with metrics.stage("sqlite_fetch"):
+            rows = self.metadata_db.query_root_by_id(list({
+                root_id for query_results in root_results
+                for root_id, _ in query_results
+            }))
+        return [
+            [
+                RootQueryResult(
+                    uuid=rows[root_id][0],
+                    summary=rows[root_id][1],
+                    score=score
+                )
+                for root_id, score in query_results
+                if root_id in rows
+            ]
+            for query_results in root_results
+        ]
+
+    def query_documents_batch(
+        self,
+        document_uuids: str | list[str],
+        query_embeddings: list[list[float]],
+        min_score: Optional[float] = None,
+        top_k: int = 5
+    ) -> Optional[list[list[DocumentChunk]]]:
+        """
+        Queries the sub-indexes of the given documents with all the given
+        embeddings, running a single search per document, and returns the
+        top-k nearest neighbors of each query for each document.
+
+        Args:
+        - document_uuids (str | list[str]): The UUID or list of UUIDs of the
+            documents to query.
+        - query_embeddings (list[list[float]]): The embeddings to query the
+            index with.
+        - min_score (Optional[float]): If given, only the chunks with at
+            least this cosine similarity to the query are returned.
+        - top_k (int): The number of chunks to return for each document.
+
+        Returns:
+        - Optional[list[list[DocumentChunk]]]: For each query, the top-k
+            nearest neighbors for each document. None if a document is
+            missing from a follower, see _stored_documents.
+        """
+        if len(query_embeddings) == 0:
+            return []
+        if isinstance(document_uuids, str):
+            document_uuids = [document_uuids]
+        document_keys = self._stored_documents(document_uuids)
+        if document_keys is None:
+            return None
+
+        if self.chunk_index is not None:
+            return self._query_chunk_index(
+                document_keys, query_embeddings, min_score, top_k)
+
+        with metrics.stage("chunk_search"):
+            document_results = {
+                document_uuid: self.vector_index.query_batch(
+                    document_uuid, query_embeddings, top_k, min_score)
+                for document_uuid in document_uuids
+                if document_uuid in document_keys
+            }
+        with metrics.stage("sqlite_fetch"):
+            rows = self.metadata_db.query_many({
+                document_uuid: list({
+                    faiss_id for query_results in results
+                    for faiss_id, _ in query_results
+                })
+                for document_uuid, results in document_results.items()
+            })
+
+        result = [[] for _ in query_embeddings]
+        for document_uuid, results in document_results.items():
+            document_rows = rows[document_uuid]
+            for query_result, query_results in zip(result, results):
+                query_result.extend([
+                    DocumentChunk(
+                        text=document_rows[faiss_id][1],
+                        page_number=document_rows[faiss_id][0],
+                        score=score
+                    )
+                    for faiss_id, score in query_results
+                    if faiss_id in document_rows
+                ])
         return result
+
+    def _stored_documents(
+        self,
+        document_uuids: list[str]
+    ) -> Optional[dict[str, int]]:
+        """
+        Returns the root index IDs of the given documents that are stored,
+        keyed by UUID; the others are skipped by the queries. A follower
+        might only not have replicated them yet, so it returns None instead
+        and its reads are answered with a 404 for the backend to retry them
+        on the leader. Nothing is created for the missing documents.
+        """
+        with metrics.stage("sqlite_fetch"):
+            document_keys = self.metadata_db.get_root_ids(document_uuids)
+        if (
+            self.role == replication.FOLLOWER
+            and len(document_keys) < len(set(document_uuids))
+        ):
+            return None
+        return document_keys
+
+    def _query_chunk_index(
+        self,
+        document_keys: dict[str, int],
+        query_embeddings: list[list[float]],
+        min_score: Optional[float] = None,
+        top_k: int = 5
+    ) -> list[list[DocumentChunk]]:
+        """
+        Queries the global chunk index restricted to the given documents
+        with a single search. The same total number of chunks as the
+        per-document search is returned, but they are the best ones across
+        all the documents.
+
+        Args:
+        - document_keys (dict[str, int]): The root index IDs of the
+            documents to query, keyed by UUID, see _stored_documents.
+        - query_embeddings (list[list[float]]): The embeddings to query the
+            index with.
+        - min_score (Optional[float]): If given, only the chunks with at
+            least this cosine similarity to the query are returned.
+        - top_k (int): The number of chunks to return for each document.
+
+        Returns:
+        - list[list[DocumentChunk]]: For each query, the nearest chunks of
+            the documents, closest first.
+        """
+        key_to_uuid = {key: uuid for uuid, key in document_keys.items()}
+        with metrics.stage("chunk_search"):
+            chunk_results = self.chunk_index.query_batch(
+                list(key_to_uuid),
+                query_embeddings,
+                top_k * len(key_to_uuid),
+                min_score
+            )
+
+        # Chunks are grouped by document to fetch all their metadata with a
+        # single lookup
+        document_chunks: dict[int, set[int]] = {}
+        for query_results in chunk_results:
+            for document_key, chunk_id, _ in query_results:
+                document_chunks.setdefault(document_key, set()).add(chunk_id)
+        with metrics.stage("sqlite_fetch"):
+            uuid_rows = self.metadata_db.query_many({
+                key_to_uuid[document_key]: list(faiss_ids)
+                for document_key, faiss_ids in document_chunks.items()
+            })
+        rows = {
+            document_key: uuid_rows[key_to_uuid[document_key]]
+            for document_key in document_chunks
+        }
+
+        return [
+            [
+                DocumentChunk(
+                    text=rows[document_key][chunk_id][1],
+                    page_number=rows[document_key][chunk_id][0],
+                    score=score
+                )
+                for document_key, chunk_id, score in query_results
+                if chunk_id in rows[document_key]
+            ]
+            for query_results in chunk_results
+        ]
     
-    def get_document_info(self, document_uuid: Optional[str]) -> DocumentInfo:
+    def query_lexical(
+        self,
+        query_text: str,
+        document_uuids: Optional[list[str]] = None,
+        top_k: int = 5,
+        phrase: bool = False
+    ) -> Optional[list[DocumentChunk]]:
+        """
+        Searches the chunks matching the given text with the BM25 full-text
+        index, without any embedding.
+
+        Args:
+        - query_text (str): The text of the query.
+        - document_uuids (Optional[list[str]]): If given, only the chunks of
+            these documents are searched, otherwise all the documents are.
+        - top_k (int): The maximum number of chunks to return.
+        - phrase (bool): Whether the text must appear as an exact phrase.
+
+        Returns:
+        - Optional[list[DocumentChunk]]: The best matching chunks first,
+            scored by their BM25 relevance. None if a document is missing
+            from a follower, see _stored_documents.
+        """
+        if (
+            document_uuids is not None
+            and self._stored_documents(document_uuids) is None
+        ):
+            return None
+        with metrics.stage("lexical_search"):
+            results = self.metadata_db.search_text(
+                query_text, document_uuids, top_k, phrase)
+        return [
+            DocumentChunk(
+                text=text,
+                page_number=page_number,
+                score=score,
+                score_type="bm25"
+            )
+            for _, _, page_number, text, score in results
+        ]
+
+    def query_documents_hybrid(
+        self,
+        document_uuids: str | list[str],
+        query_embedding: list[float],
+        query_text: str,
+        min_score: Optional[float] = None,
+        top_k: int = 5,
+        limit: Optional[int] = None
+    ) -> Optional[list[DocumentChunk]]:
+        """
+        Queries the chunks of the given documents with both the vector
+        indexes and the BM25 full-text index, and fuses the two rankings
+        with reciprocal rank fusion: each chunk scores the sum of
+        1 / (HYBRID_RRF_K + rank) over the rankings it appears in.
+
+        Args:
+        - document_uuids (str | list[str]): The UUID or list of UUIDs of the
+            documents to query.
+        - query_embedding (list[float]): The embedding of the query.
+        - query_text (str): The text of the query.
+        - min_score (Optional[float]): If given, only the chunks with at
+            least this cosine similarity to the query are retrieved by the
+            vector search.
+        - top_k (int): The number of candidate chunks searched in each
+            document.
+        - limit (Optional[int]): The number of chunks to return, by default
+            top_k * len(document_uuids).
+
+        Returns:
+        - Optional[list[DocumentChunk]]: The limit chunks with the best fused
+            score, best first. None if a document is missing from a
+            follower, see _stored_documents.
+        """
+        if isinstance(document_uuids, str):
+            document_uuids = [document_uuids]
+        if not document_uuids:
+            return []
+        limit = limit or top_k * len(document_uuids)
+        rrf_k = utils.get_rrf_k()
+
+        vector_results = self._vector_candidates(
+            document_uuids, query_embedding, min_score, top_k)
+        if vector_results is None:
+            return None
+        with metrics.stage("lexical_search"):
+            lexical_results = self.metadata_db.search_text(
+                query_text, document_uuids, limit)
+
+        scores: dict[tuple[str, int], float] = {}
+        for rank, (document_uuid, faiss_id, _) in enumerate(vector_results):
+            key = (document_uuid, faiss_id)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+        rows: dict[tuple[str, int], tuple[int, str]] = {}
+        for rank, (document_uuid, faiss_id, page_number, text, _) in enumerate(
+            lexical_results
+        ):
+            key = (document_uuid, faiss_id)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            rows[key] = (page_number, text)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        # Only the chunks found by the vector search alone need a lookup
+        missing: dict[str, list[int]] = {}
+        for document_uuid, faiss_id in best:
+            if (document_uuid, faiss_id) not in rows:
+                missing.setdefault(document_uuid, []).append(faiss_id)
+        with metrics.stage("sqlite_fetch"):
+            missing_rows = self.metadata_db.query_many(missing)
+        for document_uuid, document_rows in missing_rows.items():
+            for faiss_id, row in document_rows.items():
+                rows[(document_uuid, faiss_id)] = row
+
+        return [
+            DocumentChunk(
+                text=rows[key][1],
+                page_number=rows[key][0],
+                score=scores[key],
+                score_type="rrf"
+            )
+            for key in best
+            if key in rows
+        ]
+
+    def _vector_candidates(
+        self,
+        document_uuids: list[str],
+        query_embedding: list[float],
+        min_score: Optional[float],
+        top_k: int,
+        limit: Optional[int] = None
+    ) -> Optional[list[tuple[str, int, float]]]:
+        """
+        Searches the chunk embeddings of the given documents and returns
+        the candidates of all of them, ranked by cosine similarity.
+
+        Args:
+        - document_uuids (list[str]): The UUIDs of the documents to query.
+        - query_embedding (list[float]): The embedding of the query.
+        - min_score (Optional[float]): If given, only the chunks with at
+            least this cosine similarity are returned.
+        - top_k (int): The number of candidate chunks of each document.
+        - limit (Optional[int]): If given, only the best limit candidates
+            across all the documents are returned.
+
+        Returns:
+        - Optional[list[tuple[str, int, float]]]: The (document_uuid,
+            faiss_id, score) tuples of the candidates, closest first. None
+            if a document is missing from a follower, see _stored_documents.
+        """
+        document_keys = self._stored_documents(document_uuids)
+        if document_keys is None:
+            return None
+        if self.chunk_index is not None:
+            # The chunk index already ranks the chunks of all the documents
+            key_to_uuid = {key: uuid for uuid, key in document_keys.items()}
+            depth = top_k * len(key_to_uuid)
+            with metrics.stage("chunk_search"):
+                chunk_results = self.chunk_index.query_batch(
+                    list(key_to_uuid),
+                    [query_embedding],
+                    min(depth, limit) if limit else depth,
+                    min_score
+                )[0]
+            return [
+                (key_to_uuid[document_key], chunk_id, score)
+                for document_key, chunk_id, score in chunk_results
+            ]
+
+        # The results of each document are sorted, so they are merged with
+        # a heap of one entry per document, stopping after limit entries
+        with metrics.stage("chunk_search"):
+            document_candidates = [
+                [
+                    (document_uuid, faiss_id, score)
+                    for faiss_id, score in self.vector_index.query_batch(
+                        document_uuid, [query_embedding], top_k, min_score
+                    )[0]
+                ]
+                for document_uuid in document_uuids
+                if document_uuid in document_keys
+            ]
+        merged = heapq.merge(
+            *document_candidates,
+            key=lambda candidate: candidate[2],
+            reverse=True
+        )
+        return list(itertools.islice(merged, limit))
+
+    def get_document_info(
+        self,
+        document_uuid: Optional[str],
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[list[str]] = None,
+        filename_prefix: Optional[str] = None,
+        filename_contains: Optional[str] = None,
+        count_only: bool = False
+    ) -> Optional[DocumentInfoResponse]:
         """
         Gets the metadata for the document with the given UUID. If no UUID is
-        provided, gets the metadata for all documents in the datastore.
+        provided, gets the metadata for all documents in the datastore, or
+        a page of them.
 
         Args:
         - document_uuid (str): The UUID of the document to get the metadata for.
             If no UUID is provided, gets the metadata for all documents.
+        - limit (Optional[int]): The maximum number of documents returned.
+        - after (Optional[str]): The cursor of the page, the next_cursor of
+            the previous page.
+        - fields (Optional[list[str]]): The DocumentInfo fields returned
+            besides the UUID, all of them if not given.
+        - filename_prefix (Optional[str]): Only the documents whose filename
+            starts with it are returned.
+        - filename_contains (Optional[str]): Only the documents whose
+            filename contains it are returned.
+        - count_only (bool): Whether to only count the matching documents,
+            without returning them.
 
         Returns:
-        - DocumentInfoResponse: The metadata for the document or all documents.
+        - Optional[DocumentInfoResponse]: The metadata for the document or all
+            documents. None if the document is missing from a follower, see
+            _stored_documents.
         """
-        document_info = (
-            self.metadata_db.get_document_info(document_uuid) 
-            if document_uuid 
-            else self.metadata_db.get_documents_info()
-        )
+        if document_uuid:
+            document_info = self.metadata_db.get_document_info(document_uuid)
+            if not document_info and self.role == replication.FOLLOWER:
+                return None
+            return DocumentInfoResponse(
+                document_count=len(document_info),
+                documents_info=document_info
+            )
+
+        if count_only:
+            return DocumentInfoResponse(
+                document_count=self.metadata_db.count_documents(
+                    filename_prefix, filename_contains),
+                documents_info=[]
+            )
+
+        if fields is not None:
+            unknown = set(fields) - set(DOCUMENT_INFO_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown document fields: {sorted(unknown)}")
+        document_info = self.metadata_db.list_documents(
+            limit, after, fields, filename_prefix, filename_contains)
         return DocumentInfoResponse(
             document_count=len(document_info),
-            documents_info=document_info
+            documents_info=document_info,
+            next_cursor=(
+                document_info[-1].document_uuid
+                if limit is not None and len(document_info) == limit
+                else None
+            )
         )
         
+    def cache_stats(self) -> CacheStatsResponse:
+        """
+        Gets the counters of the in-memory sub-index cache.
+
+        Returns:
+        - CacheStatsResponse: The hits, misses and memory usage of the cache.
+        """
+        return CacheStatsResponse(**self.vector_index.cache_stats())
+
+    def checkpoint(self) -> None:
+        """
+        Writes the in-memory indexes to disk and empties their logs.
+        """
+        self.vector_index.checkpoint()
+        if self.chunk_index is not None:
+            self.chunk_index.checkpoint()
+        if not self.vector_index.read_only:
+            self.write_manifest()
+
+    def compact(self, min_ratio: float = 0.0) -> bool:
+        """
+        Physically removes the deleted documents from the in-memory indexes
+        if they make up at least min_ratio of an index, then reclaims the
+        space they left in the metadata databases. Queries are served
+        meanwhile, see VectorIndex.compact_root.
+
+        Args:
+        - min_ratio (float): The minimum fraction of deleted entries of an
+            index for it to be compacted.
+
+        Returns:
+        - bool: Whether an index was compacted.
+        """
+        if self.vector_index.read_only:
+            return False
+        compacted = self.vector_index.compact_root(min_ratio)
+        if self.chunk_index is not None:
+            compacted = self.chunk_index.compact(min_ratio) or compacted
+        if compacted:
+            self.metadata_db.vacuum(min_ratio)
+        return compacted
+
+    def promote_root(self) -> bool:
+        """
+        Rebuilds the root index with the configured approximate index type
+        once it stores enough documents. Queries are served meanwhile, see
+        VectorIndex.promote_root.
+
+        Returns:
+        - bool: Whether the root index was promoted.
+        """
+        if self.vector_index.read_only:
+            return False
+        return self.vector_index.promote_root()
+
     def close(self):
         self.vector_index.close()
+        if self.chunk_index is not None:
+            self.chunk_index.close()
+        if not self.vector_index.read_only:
+            self.write_manifest()
         self.metadata_db.close()
+        if self.change_log is not None:
+            self.change_log.close()
 
     def clear(self):
-        self.vector_index.clear_root()
-        self.metadata_db.clear_root()
+        self._check_writable()
+        with self._publish_lock:
+            self.vector_index.clear_root()
+            self.metadata_db.clear_root()
+            self.membership.clear()
+            self.metadata_db.clear_chunks()
+            self.metadata_db.close_connections()
+            if self.chunk_index is not None:
+                self.chunk_index.clear()
+
+            shutil.rmtree(_SUB_INDEX_PATH)
+            os.makedirs(_SUB_INDEX_PATH)
+            self.vector_index.clear()
+            if self.change_log is not None:
+                self.change_log.append(replication.CLEAR)
+
+    def changes(self, after: int, limit: int = 100) -> ChangesResponse:
+        """
+        Returns the changes of the change log following the given sequence
+        number, see replication.ChangeLog.read.
+        """
+        if self.change_log is None:
+            raise ValueError("Only a leader datastore publishes its changes!")
+        return self.change_log.read(after, limit)
+
+    def apply_change(
+        self,
+        change: Change,
+        document: Optional[AddDocumentRequest] = None
+    ) -> None:
+        """
+        Applies a change of the leader change log. Changes already applied,
+        e.g. before a crash that lost the cursor, are skipped, so that a
+        change can be applied more than once.
+
+        Args:
+        - change (Change): The change to apply.
+        - document (Optional[AddDocumentRequest]): The added document, as
+            exported by the leader, for "add" changes. The change is
+            skipped without it, when the leader deleted the document since.
+        """
+        if change.operation == replication.CLEAR:
+            self.clear()
+        elif change.operation == replication.DELETE:
+            if self.has_document_uuid(change.document_uuid):
+                self.delete_document(change.document_uuid)
+        elif change.operation == replication.ADD:
+            if document is None or self.has_document_uuid(change.document_uuid):
+                return
+            self.add_document(
+                document.document_uuid,
+                document.document_hash_str,
+                document.document_filename,
+                decode_embedding(
+                    document.document_embedding, self.embedding_length),
+                document.document_summary,
+                document.document_chunks,
+                decode_embeddings(
+                    document.chunks_embeddings, self.embedding_length)
+                if document.chunks_embeddings is not None else None
+            )
+
+    def replication_cursor(self) -> int:
+        return replication.read_cursor(_DATA_ROOT)
 
-        shutil.rmtree(_SUB_INDEX_PATH)
-        os.makedirs(_SUB_INDEX_PATH)
+    def set_replication_cursor(self, seq: int) -> None:
+        replication.write_cursor(_DATA_ROOT, seq)
     
\ No newline at end of file
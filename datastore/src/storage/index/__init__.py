@@ -1 +1,2 @@
-from .db import VectorIndex
\ No newline at end of file
+from .db import VectorIndex
+from .chunk_index import ChunkIndex
\ No newline at end of file
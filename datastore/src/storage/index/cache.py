@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import threading
+
+import faiss
+
+from . import utils
+
+
+class SubIndexCache:
+    """
+    Keeps recently used sub-indexes in memory so that repeated queries on
+    the same documents do not have to deserialize the index file from disk
+    every time. The cache is bounded by a byte budget and entries are
+    evicted in least-recently-used order once the budget is exceeded.
+    """
+    def __init__(self, max_size_bytes: int) -> None:
+        """
+        Initializes the SubIndexCache object with the given parameters.
+
+        Args:
+        - max_size_bytes (int): The maximum amount of memory, in bytes, the
+            cached indexes are allowed to use. A value of 0 disables the cache.
+        """
+        self.max_size_bytes = max_size_bytes
+        self._entries: OrderedDict[str, tuple[faiss.Index, int]] = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        # Queries are run from a thread pool, so the bookkeeping has
+        # to be protected
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> faiss.Index | None:
+        """
+        Returns the cached index for the given key, if any, and marks it as
+        the most recently used.
+
+        Args:
+        - key (str): The key of the index, usually the document UUID.
+
+        Returns:
+        - faiss.Index | None: The cached index or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key: str, index: faiss.Index) -> None:
+        """
+        Adds the given index to the cache, evicting the least recently used
+        entries until the cache fits in its byte budget. Indexes larger than
+        the whole budget are not cached.
+
+        Args:
+        - key (str): The key of the index, usually the document UUID.
+        - index (faiss.Index): The index to cache.
+        """
+        if self.max_size_bytes == 0:
+            return
+        size_bytes = utils.index_size_bytes(index)
+        if size_bytes > self.max_size_bytes:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (index, size_bytes)
+            self._size_bytes += size_bytes
+            while self._size_bytes > self.max_size_bytes:
+                oldest_key = next(iter(self._entries))
+                self._pop(oldest_key)
+
+    def invalidate(self, key: str) -> None:
+        """
+        Removes the index with the given key from the cache, if present.
+
+        Args:
+        - key (str): The key of the index, usually the document UUID.
+        """
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict[str, int]: The number of hits, misses, cached entries, the
+            bytes currently used and the byte budget of the cache.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "entries": len(self._entries),
+                "size_bytes": self._size_bytes,
+                "max_size_bytes": self.max_size_bytes
+            }
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size_bytes -= entry[1]
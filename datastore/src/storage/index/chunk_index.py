@@ -0,0 +1,460 @@
+import pathlib
+import threading
+
+import faiss
+import numpy as np
+
+from . import utils
+from . import log as index_log
+from . import encoding as index_encoding
+from .rwlock import RWLock
+
+
+# The extension for the faiss index files
+_EXT = "faiss"
+
+# Number of low bits of a chunk ID used for the chunk position inside its
+# document, the remaining high bits store the document key
+_CHUNK_BITS = 32
+
+
+class ChunkIndex:
+    """
+    Represents a single index that stores the chunk embeddings of every
+    document, as an alternative to one sub-index file per document.
+    Each chunk is stored with a 64-bit ID built from the key of its
+    document and its position inside the document, so that searches can
+    be restricted to a set of documents with an ID selector and a query
+    over many documents is a single search call.
+
+    As for the root index, changes are recorded in an append-only log that
+    is replayed on startup and emptied by checkpoint(), and the chunks of
+    removed documents are tombstoned until compact() removes them.
+    """
+    def __init__(
+        self,
+        embedding_length: int,
+        data_root: str,
+        chunk_index_name: str,
+        read_only: bool = False,
+        encoding: str = index_encoding.FLAT
+    ) -> None:
+        """
+        Initializes the ChunkIndex object with the given parameters.
+
+        Args:
+        - embedding_length (int): The length of the embeddings to be stored.
+        - data_root (str): The root directory for the index file.
+        - chunk_index_name (str): The name of the chunk index file.
+        - read_only (bool): Whether to open the index file in read-only
+            mode. Every write operation then raises a RuntimeError.
+        - encoding (str): The encoding of the stored embeddings.
+            The index is filled incrementally so encodings that need
+            training fall back to "sq_fp16".
+        """
+        self.embedding_length = embedding_length
+        self.read_only = read_only
+        self.index_path = pathlib.Path(data_root) / f"{chunk_index_name}.{_EXT}"
+
+        if self.index_path.exists():
+            # The index is an IDMap, which faiss cannot memory-map
+            self.index: faiss.IndexIDMap = faiss.read_index(
+                str(self.index_path))
+        else:
+            encoding = index_encoding.untrained_encoding(encoding)
+            self.index = faiss.IndexIDMap(faiss.index_factory(
+                embedding_length,
+                index_encoding.factory_string(
+                    encoding, embedding_length, 0, 0)
+            ))
+
+        # The keys of the removed documents whose chunks are still stored,
+        # the file can list keys that a compaction already removed
+        self._tombstones_path = self.index_path.with_suffix(".tombstones")
+        tombstones = utils.read_ids(self._tombstones_path)
+        keys, counts = np.unique(
+            faiss.vector_to_array(self.index.id_map) >> _CHUNK_BITS,
+            return_counts=True
+        )
+        # The number of stored chunks of each document key
+        self._key_sizes: dict[int, int] = dict(
+            zip(keys.tolist(), counts.tolist()))
+        self._tombstones: set[int] = {
+            key for key in tombstones.tolist() if key in self._key_sizes
+        }
+
+        # Searches share the index, changes to it and its log are exclusive
+        self._lock = RWLock()
+        # Serializes the checkpoints, which only read the index
+        self._checkpoint_lock = threading.Lock()
+        # Serializes the compactions, see VectorIndex.compact_root
+        self._compaction_lock = threading.Lock()
+        self._compaction_ops = None
+        self._compacted = False
+        self.log = None
+        if not self.read_only:
+            self.log = index_log.IndexLog(
+                self.index_path.with_suffix(".log"),
+                embedding_length
+            )
+            self._replay_log()
+
+    def close(self) -> None:
+        if self.read_only:
+            return
+        self.checkpoint()
+        self.log.close()
+
+    def checkpoint(self) -> None:
+        """
+        Atomically writes the index to disk and empties its log. Does
+        nothing if the index did not change since the last checkpoint.
+        """
+        if self.read_only:
+            return
+        with self._checkpoint_lock:
+            # See VectorIndex.checkpoint
+            with self._lock.read():
+                log_size = self.log.size()
+                if (
+                    log_size == 0
+                    and self.index_path.exists()
+                    and not self._compacted
+                ):
+                    return
+                data = faiss.serialize_index(self.index)
+                tombstones = utils.ids_to_np(sorted(self._tombstones))
+                self._compacted = False
+            try:
+                utils.write_bytes_atomic(data, self.index_path)
+                utils.write_ids_atomic(tombstones, self._tombstones_path)
+            except Exception:
+                self._compacted = True
+                raise
+            self.log.truncate(log_size)
+
+    def _replay_log(self) -> None:
+        """
+        Applies the operations logged since the last checkpoint. Chunks
+        already part of the checkpoint are not added twice.
+        """
+        operations = self.log.replay()
+        if not operations:
+            return
+        stored_ids = set(faiss.vector_to_array(self.index.id_map).tolist())
+        for operation, ids, embeddings in operations:
+            if operation == index_log.CLEAR:
+                self._clear()
+                stored_ids.clear()
+            elif operation == index_log.ADD:
+                document_key = int(ids[0]) >> _CHUNK_BITS
+                if document_key in self._tombstones:
+                    self._purge(document_key)
+                    stored_ids = {
+                        chunk_id for chunk_id in stored_ids
+                        if chunk_id >> _CHUNK_BITS != document_key
+                    }
+                missing = np.array(
+                    [chunk_id not in stored_ids for chunk_id in ids.tolist()],
+                    dtype=bool
+                )
+                if missing.any():
+                    self._add(document_key, embeddings[missing], ids[missing])
+                    stored_ids.update(ids[missing].tolist())
+            elif operation == index_log.REMOVE:
+                # Removals are logged with the key of the document
+                self._remove(int(ids[0]))
+
+    def size(self) -> int:
+        return self.index.ntotal
+
+    def tombstone_ratio(self) -> float:
+        """
+        Returns the fraction of the stored chunks that belong to removed
+        documents.
+        """
+        with self._lock.read():
+            if self.index.ntotal == 0:
+                return 0.0
+            return sum(
+                self._key_sizes[key] for key in self._tombstones
+            ) / self.index.ntotal
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(
+                "The chunk index is opened in read-only mode")
+
+    @staticmethod
+    def _document_range(document_key: int) -> faiss.IDSelectorRange:
+        return faiss.IDSelectorRange(
+            document_key << _CHUNK_BITS,
+            (document_key + 1) << _CHUNK_BITS
+        )
+
+    def _chunk_ids(self, document_keys: list[int]) -> np.ndarray:
+        """
+        Returns the IDs of the stored chunks of the given documents. The
+        chunks of a document are always stored with the positions 0 to its
+        chunk count, so the IDs are built without scanning the index.
+        """
+        sizes = [self._key_sizes.get(key, 0) for key in document_keys]
+        if sum(sizes) == 0:
+            return utils.ids_to_np([])
+        return np.concatenate([
+            (key << _CHUNK_BITS) + np.arange(size, dtype=np.int64)
+            for key, size in zip(document_keys, sizes)
+        ])
+
+    def add(
+        self,
+        document_key: int,
+        embeddings: list[list[float]]
+    ) -> list[int]:
+        """
+        Adds the chunk embeddings of the document with the given key.
+
+        Args:
+        - document_key (int): The key of the document, its root index ID.
+        - embeddings (list[list[float]]): The embeddings to add to the index.
+
+        Returns:
+        - list[int]: The position of each chunk inside the document, which
+            is also the faiss ID stored in the document metadata.
+        """
+        self._check_writable()
+        chunk_ids = utils.generate_ids(0, len(embeddings))
+        index_embeddings = utils.embeddings_to_np(embeddings)
+        faiss.normalize_L2(index_embeddings)
+        ids = utils.ids_to_np([
+            (document_key << _CHUNK_BITS) | chunk_id for chunk_id in chunk_ids
+        ])
+        with self._lock.write():
+            self.log.append(index_log.ADD, ids, index_embeddings)
+            if document_key in self._tombstones:
+                # The key of a removed document is reused once its root
+                # embedding is compacted, its chunks must go first
+                self._purge(document_key)
+            self._add(document_key, index_embeddings, ids)
+        return chunk_ids
+
+    def _add(
+        self,
+        document_key: int,
+        index_embeddings: np.ndarray,
+        ids: np.ndarray
+    ) -> None:
+        self.index.add_with_ids(index_embeddings, ids)
+        self._key_sizes[document_key] = (
+            self._key_sizes.get(document_key, 0) + len(ids))
+        if self._compaction_ops is not None:
+            self._compaction_ops.append((index_embeddings, ids))
+
+    def _purge(self, document_key: int) -> None:
+        self.index.remove_ids(self._document_range(document_key))
+        self._key_sizes.pop(document_key, None)
+        self._tombstones.discard(document_key)
+        if self._compaction_ops is not None:
+            self._compaction_ops.append(document_key)
+
+    def remove(
+        self,
+        document_key: int
+    ) -> None:
+        """
+        Removes every chunk of the document with the given key. The chunks
+        are tombstoned until the next compaction.
+
+        Args:
+        - document_key (int): The key of the document, its root index ID.
+        """
+        self._check_writable()
+        with self._lock.write():
+            self.log.append(index_log.REMOVE, utils.ids_to_np([document_key]))
+            self._remove(document_key)
+
+    def _remove(self, document_key: int) -> None:
+        if document_key in self._key_sizes:
+            self._tombstones.add(document_key)
+
+    def clear(self) -> None:
+        self._check_writable()
+        with self._lock.write():
+            self.log.append(index_log.CLEAR, utils.ids_to_np([]))
+            self._clear()
+
+    def _clear(self) -> None:
+        self.index.reset()
+        self._key_sizes.clear()
+        self._tombstones.clear()
+        if self._compaction_ops is not None:
+            self._compaction_ops.append(None)
+
+    def reconstruct(self, document_key: int) -> tuple[list[int], np.ndarray]:
+        """
+        Returns the chunk embeddings of the document with the given key.
+
+        Args:
+        - document_key (int): The key of the document, its root index ID.
+
+        Returns:
+        - tuple[list[int], np.ndarray]: The position of each chunk inside the
+            document and its embedding, in the order of the positions.
+        """
+        with self._lock.read():
+            if document_key in self._tombstones:
+                return [], np.zeros((0, self.embedding_length), dtype=np.float32)
+            ids = faiss.vector_to_array(self.index.id_map)
+            positions = np.flatnonzero(ids >> _CHUNK_BITS == document_key)
+            positions = positions[np.argsort(ids[positions])]
+            vectors = np.stack([
+                self.index.index.reconstruct(int(position))
+                for position in positions
+            ]) if len(positions) > 0 else np.zeros(
+                (0, self.embedding_length), dtype=np.float32)
+        chunk_mask = (1 << _CHUNK_BITS) - 1
+        return (ids[positions] & chunk_mask).tolist(), vectors
+
+    def compact(self, min_ratio: float = 0.0) -> bool:
+        """
+        Physically removes the tombstoned chunks if they make up at least
+        min_ratio of the index, without blocking the searches, see
+        VectorIndex.compact_root.
+
+        Args:
+        - min_ratio (float): The minimum tombstone ratio, see
+            tombstone_ratio.
+
+        Returns:
+        - bool: Whether the index was compacted.
+        """
+        self._check_writable()
+        with self._compaction_lock:
+            with self._lock.read():
+                dead = sum(self._key_sizes[key] for key in self._tombstones)
+                if dead == 0 or dead < min_ratio * self.index.ntotal:
+                    return False
+                compacted_keys = set(self._tombstones)
+                index = faiss.clone_index(self.index)
+                self._compaction_ops = []
+            try:
+                ids = faiss.vector_to_array(
+                    faiss.downcast_index(index).id_map)
+                dead_ids = ids[np.isin(
+                    ids >> _CHUNK_BITS,
+                    utils.ids_to_np(sorted(compacted_keys))
+                )]
+                index.remove_ids(faiss.IDSelectorBatch(
+                    len(dead_ids), faiss.swig_ptr(dead_ids)))
+            except Exception:
+                with self._lock.write():
+                    self._compaction_ops = None
+                raise
+            with self._lock.write():
+                operations, self._compaction_ops = self._compaction_ops, None
+                cleared = False
+                for operation in operations:
+                    if operation is None:
+                        index.reset()
+                        cleared = True
+                    elif isinstance(operation, int):
+                        index.remove_ids(self._document_range(operation))
+                    else:
+                        index.add_with_ids(*operation)
+                self.index = index
+                # The keys purged meanwhile can be tombstoned again with
+                # new chunks, that this compaction did not remove
+                purged = {
+                    operation for operation in operations
+                    if isinstance(operation, int)
+                }
+                if not cleared:
+                    for key in (compacted_keys - purged) & self._tombstones:
+                        self._tombstones.discard(key)
+                        self._key_sizes.pop(key, None)
+                self._compacted = True
+        return True
+
+    def query(
+        self,
+        document_keys: list[int],
+        query_embedding: list[float],
+        top_k: int = 5,
+        min_score: float | None = None
+    ) -> list[tuple[int, int, float]]:
+        """
+        Searches the chunks of the given documents with a single call and
+        returns the top-k nearest neighbors, closest first.
+
+        Args:
+        - document_keys (list[int]): The keys of the documents to search.
+        - query_embedding (list[float]): The embedding to query the index with.
+        - top_k (int): The number of nearest neighbors to return.
+        - min_score (float | None): If given, only the neighbors with at
+            least this cosine similarity are returned.
+
+        Returns:
+        - list[tuple[int, int, float]]: The nearest chunks as
+            (document_key, chunk_id, score) tuples.
+        """
+        return self.query_batch(
+            document_keys, [query_embedding], top_k, min_score)[0]
+
+    def query_batch(
+        self,
+        document_keys: list[int],
+        query_embeddings: list[list[float]],
+        top_k: int = 5,
+        min_score: float | None = None
+    ) -> list[list[tuple[int, int, float]]]:
+        """
+        Searches the chunks of the given documents with all the given
+        embeddings in a single call and returns the top-k nearest neighbors
+        of each, closest first.
+
+        Args:
+        - document_keys (list[int]): The keys of the documents to search.
+        - query_embeddings (list[list[float]]): The embeddings to query the
+            index with.
+        - top_k (int): The number of nearest neighbors to return.
+        - min_score (float | None): If given, only the neighbors with at
+            least this cosine similarity are returned.
+
+        Returns:
+        - list[list[tuple[int, int, float]]]: For each query, the nearest
+            chunks as (document_key, chunk_id, score) tuples.
+        """
+        with self._lock.read():
+            # The chunks of removed documents are not searched
+            chunk_ids = self._chunk_ids([
+                key for key in document_keys if key not in self._tombstones
+            ])
+        if len(chunk_ids) == 0:
+            return [[] for _ in query_embeddings]
+
+        # A single hashed set of the chunk IDs, so that the cost of the
+        # membership test does not grow with the number of documents
+        params = faiss.SearchParameters()
+        params.sel = faiss.IDSelectorBatch(
+            len(chunk_ids), faiss.swig_ptr(chunk_ids))
+
+        query_embeddings = utils.embeddings_to_np(query_embeddings)
+        faiss.normalize_L2(query_embeddings)
+        with self._lock.read():
+            if self.size() == 0:
+                return [[] for _ in query_embeddings]
+            results = utils.search(
+                self.index,
+                query_embeddings,
+                min(top_k, self.size()),
+                min_score,
+                params
+            )
+        chunk_mask = (1 << _CHUNK_BITS) - 1
+        return [
+            [
+                (chunk_id >> _CHUNK_BITS, chunk_id & chunk_mask, score)
+                for chunk_id, score in query_results
+            ]
+            for query_results in results
+        ]
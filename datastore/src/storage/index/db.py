@@ -1,9 +1,17 @@
 import os
 import pathlib
+import sys
+import threading
 
 import faiss
+import numpy as np
 
 from . import utils
+from . import root_index
+from . import log as index_log
+from . import encoding as index_encoding
+from .cache import SubIndexCache
+from .rwlock import RWLock, KeyedRWLock
 
 
 # The extension for the faiss index files
@@ -14,13 +22,32 @@ class VectorIndex:
     Represents a vector index that stores embeddings and allows for querying
     and updating the index. It is composed of a root index that stores all
     embeddings and sub-indexes that store embeddings for individual documents.
+
+    The root index is kept in memory and every change is recorded in an
+    append-only log next to it. checkpoint() writes the whole root index
+    and empties the log; on startup the log is replayed on top of the last
+    checkpoint, so no change is lost if the service is not shut down
+    cleanly.
+
+    Removed embeddings are only tombstoned: their IDs are skipped by the
+    searches until compact_root() physically removes them, so a removal
+    does not rewrite, or for HNSW rebuild, the root index. Likewise,
+    promote_root() builds the approximate root index in the background.
     """
     def __init__(
         self,
         embedding_length: int,
         data_root: str,
         root_index_name: str,
-        sub_index_path: str
+        sub_index_path: str,
+        sub_index_cache_size: int = 0,
+        read_only: bool = False,
+        root_index_type: str = root_index.FLAT,
+        root_index_promotion_threshold: int = 10_000,
+        root_index_params: dict[str, int] | None = None,
+        encoding: str = index_encoding.FLAT,
+        rerank_factor: int = 0,
+        pq_m: int = 64
     ) -> None:
         """
         Initializes the VectorIndex object with the given parameters.
@@ -30,53 +57,317 @@ class VectorIndex:
         - data_root (str): The root directory for the index files.
         - root_index_name (str): The name of the root index file.
         - sub_index_path (str): The path to the sub-index files.
+        - sub_index_cache_size (int): The maximum size, in bytes, of the
+            in-memory cache for the sub-indexes. 0 disables the cache.
+        - read_only (bool): Whether to open the index files in read-only
+            mode. The index files are then never modified and every write
+            operation raises a RuntimeError.
+        - root_index_type (str): The type of the root index, one of "flat",
+            "hnsw", "ivf_flat" or "ivf_pq". The root index starts as an
+            exact flat index and promote_root() rebuilds it with this type
+            once it stores root_index_promotion_threshold documents.
+        - root_index_promotion_threshold (int): The number of documents
+            after which the root index is promoted to root_index_type.
+        - root_index_params (dict[str, int] | None): The parameters of the
+            approximate root index, "hnsw_m", "nlist", "pq_m", "ef_search"
+            and "nprobe".
+        - encoding (str): The encoding of the stored embeddings, one of
+            "flat", "sq_fp16", "sq8" or "pq", see encoding.ENCODINGS.
+            Sub-indexes are built with all their embeddings and use it as
+            is, the flat root index is filled incrementally and falls back
+            to "sq_fp16" for the encodings that need training.
+        - rerank_factor (int): If set, sub-indexes also keep the exact
+            embeddings to re-rank rerank_factor * top_k candidates found
+            with the compressed ones, which takes more space than the
+            flat encoding. 0 disables re-ranking.
+        - pq_m (int): The maximum number of sub-quantizers of the "pq"
+            encoding.
         """
         
         self.embedding_length = embedding_length
+        if encoding not in index_encoding.ENCODINGS:
+            raise ValueError(f"Unknown index encoding {encoding}!")
+        self.encoding = encoding
+        self.rerank_factor = rerank_factor
+        if rerank_factor > 0 and encoding != index_encoding.FLAT:
+            print(
+                f"Re-ranking keeps the exact embeddings next to the {encoding}"
+                " ones, the sub-indexes are larger than with the flat"
+                " encoding",
+                file=sys.stderr
+            )
+        self.pq_m = pq_m
+        self.read_only = read_only
+        # faiss only memory-maps the inverted lists of IVF indexes, which
+        # are then shared through the page cache. The other index types
+        # are read fully in memory, the flags are ignored for them.
+        self._io_flags = (
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if read_only else 0
+        )
         self.sub_index_path = pathlib.Path(sub_index_path)
         self.root_path = pathlib.Path(data_root) / f"{root_index_name}.{_EXT}"
 
-        if not self.root_path.exists():
-            # The root index uses an IDMap to store the embeddings
-            # so that we can associate each embedding with an ID
-            # and an embedding can be removed without shifting the
-            # ids of other embeddings. 
-            tmp_index = faiss.IndexFlatL2(embedding_length)
-            tmp_id_index = faiss.IndexIDMap(tmp_index)
+        if root_index_type not in root_index.INDEX_TYPES:
+            raise ValueError(f"Unknown root index type {root_index_type}!")
+        self.root_index_type = root_index_type
+        self.root_index_promotion_threshold = max(
+            root_index_promotion_threshold,
+            root_index.min_training_size(root_index_type)
+        )
+        self.root_index_params = {
+            "hnsw_m": 32,
+            "nlist": 1024,
+            "pq_m": 64,
+            "ef_search": 64,
+            "nprobe": 16,
+            **(root_index_params or {})
+        }
+
+        if not self.root_path.exists() and not self.read_only:
+            # The root index starts as an exact flat index, see
+            # root_index.empty_flat_index
+            tmp_id_index = root_index.empty_flat_index(
+                embedding_length, encoding)
             faiss.write_index(tmp_id_index, str(self.root_path))
             del tmp_id_index
-            del tmp_index
         
-        self.root_index: faiss.IndexIDMap = faiss.read_index(str(self.root_path))
-
-    def close(self):
-        faiss.write_index(
+        self.root_index: faiss.Index = self._read_index(self.root_path)
+        root_index.set_search_params(
             self.root_index,
-            str(self.root_path)
+            self.root_index_params["ef_search"],
+            self.root_index_params["nprobe"]
         )
+        # The IDs of the removed embeddings still stored in the root index.
+        # The file is written after the index, so it can list IDs that a
+        # compaction already removed: they are dropped, but still count
+        # for the next ID, see _next_root_id.
+        self._tombstones_path = self.root_path.with_suffix(".tombstones")
+        tombstones = utils.read_ids(self._tombstones_path)
+        stored_ids = root_index.index_ids(self.root_index)
+        self._root_tombstones: set[int] = set(
+            tombstones[np.isin(tombstones, stored_ids)].tolist())
+        self._root_next_id = int(max(
+            stored_ids.max(initial=-1), tombstones.max(initial=-1))) + 1
+        # Built from the tombstones on the first search after they change,
+        # the search parameters holding it are built for every search
+        self._root_selector = None
+        self._root_selector_lock = threading.Lock()
+        # Searches share the root index, changes to it and its log are
+        # exclusive
+        self._root_lock = RWLock()
+        # Serializes the checkpoints, which only read the root index
+        self._checkpoint_lock = threading.Lock()
+        # Serializes the compactions and promotions. While one runs, the
+        # additions and clears are recorded to be applied to the new index
+        # too.
+        self._compaction_lock = threading.Lock()
+        self._compaction_ops = None
+        # Whether the root index was compacted or promoted since the last
+        # checkpoint, neither is logged
+        self._root_compacted = False
+        # Read-only processes never write the log, they serve the
+        # last checkpoint
+        self.root_log = None
+        if not self.read_only:
+            self.root_log = index_log.IndexLog(
+                self.root_path.with_suffix(".log"),
+                embedding_length
+            )
+            self._replay_root_log()
+        self.sub_index_cache = SubIndexCache(sub_index_cache_size)
+        self._sub_index_locks = KeyedRWLock()
+
+    def close(self):
+        if self.read_only:
+            return
+        self.checkpoint()
+        self.root_log.close()
+
+    def checkpoint(self) -> None:
+        """
+        Atomically writes the root index to disk and empties its log. Does
+        nothing if the root index did not change since the last checkpoint.
+        """
+        if self.read_only:
+            return
+        with self._checkpoint_lock:
+            # Only the in-memory snapshot holds the lock, the slow writes to
+            # disk do not block the changes, nor the searches queued behind
+            # them
+            with self._root_lock.read():
+                log_size = self.root_log.size()
+                if log_size == 0 and not self._root_compacted:
+                    return
+                data = faiss.serialize_index(self.root_index)
+                tombstones = utils.ids_to_np(sorted(self._root_tombstones))
+                self._root_compacted = False
+            try:
+                utils.write_bytes_atomic(data, self.root_path)
+                utils.write_ids_atomic(tombstones, self._tombstones_path)
+            except Exception:
+                self._root_compacted = True
+                raise
+            self.root_log.truncate(log_size)
 
-    def _get_index(
+    def _replay_root_log(self) -> None:
+        """
+        Applies the operations logged since the last checkpoint to the root
+        index. Operations that are already part of the checkpoint, because
+        the service stopped after writing it but before emptying the log,
+        are skipped: added IDs are only added if missing and removed IDs
+        only tombstoned if present.
+        """
+        operations = self.root_log.replay()
+        if not operations:
+            return
+        stored_ids = set(root_index.index_ids(self.root_index).tolist())
+        for operation, ids, embeddings in operations:
+            if operation == index_log.CLEAR:
+                self._clear_root()
+                stored_ids.clear()
+            elif operation == index_log.ADD:
+                missing = np.array(
+                    [root_id not in stored_ids for root_id in ids.tolist()],
+                    dtype=bool
+                )
+                if missing.any():
+                    self._add_to_root(embeddings[missing], ids[missing])
+                    stored_ids.update(ids[missing].tolist())
+                self._root_next_id = max(
+                    self._root_next_id, int(ids.max(initial=-1)) + 1)
+            elif operation == index_log.REMOVE:
+                present = [
+                    root_id for root_id in ids.tolist() if root_id in stored_ids
+                ]
+                if present:
+                    self._remove_from_root(utils.ids_to_np(present))
+
+    def cache_stats(self) -> dict[str, int]:
+        return self.sub_index_cache.stats()
+
+    def _get_cached_index(
         self,
-        index_path: pathlib.Path
+        uuid: str
     ) -> faiss.IndexFlatL2:
         """
-        Returns the faiss index at the given path. If the index does not exist,
-        a new index is created and saved to the path.
-        
+        Returns the sub-index with the given UUID, reading it from disk only
+        if it is not already in the sub-index cache. A sub-index that does
+        not exist, e.g. of a document a follower did not replicate yet, is
+        read as an empty index: reads never create sub-index files.
+
+        Args:
+        - uuid (str): The UUID of the sub-index.
+
+        Returns:
+        - faiss.IndexFlatL2: The sub-index with the given UUID.
+        """
+        index = self.sub_index_cache.get(uuid)
+        if index is None:
+            index_path = self.sub_index_path / f"{uuid}.{_EXT}"
+            if not index_path.exists():
+                return faiss.IndexFlatL2(self.embedding_length)
+            index = self._read_index(index_path)
+            self.sub_index_cache.put(uuid, index)
+        return index
+
+    def _read_index(
+        self,
+        index_path: pathlib.Path
+    ) -> faiss.Index:
+        """
+        Reads the faiss index at the given path. In read-only mode, the
+        inverted lists of IVF indexes are memory-mapped.
+
         Args:
         - index_path (pathlib.Path): The path to the index file.
-        
+
         Returns:
-        - faiss.IndexFlatL2: The faiss index at the given path."""
+        - faiss.Index: The faiss index at the given path.
+        """
         if not index_path.exists():
-            tmp_index = faiss.IndexFlatL2(self.embedding_length)
-            faiss.write_index(tmp_index, str(index_path))
-            del tmp_index
-        
-        return faiss.read_index(str(index_path))
+            # Only happens in read-only mode, where missing files are
+            # never created
+            return faiss.IndexIDMap(faiss.IndexFlatL2(self.embedding_length))
+        return faiss.read_index(str(index_path), self._io_flags)
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(
+                "The vector index is opened in read-only mode")
     
     def root_index_size(self) -> int:
-        return self.root_index.ntotal
+        return self.root_index.ntotal - len(self._root_tombstones)
+
+    def tombstone_ratio(self) -> float:
+        """
+        Returns the fraction of the embeddings stored in the root index
+        that are tombstoned.
+        """
+        with self._root_lock.read():
+            if self.root_index.ntotal == 0:
+                return 0.0
+            return len(self._root_tombstones) / self.root_index.ntotal
+
+    def _next_root_id(self) -> int:
+        # IDs are not reused while their document is stored, since other
+        # indexes (e.g. the ChunkIndex) use them as document keys, nor
+        # before the next checkpoint once removed, since the log replay
+        # identifies the embeddings by ID.
+        return self._root_next_id
+
+    def _should_promote_root(self) -> bool:
+        return (
+            self.root_index_type != root_index.FLAT
+            and root_index.index_type(self.root_index) == root_index.FLAT
+            and self.root_index_size() >= self.root_index_promotion_threshold
+        )
+
+    def promote_root(self) -> bool:
+        """
+        Rebuilds the root index with the configured approximate index type
+        once the exact flat index stores enough documents. Small corpora
+        keep the exact search, large ones get a sublinear one.
+
+        As for compact_root, the new index is built, and for IVF trained,
+        from a snapshot without holding the lock. The additions and clears
+        made meanwhile are then applied to it and only swapping the indexes
+        is exclusive.
+
+        Returns:
+        - bool: Whether the root index was promoted.
+        """
+        self._check_writable()
+        with self._compaction_lock:
+            with self._root_lock.read():
+                if not self._should_promote_root():
+                    return False
+                vectors, ids = root_index.index_vectors(self.root_index)
+                self._compaction_ops = []
+            try:
+                # Tombstoned embeddings are kept with their IDs, so the
+                # tombstones still apply to the new index
+                index = root_index.build_index(
+                    self.root_index_type,
+                    self.embedding_length,
+                    vectors,
+                    ids,
+                    self.root_index_params
+                )
+            except Exception:
+                with self._root_lock.write():
+                    self._compaction_ops = None
+                raise
+            del vectors
+            with self._root_lock.write():
+                operations, self._compaction_ops = self._compaction_ops, None
+                if None in operations:
+                    # Cleared meanwhile, the flat index starts over
+                    return False
+                for operation in operations:
+                    index.add_with_ids(*operation)
+                self.root_index = index
+                self._root_compacted = True
+        return True
     
     def add_to_root(
         self,
@@ -91,58 +382,208 @@ class VectorIndex:
         Returns:
         - int: The ID of the added embedding.
         """
+        self._check_writable()
         embeddings = [embedding]
-        ids = utils.generate_ids(
-            self.root_index_size(),
-            1
-        )
         index_embeddings = utils.embeddings_to_np(embeddings)
         faiss.normalize_L2(index_embeddings)
-        self.root_index.add_with_ids(index_embeddings, ids)
+        with self._root_lock.write():
+            ids = utils.generate_ids(
+                self._next_root_id(),
+                1
+            )
+            np_ids = utils.ids_to_np(ids)
+            self.root_log.append(index_log.ADD, np_ids, index_embeddings)
+            self._add_to_root(index_embeddings, np_ids)
+            self._root_next_id = ids[-1] + 1
+            if self._compaction_ops is not None:
+                self._compaction_ops.append((index_embeddings, np_ids))
         return ids[0]
+
+    def _add_to_root(
+        self,
+        index_embeddings: np.ndarray,
+        np_ids: np.ndarray
+    ) -> None:
+        self.root_index.add_with_ids(index_embeddings, np_ids)
     
     def remove_from_root(
         self,
         ids: int | list[int]
     ):
         """
-        Removes the embeddings with the given IDs from the root index.
+        Removes the embeddings with the given IDs from the root index. They
+        are tombstoned until the next compaction.
         
         Args:
         - ids (int | list[int]): The ID or list of IDs of the embeddings to remove.
         """
+        self._check_writable()
         if isinstance(ids, int):
             ids = [ids]
         np_ids = utils.ids_to_np(ids)
-        ids_to_remove = faiss.IDSelectorArray(
-            len(ids),
-            faiss.swig_ptr(np_ids)
+        with self._root_lock.write():
+            self.root_log.append(index_log.REMOVE, np_ids)
+            self._remove_from_root(np_ids)
+
+    def _remove_from_root(
+        self,
+        np_ids: np.ndarray
+    ) -> None:
+        self._root_tombstones.update(np_ids.tolist())
+        self._root_selector = None
+
+    def compact_root(self, min_ratio: float = 0.0) -> bool:
+        """
+        Physically removes the tombstoned embeddings from the root index if
+        they make up at least min_ratio of it. The index is copied and
+        compacted without holding the lock, so searches keep using the
+        current index meanwhile; only swapping the indexes is exclusive.
+
+        Args:
+        - min_ratio (float): The minimum tombstone ratio, see
+            tombstone_ratio.
+
+        Returns:
+        - bool: Whether the root index was compacted.
+        """
+        self._check_writable()
+        with self._compaction_lock:
+            with self._root_lock.read():
+                tombstones = len(self._root_tombstones)
+                if tombstones == 0 or (
+                    tombstones < min_ratio * self.root_index.ntotal
+                ):
+                    return False
+                compacted_ids = utils.ids_to_np(sorted(self._root_tombstones))
+                index = faiss.clone_index(self.root_index)
+                self._compaction_ops = []
+            try:
+                index = root_index.purge_ids(
+                    index, compacted_ids, self.root_index_params)
+            except Exception:
+                with self._root_lock.write():
+                    self._compaction_ops = None
+                raise
+            with self._root_lock.write():
+                operations, self._compaction_ops = self._compaction_ops, None
+                cleared = False
+                for operation in operations:
+                    if operation is None:
+                        index = root_index.empty_flat_index(
+                            self.embedding_length, self.encoding)
+                        cleared = True
+                    else:
+                        index.add_with_ids(*operation)
+                root_index.set_search_params(
+                    index,
+                    self.root_index_params["ef_search"],
+                    self.root_index_params["nprobe"]
+                )
+                self.root_index = index
+                # After a clear, the tombstones are only the later removals
+                if not cleared:
+                    self._root_tombstones.difference_update(
+                        compacted_ids.tolist())
+                self._root_selector = None
+                self._root_compacted = True
+        return True
+
+    def reconstruct_root(self, root_id: int) -> np.ndarray | None:
+        """
+        Returns the embedding stored in the root index with the given ID,
+        None if it was removed.
+        """
+        with self._root_lock.read():
+            if root_id in self._root_tombstones:
+                return None
+            return root_index.reconstruct(self.root_index, root_id)
+
+    def _search_params(self) -> faiss.SearchParameters | None:
+        with self._root_selector_lock:
+            if self._root_selector is None and self._root_tombstones:
+                self._root_selector = root_index.excluded_selector(
+                    self._root_tombstones)
+            selector = self._root_selector
+        return root_index.search_params(
+            self.root_index,
+            self.root_index_params["ef_search"],
+            self.root_index_params["nprobe"],
+            selector
         )
-        self.root_index.remove_ids(ids_to_remove)
 
     def query_root(
         self,
         query_embedding: list[float],
-        top_k: int = 5
-    ) -> list[int]:
+        top_k: int = 5,
+        min_score: float | None = None
+    ) -> list[tuple[int, float]]:
         """
         Queries the root index with the given embedding and returns the IDs
-        of the top-k nearest neighbors.
+        and scores of the top-k nearest neighbors.
 
         Args:
         - query_embedding (list[float]): The embedding to query the index with.
         - top_k (int): The number of nearest neighbors to return.
+        - min_score (float | None): If given, only the neighbors with at
+            least this cosine similarity are returned.
 
         Returns:
-        - list[int]: The IDs of the top-k nearest neighbors.
+        - list[tuple[int, float]]: The IDs and similarity scores of the 
+            top-k nearest neighbors, closest first.
         """
-        query_embedding = utils.embeddings_to_np([query_embedding])
-        faiss.normalize_L2(query_embedding)
-        _, ids = self.root_index.search(query_embedding, min(top_k, self.root_index_size()))
-        return ids[0].tolist()
+        return self.query_root_batch([query_embedding], top_k, min_score)[0]
+
+    def query_root_batch(
+        self,
+        query_embeddings: list[list[float]],
+        top_k: int = 5,
+        min_score: float | None = None
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Queries the root index with all the given embeddings in a single
+        search and returns the IDs and scores of the top-k nearest neighbors
+        of each.
+
+        Args:
+        - query_embeddings (list[list[float]]): The embeddings to query the
+            index with.
+        - top_k (int): The number of nearest neighbors to return.
+        - min_score (float | None): If given, only the neighbors with at
+            least this cosine similarity are returned.
+
+        Returns:
+        - list[list[tuple[int, float]]]: For each query, the IDs and
+            similarity scores of the top-k nearest neighbors, closest first.
+        """
+        query_embeddings = utils.embeddings_to_np(query_embeddings)
+        faiss.normalize_L2(query_embeddings)
+        with self._root_lock.read():
+            if self.root_index_size() == 0:
+                return [[] for _ in query_embeddings]
+            return utils.search(
+                self.root_index,
+                query_embeddings,
+                min(top_k, self.root_index_size()),
+                min_score,
+                self._search_params()
+            )
     
     def clear_root(self):
-        self.root_index.reset()
+        self._check_writable()
+        with self._root_lock.write():
+            self.root_log.append(index_log.CLEAR, utils.ids_to_np([]))
+            self._clear_root()
+            if self._compaction_ops is not None:
+                self._compaction_ops.append(None)
+
+    def _clear_root(self) -> None:
+        # Go back to a brute-force index, it will be promoted again once
+        # enough documents are added
+        self.root_index = root_index.empty_flat_index(
+            self.embedding_length, self.encoding)
+        self._root_tombstones.clear()
+        self._root_selector = None
+        self._root_next_id = 0
 
     def add(
         self,
@@ -159,12 +600,27 @@ class VectorIndex:
         Returns:
         - list[int]: The IDs of the added embeddings.
         """
+        self._check_writable()
         index_path = self.sub_index_path / f"{uuid}.{_EXT}"
-        index = self._get_index(index_path)
         index_embeddings = utils.embeddings_to_np(embeddings)
         faiss.normalize_L2(index_embeddings)
-        index.add(index_embeddings)
-        faiss.write_index(index, str(index_path))
+        with self._sub_index_locks.write(uuid):
+            if index_path.exists():
+                index = self._read_index(index_path)
+                index.add(index_embeddings)
+            else:
+                # All the embeddings of the document are known, so they are
+                # used to train the encoding
+                index = index_encoding.build_index(
+                    self.encoding,
+                    self.embedding_length,
+                    index_embeddings,
+                    self.rerank_factor,
+                    self.pq_m
+                )
+            # A failed write must not leave a truncated sub-index behind
+            utils.write_index_atomic(index, index_path)
+            self.sub_index_cache.invalidate(uuid)
         return [i for i in range(len(embeddings))]
 
     def remove(
@@ -177,31 +633,88 @@ class VectorIndex:
         Args:
         - index_name (str): The name of the index to remove.
         """
+        self._check_writable()
         index_path = self.sub_index_path / f"{index_name}.{_EXT}"
-        if os.path.isfile(index_path):
-            os.remove(index_path)
+        with self._sub_index_locks.write(index_name):
+            if os.path.isfile(index_path):
+                os.remove(index_path)
+            self.sub_index_cache.invalidate(index_name)
+        self._sub_index_locks.discard(index_name)
+
+    def reconstruct(self, uuid: str) -> np.ndarray:
+        """
+        Returns the embeddings stored in the index with the given UUID, in
+        the order of their IDs.
+        """
+        with self._sub_index_locks.read(uuid):
+            index = self._get_cached_index(uuid)
+            return index.reconstruct_n(0, index.ntotal)
+
+    def clear(self) -> None:
+        """
+        Drops every cached sub-index. Used when all the sub-index files
+        are removed from disk.
+        """
+        self.sub_index_cache.clear()
+        self._sub_index_locks.clear()
     
     def query(
         self,
         uuid: str,
         query_embedding: list[float],
-        top_k: int = 5
-    ) -> list[int]:
+        top_k: int = 5,
+        min_score: float | None = None
+    ) -> list[tuple[int, float]]:
         """
         Queries the index with the given UUID using the given embedding and
-        returns the IDs of the top-k nearest neighbors.
+        returns the IDs and scores of the top-k nearest neighbors.
 
         Args:
         - uuid (str): The UUID of the index to query.
         - query_embedding (list[float]): The embedding to query the index with.
         - top_k (int): The number of nearest neighbors to return.
+        - min_score (float | None): If given, only the neighbors with at
+            least this cosine similarity are returned.
 
         Returns:
-        - list[int]: The IDs of the top-k nearest neighbors.
+        - list[tuple[int, float]]: The IDs and similarity scores of the
+            top-k nearest neighbors, closest first.
         """
-        index_path = self.sub_index_path / f"{uuid}.{_EXT}"
-        index = self._get_index(index_path)
-        query_embedding = utils.embeddings_to_np([query_embedding])
-        faiss.normalize_L2(query_embedding)
-        _, ids = index.search(query_embedding, min(top_k, index.ntotal))
-        return ids[0].tolist()
\ No newline at end of file
+        return self.query_batch(uuid, [query_embedding], top_k, min_score)[0]
+
+    def query_batch(
+        self,
+        uuid: str,
+        query_embeddings: list[list[float]],
+        top_k: int = 5,
+        min_score: float | None = None
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Queries the index with the given UUID using all the given embeddings
+        in a single search and returns the IDs and scores of the top-k
+        nearest neighbors of each.
+
+        Args:
+        - uuid (str): The UUID of the index to query.
+        - query_embeddings (list[list[float]]): The embeddings to query the
+            index with.
+        - top_k (int): The number of nearest neighbors to return.
+        - min_score (float | None): If given, only the neighbors with at
+            least this cosine similarity are returned.
+
+        Returns:
+        - list[list[tuple[int, float]]]: For each query, the IDs and
+            similarity scores of the top-k nearest neighbors, closest first.
+        """
+        query_embeddings = utils.embeddings_to_np(query_embeddings)
+        faiss.normalize_L2(query_embeddings)
+        with self._sub_index_locks.read(uuid):
+            index = self._get_cached_index(uuid)
+            if index.ntotal == 0:
+                return [[] for _ in query_embeddings]
+            return utils.search(
+                index,
+                query_embeddings,
+                min(top_k, index.ntotal),
+                min_score
+            )
\ No newline at end of file
@@ -0,0 +1,131 @@
+import math
+import sys
+
+import faiss
+import numpy as np
+
+from . import utils
+
+
+# The supported encodings of the stored embeddings, from the largest and
+# exact to the smallest and most approximate:
+# - flat: float32, 4 bytes per dimension
+# - sq_fp16: float16 scalar quantization, 2 bytes per dimension
+# - sq8: 8-bit scalar quantization, 1 byte per dimension
+# - pq: product quantization, 1 byte per sub-quantizer
+FLAT = "flat"
+SQ_FP16 = "sq_fp16"
+SQ8 = "sq8"
+PQ = "pq"
+ENCODINGS = (FLAT, SQ_FP16, SQ8, PQ)
+
+# The PQ codebooks use 8 bits per sub-quantizer, so training needs at
+# least 2^8 embeddings
+_PQ_NBITS = 8
+_PQ_MIN_TRAINING_SIZE = 1 << _PQ_NBITS
+
+
+def needs_training(encoding: str) -> bool:
+    """
+    Returns whether an index with the given encoding must be trained on
+    the embeddings before they can be added.
+    """
+    return encoding in (SQ8, PQ)
+
+def pq_min_size(embedding_length: int, pq_m: int) -> int:
+    """
+    Returns the number of embeddings from which a PQ index is smaller than
+    an SQ8 one. Each index trains its own codebooks, 2^8 float32 centroids
+    of every sub-vector, i.e. 1 KiB per dimension, which only the smaller
+    codes of PQ (pq_m bytes per embedding instead of embedding_length) pay
+    back. Never less than the number of embeddings training needs.
+    """
+    m = utils.pq_sub_quantizers(embedding_length, pq_m)
+    if m >= embedding_length:
+        # The codes are not smaller than SQ8 ones
+        return sys.maxsize
+    codebook_size = (1 << _PQ_NBITS) * embedding_length * 4
+    return max(
+        _PQ_MIN_TRAINING_SIZE,
+        math.ceil(codebook_size / (embedding_length - m))
+    )
+
+def untrained_encoding(encoding: str) -> str:
+    """
+    Returns the given encoding if it does not need training, otherwise the
+    closest one that does not. Used for the indexes that are created empty
+    and filled incrementally.
+    """
+    return SQ_FP16 if needs_training(encoding) else encoding
+
+def factory_string(
+    encoding: str,
+    embedding_length: int,
+    training_size: int,
+    pq_m: int
+) -> str:
+    """
+    Returns the faiss index factory description of the storage for the
+    given encoding. PQ falls back to SQ8 when there are too few embeddings
+    for its codebooks to pay off, see pq_min_size.
+
+    Args:
+    - encoding (str): The encoding, one of ENCODINGS.
+    - embedding_length (int): The length of the embeddings.
+    - training_size (int): The number of embeddings available for training.
+    - pq_m (int): The maximum number of PQ sub-quantizers.
+
+    Returns:
+    - str: The index factory description.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown index encoding {encoding}!")
+    if encoding == PQ and training_size < pq_min_size(embedding_length, pq_m):
+        encoding = SQ8
+    if needs_training(encoding) and training_size == 0:
+        encoding = SQ_FP16
+    if encoding == PQ:
+        m = utils.pq_sub_quantizers(embedding_length, pq_m)
+        return f"PQ{m}x{_PQ_NBITS}"
+    return {
+        FLAT: "Flat",
+        SQ_FP16: "SQfp16",
+        SQ8: "SQ8",
+    }[encoding]
+
+def build_index(
+    encoding: str,
+    embedding_length: int,
+    vectors: np.ndarray,
+    rerank_factor: int = 0,
+    pq_m: int = 64
+) -> faiss.Index:
+    """
+    Builds an index that stores the given normalized embeddings with the
+    given encoding. If rerank_factor is set, the index also keeps the exact
+    float32 embeddings: the compressed codes select rerank_factor * k
+    candidates that are then re-ranked with the exact distances. This
+    improves the accuracy but the exact embeddings take the same space as
+    a flat index, so the index is larger than a flat one.
+
+    Args:
+    - encoding (str): The encoding, one of ENCODINGS.
+    - embedding_length (int): The length of the embeddings.
+    - vectors (np.ndarray): The embeddings to add, also used for training.
+    - rerank_factor (int): The re-ranking factor, 0 disables re-ranking.
+    - pq_m (int): The maximum number of PQ sub-quantizers.
+
+    Returns:
+    - faiss.Index: The new index containing the embeddings.
+    """
+    description = factory_string(encoding, embedding_length, len(vectors), pq_m)
+    if rerank_factor > 0 and description != "Flat":
+        description += ",RFlat"
+    index = faiss.index_factory(embedding_length, description)
+    if rerank_factor > 0 and description.endswith(",RFlat"):
+        faiss.downcast_index(index).k_factor = rerank_factor
+    if not index.is_trained:
+        index.train(vectors)
+    if len(vectors) > 0:
+        index.add(vectors)
+    return index
@@ -0,0 +1,154 @@
+import os
+import pathlib
+import struct
+import threading
+
+import numpy as np
+
+from . import utils
+
+
+# Operations recorded in the log
+ADD = b"A"
+REMOVE = b"R"
+CLEAR = b"C"
+
+# Each record is the operation, the number of IDs and, for additions,
+# the number of embeddings; followed by the IDs as int64 and the
+# embeddings as float32, all little-endian
+_HEADER = struct.Struct("<cII")
+
+
+class IndexLog:
+    """
+    Represents an append-only log of the operations applied to an index
+    since its last checkpoint. Every operation is written and synced to
+    disk before it is applied, so that after a crash the index can be
+    rebuilt by replaying the log on top of the last checkpoint. The cost
+    of an operation is proportional to the data it changes, not to the
+    size of the index.
+    """
+    def __init__(
+        self,
+        log_path: pathlib.Path,
+        embedding_length: int
+    ) -> None:
+        """
+        Initializes the IndexLog object with the given parameters.
+
+        Args:
+        - log_path (pathlib.Path): The path to the log file.
+        - embedding_length (int): The length of the logged embeddings.
+        """
+        self.log_path = log_path
+        self.embedding_length = embedding_length
+        self._lock = threading.Lock()
+        self._file = open(self.log_path, "ab")
+
+    def close(self) -> None:
+        self._file.close()
+
+    def size(self) -> int:
+        """
+        Returns the size in bytes of the operations logged since the last
+        checkpoint.
+        """
+        with self._lock:
+            return self._file.tell()
+
+    def append(
+        self,
+        operation: bytes,
+        ids: np.ndarray,
+        embeddings: np.ndarray | None = None
+    ) -> None:
+        """
+        Appends the given operation to the log and syncs it to disk.
+
+        Args:
+        - operation (bytes): The operation, one of ADD, REMOVE or CLEAR.
+        - ids (np.ndarray): The IDs the operation applies to.
+        - embeddings (np.ndarray | None): The embeddings added, only for
+            ADD operations.
+        """
+        ids = np.ascontiguousarray(ids, dtype="<i8")
+        record = [_HEADER.pack(
+            operation,
+            len(ids),
+            0 if embeddings is None else len(embeddings)
+        ), ids.tobytes()]
+        if embeddings is not None:
+            record.append(
+                np.ascontiguousarray(embeddings, dtype="<f4").tobytes())
+
+        with self._lock:
+            self._file.write(b"".join(record))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def replay(self) -> list[tuple[bytes, np.ndarray, np.ndarray | None]]:
+        """
+        Reads the operations logged since the last checkpoint. A record
+        truncated by a crash while it was being written is discarded and
+        cut from the file, so that the next appended record follows the
+        last complete one. Must be called before any append.
+
+        Returns:
+        - list[tuple[bytes, np.ndarray, np.ndarray | None]]: The logged
+            operations as (operation, ids, embeddings) tuples, in order.
+        """
+        with self._lock:
+            data = self.log_path.read_bytes()
+
+        operations = []
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            operation, ids_count, embeddings_count = _HEADER.unpack_from(
+                data, offset)
+            ids_size = ids_count * 8
+            embeddings_size = embeddings_count * self.embedding_length * 4
+            end = offset + _HEADER.size + ids_size + embeddings_size
+            if end > len(data):
+                break
+            start = offset + _HEADER.size
+            ids = np.frombuffer(
+                data, dtype="<i8", count=ids_count, offset=start).copy()
+            embeddings = None
+            if embeddings_count:
+                embeddings = np.frombuffer(
+                    data,
+                    dtype="<f4",
+                    count=embeddings_count * self.embedding_length,
+                    offset=start + ids_size
+                ).reshape(embeddings_count, self.embedding_length).copy()
+            operations.append((operation, ids, embeddings))
+            offset = end
+
+        if offset < len(data):
+            with self._lock:
+                self._file.truncate(offset)
+                self._file.seek(offset)
+                os.fsync(self._file.fileno())
+        return operations
+
+    def truncate(self, size: int) -> None:
+        """
+        Removes the first size bytes of the log, once their operations are
+        part of a checkpoint. The operations logged since, while the
+        checkpoint was written, are kept.
+
+        Args:
+        - size (int): The size of the log when the checkpointed index was
+            snapshotted, see size.
+        """
+        with self._lock:
+            if self._file.tell() == size:
+                self._file.truncate(0)
+                self._file.seek(0)
+                os.fsync(self._file.fileno())
+                return
+            # Appends are synced, so the file holds every record
+            tail = self.log_path.read_bytes()[size:]
+            self._file.close()
+            utils.write_bytes_atomic(tail, self.log_path)
+            self._file = open(self.log_path, "ab")
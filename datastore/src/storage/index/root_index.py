@@ -0,0 +1,259 @@
+import faiss
+import numpy as np
+
+from . import utils
+from . import encoding as index_encoding
+
+
+# The supported root index types. "flat" is an exact brute-force search,
+# the others are approximate searches that scale sublinearly
+FLAT = "flat"
+HNSW = "hnsw"
+IVF_FLAT = "ivf_flat"
+IVF_PQ = "ivf_pq"
+INDEX_TYPES = (FLAT, HNSW, IVF_FLAT, IVF_PQ)
+
+# Minimum number of training points per IVF centroid, below this faiss
+# warns that the clustering is unreliable
+_MIN_POINTS_PER_CENTROID = 39
+# The PQ codebooks use 8 bits per sub-quantizer
+_PQ_NBITS = 8
+
+
+def empty_flat_index(
+    embedding_length: int,
+    encoding: str = index_encoding.FLAT
+) -> faiss.IndexIDMap:
+    """
+    Returns an empty brute-force root index. The IDMap associates each
+    embedding with an ID so that an embedding can be removed without
+    shifting the IDs of the other embeddings. The embeddings are stored
+    with the given encoding if it does not need training, see
+    encoding.untrained_encoding.
+    """
+    encoding = index_encoding.untrained_encoding(encoding)
+    return faiss.IndexIDMap(faiss.index_factory(
+        embedding_length,
+        index_encoding.factory_string(encoding, embedding_length, 0, 0)
+    ))
+
+def index_type(index: faiss.Index) -> str:
+    """
+    Returns the type of the given root index, one of INDEX_TYPES.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return IVF_PQ
+    if isinstance(index, faiss.IndexIVF):
+        return IVF_FLAT
+    inner_index = faiss.downcast_index(index.index)
+    if isinstance(inner_index, faiss.IndexHNSW):
+        return HNSW
+    return FLAT
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """
+    Returns the IDs of all the embeddings stored in the given root index.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            faiss.rev_swig_ptr(
+                invlists.get_ids(list_no),
+                invlists.list_size(list_no)
+            ).copy()
+            for list_no in range(index.nlist)
+        ])
+    return faiss.vector_to_array(index.id_map)
+
+def reconstruct(index: faiss.Index, root_id: int) -> np.ndarray | None:
+    """
+    Returns the embedding stored with the given ID in the given root index,
+    None if there is none. Indexes with a lossy encoding (e.g. "ivf_pq")
+    return its approximation.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        for list_no in range(index.nlist):
+            list_size = invlists.list_size(list_no)
+            if list_size == 0:
+                continue
+            offsets = np.flatnonzero(faiss.rev_swig_ptr(
+                invlists.get_ids(list_no), list_size) == root_id)
+            if len(offsets) > 0:
+                vector = np.empty(index.d, dtype=np.float32)
+                index.reconstruct_from_offset(
+                    list_no, int(offsets[0]), faiss.swig_ptr(vector))
+                return vector
+        return None
+    positions = np.flatnonzero(faiss.vector_to_array(index.id_map) == root_id)
+    if len(positions) == 0:
+        return None
+    return index.index.reconstruct(int(positions[0]))
+
+def index_vectors(index: faiss.IndexIDMap) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the embeddings and IDs stored in an IDMap based root index
+    (flat or HNSW), in the same order.
+    """
+    index = faiss.downcast_index(index)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    return vectors, faiss.vector_to_array(index.id_map)
+
+def set_search_params(
+    index: faiss.Index,
+    ef_search: int,
+    nprobe: int
+) -> None:
+    """
+    Applies the search-time parameters to the given root index. They are
+    not stored in the index file, so they must be set every time the index
+    is built or loaded.
+    """
+    kind = index_type(index)
+    if kind == HNSW:
+        faiss.downcast_index(index.index).hnsw.efSearch = ef_search
+    elif kind in (IVF_FLAT, IVF_PQ):
+        faiss.extract_index_ivf(index).nprobe = nprobe
+
+def excluded_selector(excluded_ids: set[int]) -> faiss.IDSelector:
+    """
+    Returns an ID selector that skips the embeddings with the given IDs.
+    The selector is only read by the searches, so it can be shared by
+    concurrent searches, unlike the search parameters holding it.
+    """
+    np_ids = np.array(sorted(excluded_ids), dtype=np.int64)
+    excluded = faiss.IDSelectorBatch(len(np_ids), faiss.swig_ptr(np_ids))
+    selector = faiss.IDSelectorNot(excluded)
+    # The selectors do not own the selector they wrap
+    selector.referenced_objects = [excluded]
+    return selector
+
+def search_params(
+    index: faiss.Index,
+    ef_search: int,
+    nprobe: int,
+    selector: faiss.IDSelector | None
+) -> faiss.SearchParameters | None:
+    """
+    Returns the search parameters of the given root index that only search
+    the embeddings accepted by the given selector, see excluded_selector,
+    None if there is none. Explicit search parameters replace the ones set
+    on the index, so they carry ef_search or nprobe again.
+
+    faiss.IndexIDMap.search temporarily replaces the selector of the
+    parameters it is given, so they must not be shared by concurrent
+    searches: new ones are returned on every call.
+    """
+    if selector is None:
+        return None
+    kind = index_type(index)
+    if kind == HNSW:
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search
+    elif kind in (IVF_FLAT, IVF_PQ):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe
+    else:
+        params = faiss.SearchParameters()
+    # The parameters do not own their selector
+    params.referenced_objects = [selector]
+    params.sel = selector
+    return params
+
+def purge_ids(
+    index: faiss.Index,
+    ids: np.ndarray,
+    params: dict[str, int]
+) -> faiss.Index:
+    """
+    Physically removes the embeddings with the given IDs from the given
+    root index and returns it. HNSW graphs do not support removals, so a
+    new index is built without the removed embeddings.
+    """
+    if index_type(index) == HNSW:
+        vectors, index_ids = index_vectors(index)
+        keep = ~np.isin(index_ids, ids)
+        return build_index(
+            HNSW,
+            index.d,
+            vectors[keep],
+            index_ids[keep],
+            params
+        )
+    index.remove_ids(faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+    return index
+
+def build_index(
+    kind: str,
+    embedding_length: int,
+    vectors: np.ndarray,
+    ids: np.ndarray,
+    params: dict[str, int]
+) -> faiss.Index:
+    """
+    Builds a root index of the given type containing the given normalized
+    embeddings. IVF indexes are trained on the embeddings themselves, with
+    the number of lists reduced if there are not enough of them.
+
+    Args:
+    - kind (str): The type of the index, one of INDEX_TYPES.
+    - embedding_length (int): The length of the embeddings.
+    - vectors (np.ndarray): The embeddings to add to the index.
+    - ids (np.ndarray): The ID of each embedding.
+    - params (dict[str, int]): The index parameters, "hnsw_m", "nlist",
+        "pq_m", "ef_search" and "nprobe".
+
+    Returns:
+    - faiss.Index: The new root index.
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown root index type {kind}!")
+
+    if kind == FLAT:
+        index = empty_flat_index(embedding_length)
+    elif kind == HNSW:
+        # HNSW does not support custom IDs, the IDMap provides them
+        index = faiss.IndexIDMap(
+            faiss.IndexHNSWFlat(embedding_length, params["hnsw_m"]))
+    else:
+        # IVF indexes store the IDs in the inverted lists and support
+        # removals natively, so they are not wrapped in an IDMap
+        nlist = max(1, min(
+            params["nlist"],
+            len(vectors) // _MIN_POINTS_PER_CENTROID
+        ))
+        quantizer = faiss.IndexFlatL2(embedding_length)
+        if kind == IVF_FLAT:
+            index = faiss.IndexIVFFlat(quantizer, embedding_length, nlist)
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer,
+                embedding_length,
+                nlist,
+                utils.pq_sub_quantizers(embedding_length, params["pq_m"]),
+                _PQ_NBITS
+            )
+        # The quantizer must outlive this function, the IVF index does
+        # not own it unless told so
+        index.own_fields = True
+        quantizer.this.disown()
+        index.train(vectors)
+
+    if len(vectors) > 0:
+        index.add_with_ids(vectors, ids)
+    set_search_params(index, params["ef_search"], params["nprobe"])
+    return index
+
+def min_training_size(kind: str) -> int:
+    """
+    Returns the minimum number of embeddings needed to build a root index
+    of the given type.
+    """
+    if kind == IVF_PQ:
+        return 1 << _PQ_NBITS
+    if kind == IVF_FLAT:
+        return _MIN_POINTS_PER_CENTROID
+    return 0
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import threading
+from typing import Iterator
+
+
+class RWLock:
+    """
+    A reader-writer lock: any number of readers can hold it at the same
+    time, while a writer holds it alone. Waiting writers are served before
+    new readers, so that a steady stream of searches cannot starve the
+    mutations.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class KeyedRWLock:
+    """
+    One RWLock per key, created on first use, used to lock each sub-index
+    independently.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._locks: dict[str, RWLock] = {}
+
+    def get(self, key: str) -> RWLock:
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = RWLock()
+            return lock
+
+    def read(self, key: str):
+        return self.get(key).read()
+
+    def write(self, key: str):
+        return self.get(key).write()
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._locks.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._locks.clear()
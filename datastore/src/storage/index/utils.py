@@ -1,3 +1,7 @@
+import os
+import pathlib
+
+import faiss
 import numpy as np
 
 def embeddings_to_np(embeddings: list[list[float]]) -> np.ndarray:
@@ -7,4 +11,167 @@ def generate_ids(start: int, count: int) -> list[int]:
     return [i for i in range(start, start + count)]
 
 def ids_to_np(ids: list[int]) -> np.ndarray:
-    return np.array(ids)
\ No newline at end of file
+    return np.array(ids, dtype=np.int64)
+
+def l2_to_similarity(distance: float) -> float:
+    """
+    Converts the squared L2 distance between two normalized embeddings to
+    their cosine similarity, in [-1, 1] where higher is more similar.
+    """
+    return 1.0 - distance / 2.0
+
+def similarity_to_l2(similarity: float) -> float:
+    """
+    Converts a cosine similarity to the squared L2 distance between two
+    normalized embeddings, the inverse of l2_to_similarity.
+    """
+    return 2.0 * (1.0 - similarity)
+
+def search(
+    index: faiss.Index,
+    query_embeddings: np.ndarray,
+    top_k: int,
+    min_score: float | None = None,
+    params: faiss.SearchParameters | None = None
+) -> list[list[tuple[int, float]]]:
+    """
+    Searches the given index with the given normalized embeddings and
+    returns, for each query, the IDs and similarity scores of its top-k
+    nearest neighbors, closest first. If min_score is given, a range search
+    is used so that only neighbors with at least that similarity are
+    returned.
+    """
+    if min_score is None:
+        distances, ids = index.search(query_embeddings, top_k, params=params)
+        # Missing results, when the index has less than top_k matching
+        # embeddings, are returned with ID -1
+        return [
+            [
+                (idx, l2_to_similarity(distance))
+                for distance, idx in zip(query_distances, query_ids)
+                if idx >= 0
+            ]
+            for query_distances, query_ids in zip(distances.tolist(), ids.tolist())
+        ]
+
+    try:
+        lims, distances, ids = index.range_search(
+            query_embeddings,
+            similarity_to_l2(min_score),
+            params=params
+        )
+    except RuntimeError:
+        # Some index types (e.g. with re-ranking) do not implement range
+        # search, the top-k results are filtered instead
+        return [
+            [(idx, score) for idx, score in query_results if score >= min_score]
+            for query_results in search(index, query_embeddings, top_k, None, params)
+        ]
+    result = []
+    for query_no in range(len(query_embeddings)):
+        start, end = int(lims[query_no]), int(lims[query_no + 1])
+        # Range search results are not sorted
+        order = np.argsort(distances[start:end])[:top_k] + start
+        result.append([
+            (int(ids[i]), l2_to_similarity(float(distances[i])))
+            for i in order
+        ])
+    return result
+
+def index_size_bytes(index: faiss.Index) -> int:
+    """
+    Estimates the memory used by the given index: the stored vectors, their
+    IDs, the trained codebooks, the exact vectors kept for re-ranking and
+    the HNSW graph. Indexes that do not expose their code size are assumed
+    to store full float32 vectors.
+    """
+    index = faiss.downcast_index(index)
+    float_size = np.dtype(np.float32).itemsize
+    id_size = np.dtype(np.int64).itemsize
+    if isinstance(index, faiss.IndexRefine):
+        return (
+            index_size_bytes(index.base_index)
+            + index_size_bytes(index.refine_index)
+        )
+    if isinstance(index, faiss.IndexIDMap):
+        return index_size_bytes(index.index) + index.id_map.size() * id_size
+    if isinstance(index, faiss.IndexHNSW):
+        return (
+            index_size_bytes(index.storage)
+            + index.hnsw.neighbors.size() * np.dtype(np.int32).itemsize
+        )
+    if isinstance(index, faiss.IndexIVF):
+        # The inverted lists store the ID of every vector with its code
+        size = (
+            index.ntotal * (index.code_size + id_size)
+            + index_size_bytes(index.quantizer)
+        )
+    else:
+        try:
+            code_size = index.sa_code_size()
+        except RuntimeError:
+            code_size = index.d * float_size
+        size = index.ntotal * code_size
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        size += index.pq.centroids.size() * float_size
+    elif isinstance(index, faiss.IndexScalarQuantizer):
+        size += index.sq.trained.size() * float_size
+    return size
+
+def pq_sub_quantizers(embedding_length: int, max_sub_quantizers: int) -> int:
+    """
+    Returns the largest number of PQ sub-quantizers not greater than
+    max_sub_quantizers that evenly divides the embedding length.
+    """
+    for m in range(min(max_sub_quantizers, embedding_length), 0, -1):
+        if embedding_length % m == 0:
+            return m
+    return 1
+
+def write_index_atomic(index: faiss.Index, index_path: pathlib.Path) -> None:
+    """
+    Writes the given index to a temporary file and renames it to the given
+    path, so that a crash while writing never leaves a corrupted index.
+    """
+    tmp_path = index_path.with_name(f"{index_path.name}.tmp")
+    faiss.write_index(index, str(tmp_path))
+    _replace_synced(tmp_path, index_path)
+
+def write_bytes_atomic(data, path: pathlib.Path) -> None:
+    """
+    Writes the given bytes, e.g. an index serialized with
+    faiss.serialize_index, to a temporary file and renames it to the given
+    path, see write_index_atomic.
+    """
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    _replace_synced(tmp_path, path)
+
+def write_ids_atomic(ids: np.ndarray, ids_path: pathlib.Path) -> None:
+    """
+    Writes the given IDs as raw little-endian int64 to a temporary file
+    and renames it to the given path, see write_index_atomic.
+    """
+    tmp_path = ids_path.with_name(f"{ids_path.name}.tmp")
+    ids.astype("<i8").tofile(tmp_path)
+    _replace_synced(tmp_path, ids_path)
+
+def read_ids(ids_path: pathlib.Path) -> np.ndarray:
+    """
+    Reads the IDs written by write_ids_atomic, none if the file does not
+    exist.
+    """
+    if not ids_path.exists():
+        return np.zeros(0, dtype=np.int64)
+    return np.fromfile(ids_path, dtype="<i8").astype(np.int64)
+
+def _replace_synced(tmp_path: pathlib.Path, path: pathlib.Path) -> None:
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
\ No newline at end of file
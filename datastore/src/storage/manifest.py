@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+import sys
+from typing import Optional
+
+from api_models import StoreManifest
+
+
+# Incremented when the manifest format changes incompatibly, newer
+# manifests are ignored
+MANIFEST_VERSION = 1
+_MANIFEST_NAME = "manifest.json"
+
+
+def read_manifest(data_root: str) -> Optional[StoreManifest]:
+    """
+    Reads the manifest of the store in the given directory.
+
+    Args:
+    - data_root (str): The root directory of the store.
+
+    Returns:
+    - Optional[StoreManifest]: The manifest, None if there is none or it
+        cannot be used.
+    """
+    manifest_path = Path(data_root) / _MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    try:
+        manifest = StoreManifest.model_validate_json(manifest_path.read_text())
+    except (OSError, ValueError) as e:
+        print(f"Could not read the store manifest: {e}", file=sys.stderr)
+        return None
+    if manifest.manifest_version > MANIFEST_VERSION:
+        print(
+            f"Unsupported store manifest version "
+            f"{manifest.manifest_version}", file=sys.stderr)
+        return None
+    return manifest
+
+def write_manifest(data_root: str, manifest: StoreManifest) -> None:
+    """
+    Writes the given manifest to a temporary file and renames it, so that
+    a crash while writing never leaves a truncated manifest.
+
+    Args:
+    - data_root (str): The root directory of the store.
+    - manifest (StoreManifest): The manifest to write.
+    """
+    manifest_path = Path(data_root) / _MANIFEST_NAME
+    tmp_path = manifest_path.with_name(f"{_MANIFEST_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(manifest.model_dump_json(indent=2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,131 @@
+import hashlib
+import math
+from typing import Iterable, Optional
+
+
+class BloomFilter:
+    """
+    A Bloom filter over strings: a fixed-size bit array where each item
+    sets k bits. An item whose bits are not all set was never added, an
+    item whose bits are all set was probably added. Items cannot be
+    removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        """
+        Initializes the BloomFilter object with the given parameters.
+
+        Args:
+        - capacity (int): The number of items for which the false positive
+            rate is error_rate, it grows beyond.
+        - error_rate (float): The expected false positive rate.
+        """
+        capacity = max(capacity, 1)
+        self.size_bits = math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hash_count = max(
+            1, round(self.size_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.size_bits + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # Double hashing, the k positions are derived from two 64-bit hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size_bits
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def clear(self) -> None:
+        self._bits = bytearray(len(self._bits))
+
+
+class MembershipIndex:
+    """
+    Represents an in-memory index of the hashes and UUIDs of the stored
+    documents, used to answer existence checks without querying the
+    metadata database.
+
+    By default the hashes and UUIDs are kept in sets and the answers are
+    exact. With a Bloom filter, the memory used does not depend on the
+    length of the keys, but a positive answer is only probable: contains_*
+    return None in that case and the caller must check the database.
+    """
+
+    def __init__(
+        self,
+        bloom_filter: bool = False,
+        bloom_capacity: int = 1_000_000,
+        bloom_error_rate: float = 0.01
+    ) -> None:
+        """
+        Initializes the MembershipIndex object with the given parameters.
+
+        Args:
+        - bloom_filter (bool): Whether to use Bloom filters instead of sets.
+        - bloom_capacity (int): The number of documents the Bloom filters
+            are sized for.
+        - bloom_error_rate (float): The false positive rate of the Bloom
+            filters at capacity.
+        """
+        self.exact = not bloom_filter
+        if self.exact:
+            self._hashes = set()
+            self._uuids = set()
+        else:
+            self._hashes = BloomFilter(bloom_capacity, bloom_error_rate)
+            self._uuids = BloomFilter(bloom_capacity, bloom_error_rate)
+
+    def build(self, documents: Iterable[tuple[str, str]]) -> None:
+        """
+        Fills the index with the given documents.
+
+        Args:
+        - documents (Iterable[tuple[str, str]]): The (uuid, document_hash)
+            of each stored document.
+        """
+        for document_uuid, document_hash in documents:
+            self.add(document_uuid, document_hash)
+
+    def add(self, document_uuid: str, document_hash: str) -> None:
+        self._uuids.add(document_uuid)
+        self._hashes.add(document_hash)
+
+    def remove(self, document_uuid: str, document_hash: str) -> None:
+        # Bloom filters keep the bits of removed documents, the database
+        # check rejects these false positives
+        if self.exact:
+            self._uuids.discard(document_uuid)
+            self._hashes.discard(document_hash)
+
+    def clear(self) -> None:
+        self._uuids.clear()
+        self._hashes.clear()
+
+    def contains_hash(self, document_hash: str) -> Optional[bool]:
+        """
+        Returns False if no stored document has the given hash, True if one
+        does, or None if the Bloom filter cannot tell.
+        """
+        return self._contains(self._hashes, document_hash)
+
+    def contains_uuid(self, document_uuid: str) -> Optional[bool]:
+        """
+        Returns False if no stored document has the given UUID, True if one
+        does, or None if the Bloom filter cannot tell.
+        """
+        return self._contains(self._uuids, document_uuid)
+
+    def _contains(self, keys, key: str) -> Optional[bool]:
+        if key not in keys:
+            return False
+        return True if self.exact else None
@@ -1 +1 @@
-from .db import MetadataDB
\ No newline at end of file
+from .db import MetadataDB, DOCUMENT_INFO_COLUMNS
\ No newline at end of file
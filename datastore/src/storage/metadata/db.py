@@ -1,7 +1,11 @@
 from pathlib import Path
 import sqlite3
+from typing import Optional
 
 from . import tables
+from . import migrations
+from .pool import ConnectionPool, configure_connection, vacuum_database
+from .lexical import LexicalIndex
 
 from api_models import DocumentInfo
 
@@ -9,19 +13,46 @@ from api_models import DocumentInfo
 # The extension for the sqlite database files
 _EXT = "db"
 
+# The chunk store modes
+PER_DOCUMENT = "per_document"
+CONSOLIDATED = "consolidated"
+
+# The root table columns of the DocumentInfo fields that can be requested
+DOCUMENT_INFO_COLUMNS = {
+    "document_hash_str": "document_hash",
+    "document_filename": "document_filename",
+    "document_summary": "summary"
+}
+
+# Maximum number of (document_uuid, faiss_id) pairs looked up by a single
+# statement, two variables each, below SQLITE_MAX_VARIABLE_NUMBER
+_MAX_KEYS_PER_QUERY = 4096
+
 class MetadataDB:
     """
     Represents a metadata database that stores metadata for documents and
     allows for querying and updating the metadata. It is composed of a root
     database that stores metadata for all documents and sub-databases that
     store metadata for individual documents.
+
+    In the "consolidated" chunk store mode, the sub-databases are replaced by
+    a single chunk database whose table is clustered by (document_uuid,
+    faiss_id), so that the chunks of several documents are fetched with a
+    single indexed query.
     """
     
     def __init__(
         self,
         data_root: str,
         root_db_name: str,
-        sub_index_path: str
+        sub_index_path: str,
+        max_connections: int = 64,
+        mmap_size: int = 64 * 1024 * 1024,
+        cache_size: int = -8000,
+        chunk_store: str = PER_DOCUMENT,
+        chunk_db_name: str = "chunk_metadata",
+        lexical_index: bool = False,
+        lexical_db_name: str = "chunk_fts"
     ) -> None:
         """
         Initializes the MetadataDB object with the given parameters.
@@ -30,7 +61,23 @@ class MetadataDB:
         - data_root (str): The root directory for the database files.
         - root_db_name (str): The name of the root database file.
         - sub_index_path (str): The path to the sub-database files.
+        - max_connections (int): The maximum number of connections to the
+            sub-databases kept open.
+        - mmap_size (int): The number of bytes of each database file that
+            SQLite memory-maps.
+        - cache_size (int): The SQLite page cache size of each connection,
+            in KiB if negative or in pages if positive.
+        - chunk_store (str): Where the chunks are stored, "per_document" for
+            a sub-database per document or "consolidated" for a single chunk
+            database.
+        - chunk_db_name (str): The name of the chunk database file, used in
+            the "consolidated" mode.
+        - lexical_index (bool): Whether to also index the chunk text in a
+            BM25 full-text index.
+        - lexical_db_name (str): The name of the full-text database file.
         """
+        if chunk_store not in (PER_DOCUMENT, CONSOLIDATED):
+            raise ValueError(f"Unknown chunk store mode {chunk_store}!")
         self._root_db_path = Path(data_root) / f"{root_db_name}.{_EXT}"
         self._sub_index_path = Path(sub_index_path)
 
@@ -42,12 +89,54 @@ class MetadataDB:
             str(self._root_db_path), 
             check_same_thread=False
         )
+        configure_connection(self._root_db, mmap_size, cache_size)
         with self._root_db as conn:
             conn.execute(tables.root_creation_str)
+        migrations.migrate_root(self._root_db)
+
+        self._pool = ConnectionPool(max_connections, mmap_size, cache_size)
+
+        self._chunk_db = None
+        self._chunk_db_path = Path(data_root) / f"{chunk_db_name}.{_EXT}"
+        if chunk_store == CONSOLIDATED:
+            self._chunk_db = sqlite3.connect(
+                str(self._chunk_db_path),
+                check_same_thread=False
+            )
+            configure_connection(self._chunk_db, mmap_size, cache_size)
+            with self._chunk_db as conn:
+                conn.execute(tables.chunk_creation_str)
+
+        self._lexical = None
+        if lexical_index:
+            self._lexical = LexicalIndex(
+                data_root, lexical_db_name, mmap_size, cache_size)
+            if self._lexical.created:
+                self._index_stored_chunks()
 
     def close(self) -> None:
+        self._pool.close_all()
+        if self._chunk_db is not None:
+            self._chunk_db.close()
+        if self._lexical is not None:
+            self._lexical.close()
         self._root_db.close()
 
+    def close_connections(self) -> None:
+        """
+        Closes all the connections to the sub-databases. Must be called
+        before the sub-database files are removed.
+        """
+        self._pool.close_all()
+
+    def schema_version(self) -> int:
+        """
+        Returns the version of the root database schema, the number of
+        migrations applied to it.
+        """
+        with self._root_db as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
     def has_document(
         self,
         document_hash: str
@@ -62,7 +151,7 @@ class MetadataDB:
         - bool: True if the document hash is in the metadata database, 
             False otherwise.
         """
-        query_str = f"SELECT * FROM metadata WHERE document_hash = ?"
+        query_str = "SELECT 1 FROM metadata WHERE document_hash = ? LIMIT 1"
         with self._root_db as conn:
             cursor = conn.execute(query_str, (document_hash,))
             return cursor.fetchone() is not None
@@ -81,7 +170,7 @@ class MetadataDB:
         - bool: True if the document uuid is in the metadata database,
             False otherwise.
         """
-        query_str = f"SELECT * FROM metadata WHERE uuid = ?"
+        query_str = "SELECT 1 FROM metadata WHERE uuid = ? LIMIT 1"
         with self._root_db as conn:
             cursor = conn.execute(query_str, (document_uuid,))
             return cursor.fetchone() is not None
@@ -119,25 +208,82 @@ class MetadataDB:
     def remove_from_root(
         self,
         document_uuid: str
-    ) -> tuple[int, str]:
+    ) -> tuple[int, str, str]:
         """
         Removes the document with the given UUID from the root database.
+        Raises a ValueError if there is no such document, e.g. when a
+        concurrent deletion removed it first.
         
         Args:
         - document_uuid (str): The UUID of the document to remove.
+
+        Returns:
+        - tuple[int, str, str]: The faiss ID, filename and hash of the
+            removed document.
         """
-        faiss_id_query = f"SELECT faiss_id, document_filename FROM metadata WHERE uuid = ?" 
-        delete_str = f"DELETE FROM metadata WHERE uuid = ?"
+        faiss_id_query = "SELECT faiss_id, document_filename, document_hash FROM metadata WHERE uuid = ?"
+        delete_str = "DELETE FROM metadata WHERE uuid = ?"
         with self._root_db as conn:
             cursor = conn.execute(faiss_id_query, (document_uuid,))
-            faiss_id, document_filename = cursor.fetchone()
+            row = cursor.fetchone()
+            if row is None:
+                raise ValueError("Document not found")
+            faiss_id, document_filename, document_hash = row
             conn.execute(delete_str, (document_uuid,))
-            return faiss_id, document_filename
+            return faiss_id, document_filename, document_hash
+
+    def get_document_keys(self) -> list[tuple[str, str]]:
+        """
+        Gets the UUID and hash of every document in the root database.
+
+        Returns:
+        - list[tuple[str, str]]: The (uuid, document_hash) of each document.
+        """
+        with self._root_db as conn:
+            cursor = conn.execute("SELECT uuid, document_hash FROM metadata")
+            return cursor.fetchall()
+
+    def get_root_ids(
+        self,
+        document_uuids: list[str]
+    ) -> dict[str, int]:
+        """
+        Gets the faiss IDs (of the root index) of the documents with the
+        given UUIDs.
+
+        Args:
+        - document_uuids (list[str]): The UUIDs of the documents.
+
+        Returns:
+        - dict[str, int]: The faiss ID of each document found, keyed by
+            its UUID.
+        """
+        query_str = (
+            f"SELECT uuid, faiss_id FROM metadata "
+            "WHERE uuid IN "
+            f"({', '.join(['?' for _ in document_uuids])})"
+        )
+        with self._root_db as conn:
+            cursor = conn.execute(query_str, document_uuids)
+            return {row[0]: row[1] for row in cursor.fetchall()}
 
     def clear_root(self) -> None:
-        query_str = f"DELETE FROM metadata"
+        query_str = "DELETE FROM metadata"
         with self._root_db as conn:
             conn.execute(query_str)
+
+    def clear_chunks(self) -> None:
+        """
+        Removes the chunks of all the documents from the chunk database. The
+        sub-databases of the "per_document" mode are removed with their
+        directory instead.
+        """
+        if self._lexical is not None:
+            self._lexical.clear()
+        if self._chunk_db is None:
+            return
+        with self._chunk_db as conn:
+            conn.execute("DELETE FROM chunks")
     
     def query_root(
         self,
@@ -169,6 +315,30 @@ class MetadataDB:
         
     
         
+    def query_root_by_id(
+        self,
+        faiss_ids: list[int]
+    ) -> dict[int, tuple[str, str]]:
+        """
+        Queries the root database with the given faiss IDs and returns the
+        UUIDs and summaries of the documents keyed by their faiss ID.
+
+        Args:
+        - faiss_ids (list[int]): The faiss IDs to query.
+
+        Returns:
+        - dict[int, tuple[str, str]]: The (uuid, summary) tuple of each
+            document found, keyed by its faiss ID.
+        """
+        query_str = (
+            f"SELECT faiss_id, uuid, summary FROM metadata "
+            "WHERE faiss_id IN "
+            f"({', '.join(['?' for _ in faiss_ids])})"
+        )
+        with self._root_db as conn:
+            cursor = conn.execute(query_str, faiss_ids)
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
     def add(
         self,
         uuid: str,
@@ -177,7 +347,9 @@ class MetadataDB:
         text_chunks: list[str]
     ) -> None:
         """
-        Adds the given document metadata to the sub-database with the given UUID.
+        Adds the given document metadata to the sub-database with the given
+        UUID. All the chunks are inserted in bulk in a single transaction,
+        which is rolled back if any insert fails.
         
         Args:
         - uuid (str): The UUID of the document.
@@ -188,19 +360,22 @@ class MetadataDB:
         Returns:
         - list[int]: The IDs of the added embeddings.
         """
-        db_path = self._sub_index_path / f"{uuid}.{_EXT}"
-        _conn = sqlite3.connect(str(db_path), check_same_thread=False)
-        with _conn as conn:
-            conn.execute(tables.document_creation_str)
-            for faiss_id, page_number, text_chunk in zip(faiss_ids, page_numbers, text_chunks):
-                conn.execute(
-                    tables.document_insert_str, 
-                    (
-                        faiss_id, 
-                        page_number, 
-                        text_chunk
-                    )
+        if self._chunk_db is not None:
+            with self._chunk_db as conn:
+                conn.executemany(
+                    tables.chunk_insert_str,
+                    zip([uuid] * len(faiss_ids), faiss_ids, page_numbers, text_chunks)
+                )
+        else:
+            db_path = self._sub_index_path / f"{uuid}.{_EXT}"
+            with self._pool.connection(uuid, db_path) as _conn, _conn as conn:
+                conn.execute(tables.document_creation_str)
+                conn.executemany(
+                    tables.document_insert_str,
+                    zip(faiss_ids, page_numbers, text_chunks)
                 )
+        if self._lexical is not None:
+            self._lexical.add(uuid, faiss_ids, page_numbers, text_chunks)
 
     def query(
         self,
@@ -222,23 +397,197 @@ class MetadataDB:
             Each tuple contains the page number and text chunk of a 
             document as (page_number, text).
         """
+        if self._chunk_db is not None:
+            rows = self.query_by_id(uuid, faiss_ids)
+            return [rows[faiss_id] for faiss_id in faiss_ids if faiss_id in rows]
+
         query_str = (
             f"SELECT page_number, text FROM metadata "
             "WHERE faiss_id IN "
             f"({', '.join(['?' for _ in faiss_ids])})"
         )
         db_path = self._sub_index_path / f"{uuid}.{_EXT}"
-        _conn = sqlite3.connect(str(db_path), check_same_thread=False)
-        with _conn as conn:
+        with self._pool.connection(uuid, db_path) as _conn, _conn as conn:
             cursor = conn.execute(query_str, faiss_ids)
             return [(row[0], row[1]) for row in cursor.fetchall()]
         
+    def query_by_id(
+        self,
+        uuid: str,
+        faiss_ids: list[int]
+    ) -> dict[int, tuple[int, str]]:
+        """
+        Queries the sub-database with the given UUID and faiss IDs and returns
+        the page numbers and text chunks keyed by their faiss ID.
+
+        Args:
+        - uuid (str): The UUID of the document.
+        - faiss_ids (list[int]): The faiss IDs of the document.
+
+        Returns:
+        - dict[int, tuple[int, str]]: The (page_number, text) tuple of each
+            chunk found, keyed by its faiss ID.
+        """
+        if self._chunk_db is not None:
+            return self.query_many({uuid: faiss_ids}).get(uuid, {})
+
+        query_str = (
+            f"SELECT faiss_id, page_number, text FROM metadata "
+            "WHERE faiss_id IN "
+            f"({', '.join(['?' for _ in faiss_ids])})"
+        )
+        db_path = self._sub_index_path / f"{uuid}.{_EXT}"
+        with self._pool.connection(uuid, db_path) as _conn, _conn as conn:
+            cursor = conn.execute(query_str, faiss_ids)
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    def query_many(
+        self,
+        faiss_ids: dict[str, list[int]]
+    ) -> dict[str, dict[int, tuple[int, str]]]:
+        """
+        Queries the chunks of several documents at once and returns their
+        page numbers and text chunks keyed by document UUID and faiss ID.
+        In the "consolidated" mode, this is a single lookup on the primary
+        key of the chunk table instead of one query per document.
+
+        Args:
+        - faiss_ids (dict[str, list[int]]): The faiss IDs to query, keyed by
+            the UUID of their document.
+
+        Returns:
+        - dict[str, dict[int, tuple[int, str]]]: The (page_number, text)
+            tuple of each chunk found, keyed by the UUID of its document and
+            its faiss ID.
+        """
+        if self._chunk_db is None:
+            return {
+                uuid: self.query_by_id(uuid, ids)
+                for uuid, ids in faiss_ids.items()
+            }
+
+        keys = [
+            (uuid, faiss_id)
+            for uuid, ids in faiss_ids.items()
+            for faiss_id in ids
+        ]
+        result = {uuid: {} for uuid in faiss_ids}
+        with self._chunk_db as conn:
+            for start in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+                batch = keys[start:start + _MAX_KEYS_PER_QUERY]
+                # Joining on a VALUES list lets SQLite look up each pair on
+                # the primary key, a row value IN would only use its prefix
+                query_str = (
+                    "SELECT c.document_uuid, c.faiss_id, c.page_number, c.text "
+                    f"FROM (VALUES {', '.join(['(?, ?)' for _ in batch])}) AS k "
+                    "CROSS JOIN chunks AS c "
+                    "ON c.document_uuid = k.column1 AND c.faiss_id = k.column2"
+                )
+                cursor = conn.execute(
+                    query_str, [value for key in batch for value in key])
+                for row in cursor.fetchall():
+                    result[row[0]][row[1]] = (row[2], row[3])
+        return result
+
     def remove(
         self,
         uuid: str
     ) -> None:
+        if self._lexical is not None:
+            self._lexical.remove(uuid)
+        if self._chunk_db is not None:
+            with self._chunk_db as conn:
+                conn.execute(
+                    "DELETE FROM chunks WHERE document_uuid = ?", (uuid,))
+            return
+
+        self._pool.close(uuid)
         db_path = self._sub_index_path / f"{uuid}.{_EXT}"
-        db_path.unlink()
+        db_path.unlink(missing_ok=True)
+        # Files left by the WAL journal, if the database was not cleanly
+        # closed
+        for suffix in ("-wal", "-shm"):
+            db_path.with_name(db_path.name + suffix).unlink(missing_ok=True)
+
+    def vacuum(self, min_free_ratio: float = 0.0) -> list[str]:
+        """
+        Reclaims the space left by the removed documents in the root, chunk
+        and full-text databases, see pool.vacuum_database. The sub-databases
+        of the "per_document" mode are removed with their document.
+
+        Args:
+        - min_free_ratio (float): The minimum fraction of free pages of a
+            database for it to be vacuumed.
+
+        Returns:
+        - list[str]: The names of the vacuumed database files.
+        """
+        vacuumed = []
+        db_paths = [self._root_db_path]
+        if self._chunk_db is not None:
+            db_paths.append(self._chunk_db_path)
+        for db_path in db_paths:
+            if vacuum_database(db_path, min_free_ratio):
+                vacuumed.append(db_path.name)
+        if self._lexical is not None and self._lexical.vacuum(min_free_ratio):
+            vacuumed.append(self._lexical.db_path.name)
+        return vacuumed
+
+    @property
+    def has_lexical_index(self) -> bool:
+        return self._lexical is not None
+
+    def search_text(
+        self,
+        query_text: str,
+        document_uuids: Optional[list[str]] = None,
+        top_k: int = 5,
+        phrase: bool = False
+    ) -> list[tuple[str, int, int, str, float]]:
+        """
+        Searches the chunks matching the given text in the full-text index,
+        see LexicalIndex.search.
+
+        Args:
+        - query_text (str): The text of the query.
+        - document_uuids (Optional[list[str]]): If given, only the chunks of
+            these documents are searched.
+        - top_k (int): The maximum number of chunks to return.
+        - phrase (bool): Whether the text must appear as an exact phrase.
+
+        Returns:
+        - list[tuple[str, int, int, str, float]]: The best matches first, as
+            (document_uuid, faiss_id, page_number, text, score) tuples.
+        """
+        if self._lexical is None:
+            raise ValueError("The lexical index is disabled!")
+        return self._lexical.search(query_text, document_uuids, top_k, phrase)
+
+    def _index_stored_chunks(self) -> None:
+        """
+        Adds the chunks of every stored document to the full-text index,
+        used when the index is first created on existing data.
+        """
+        with self._root_db as conn:
+            uuids = [row[0] for row in conn.execute("SELECT uuid FROM metadata")]
+        for uuid in uuids:
+            if self._chunk_db is not None:
+                with self._chunk_db as conn:
+                    rows = conn.execute(
+                        "SELECT faiss_id, page_number, text FROM chunks "
+                        "WHERE document_uuid = ?",
+                        (uuid,)
+                    ).fetchall()
+            else:
+                db_path = self._sub_index_path / f"{uuid}.{_EXT}"
+                if not db_path.exists():
+                    continue
+                with self._pool.connection(uuid, db_path) as _conn, _conn as conn:
+                    rows = conn.execute(
+                        "SELECT faiss_id, page_number, text FROM metadata"
+                    ).fetchall()
+            if rows:
+                self._lexical.add(uuid, *(list(column) for column in zip(*rows)))
 
     def get_documents_info(self) -> list[DocumentInfo]:
         """
@@ -248,7 +597,7 @@ class MetadataDB:
         - list[DocumentInfo]: A list of DocumentInfo objects containing the
             metadata for all documents in the root database.
         """
-        query_str = f"SELECT uuid, document_hash, document_filename, summary FROM metadata"
+        query_str = "SELECT uuid, document_hash, document_filename, summary FROM metadata"
         with self._root_db as conn:
             cursor = conn.execute(query_str)
             return [
@@ -261,6 +610,101 @@ class MetadataDB:
                 for row in cursor.fetchall()
             ]
         
+    def list_documents(
+        self,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        fields: Optional[list[str]] = None,
+        filename_prefix: Optional[str] = None,
+        filename_contains: Optional[str] = None
+    ) -> list[DocumentInfo]:
+        """
+        Gets a page of the metadata of the documents, ordered by UUID. The
+        pages are selected with the UUID index (keyset pagination), so that
+        any page costs the same whatever its position.
+
+        Args:
+        - limit (Optional[int]): The maximum number of documents returned,
+            all of them if not given.
+        - after (Optional[str]): Only the documents with a greater UUID are
+            returned, the last UUID of the previous page.
+        - fields (Optional[list[str]]): The DocumentInfo fields to read, see
+            DOCUMENT_INFO_COLUMNS, all of them if not given. The UUID is
+            always read.
+        - filename_prefix (Optional[str]): If given, only the documents whose
+            filename starts with it are returned, ignoring the ASCII case.
+        - filename_contains (Optional[str]): If given, only the documents
+            whose filename contains it are returned, ignoring the ASCII case.
+
+        Returns:
+        - list[DocumentInfo]: The metadata of the documents of the page.
+        """
+        fields = list(DOCUMENT_INFO_COLUMNS) if fields is None else fields
+        columns = ", ".join(["uuid"] + [DOCUMENT_INFO_COLUMNS[f] for f in fields])
+        where, params = self._documents_filter(filename_prefix, filename_contains)
+        if after is not None:
+            where.append("uuid > ?")
+            params.append(after)
+        query_str = f"SELECT {columns} FROM metadata"
+        if where:
+            query_str += f" WHERE {' AND '.join(where)}"
+        query_str += " ORDER BY uuid"
+        if limit is not None:
+            query_str += " LIMIT ?"
+            params.append(limit)
+        with self._root_db as conn:
+            cursor = conn.execute(query_str, params)
+            return [
+                DocumentInfo(
+                    document_uuid=row[0],
+                    **dict(zip(fields, row[1:]))
+                )
+                for row in cursor.fetchall()
+            ]
+
+    def count_documents(
+        self,
+        filename_prefix: Optional[str] = None,
+        filename_contains: Optional[str] = None
+    ) -> int:
+        """
+        Counts the documents, see list_documents for the filters.
+
+        Args:
+        - filename_prefix (Optional[str]): The filename prefix to match.
+        - filename_contains (Optional[str]): The filename substring to match.
+
+        Returns:
+        - int: The number of matching documents.
+        """
+        where, params = self._documents_filter(filename_prefix, filename_contains)
+        query_str = "SELECT COUNT(*) FROM metadata"
+        if where:
+            query_str += f" WHERE {' AND '.join(where)}"
+        with self._root_db as conn:
+            return conn.execute(query_str, params).fetchone()[0]
+
+    @staticmethod
+    def _documents_filter(
+        filename_prefix: Optional[str],
+        filename_contains: Optional[str]
+    ) -> tuple[list[str], list[str]]:
+        def escape(pattern: str) -> str:
+            return (
+                pattern.replace("\\", "\\\\")
+                .replace("%", "\\%")
+                .replace("_", "\\_")
+            )
+
+        where, params = [], []
+        if filename_prefix:
+            where.append("document_filename LIKE ? ESCAPE '\\'")
+            params.append(f"{escape(filename_prefix)}%")
+        if filename_contains:
+            where.append("document_filename LIKE ? ESCAPE '\\'")
+            params.append(f"%{escape(filename_contains)}%")
+        return where, params
+
     def get_document_info(
         self,
         document_uuid: str
@@ -273,12 +717,15 @@ class MetadataDB:
 
         Returns:
         - list[DocumentInfo]: A list containing the DocumentInfo object 
-            with the metadata for the document with the given UUID.
+            with the metadata for the document with the given UUID, empty
+            if there is none.
         """
-        query_str = f"SELECT uuid, document_hash, document_filename, summary FROM metadata WHERE uuid = ?"
+        query_str = "SELECT uuid, document_hash, document_filename, summary FROM metadata WHERE uuid = ?"
         with self._root_db as conn:
             cursor = conn.execute(query_str, (document_uuid,))
             row = cursor.fetchone()
+            if row is None:
+                return []
             return [DocumentInfo(
                 document_uuid=row[0],
                 document_hash_str=row[1],
@@ -0,0 +1,232 @@
+from pathlib import Path
+import re
+import sqlite3
+import threading
+from typing import Optional
+
+from .pool import configure_connection, vacuum_database
+
+
+# Full-text index of the chunk text, the other columns are only stored to
+# filter and return the matches
+_fts_creation_str = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+    "text, document_uuid UNINDEXED, faiss_id UNINDEXED, "
+    "page_number UNINDEXED, tokenize = 'unicode61')"
+)
+# Maps each document to the rows of its chunks in the full-text index, so
+# that a document is removed without scanning the whole index
+_fts_rows_creation_str = (
+    "CREATE TABLE IF NOT EXISTS chunks_fts_rows ("
+    "document_uuid TEXT NOT NULL, fts_rowid INTEGER NOT NULL, "
+    "PRIMARY KEY (document_uuid, fts_rowid)) WITHOUT ROWID"
+)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Searches of up to this many documents match each document separately
+# within the row IDs of its chunks, which are consecutive, instead of
+# matching the whole corpus then filtering by document
+_MAX_SCOPED_DOCUMENTS = 16
+
+
+def match_expression(query_text: str, phrase: bool = False) -> Optional[str]:
+    """
+    Builds the FTS5 MATCH expression of the given query text. Every token is
+    quoted, so that user input is never interpreted as FTS5 syntax.
+
+    Args:
+    - query_text (str): The text of the query.
+    - phrase (bool): Whether to match the tokens as a single exact phrase
+        instead of any of them.
+
+    Returns:
+    - Optional[str]: The MATCH expression, None if the text has no token.
+    """
+    tokens = _TOKEN_RE.findall(query_text)
+    if not tokens:
+        return None
+    if phrase:
+        return '"' + " ".join(tokens) + '"'
+    return " OR ".join(f'"{token}"' for token in tokens)
+
+
+class LexicalIndex:
+    """
+    Represents a BM25 full-text index of the text of the chunks of all the
+    documents, stored in an SQLite FTS5 table.
+    """
+
+    def __init__(
+        self,
+        data_root: str,
+        lexical_db_name: str,
+        mmap_size: int = 64 * 1024 * 1024,
+        cache_size: int = -8000
+    ) -> None:
+        """
+        Initializes the LexicalIndex object with the given parameters.
+
+        Args:
+        - data_root (str): The root directory for the database files.
+        - lexical_db_name (str): The name of the full-text database file.
+        - mmap_size (int): The number of bytes of the database file that
+            SQLite memory-maps.
+        - cache_size (int): The SQLite page cache size, in KiB if negative
+            or in pages if positive.
+        """
+        self.db_path = db_path = Path(data_root) / f"{lexical_db_name}.db"
+        # True the first time the index is created, so that the documents
+        # already stored can be indexed
+        self.created = not db_path.exists()
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        configure_connection(self._db, mmap_size, cache_size)
+        with self._db as conn:
+            conn.execute(_fts_creation_str)
+            conn.execute(_fts_rows_creation_str)
+        # The new row IDs are read then written in the same transaction
+        self._write_lock = threading.Lock()
+        # Searches use their own connection, so that they never see, nor
+        # commit, the transaction of a concurrent write
+        self._read_db = sqlite3.connect(str(db_path), check_same_thread=False)
+        configure_connection(self._read_db, mmap_size, cache_size)
+
+    def close(self) -> None:
+        self._read_db.close()
+        self._db.close()
+
+    def add(
+        self,
+        uuid: str,
+        faiss_ids: list[int],
+        page_numbers: list[int],
+        text_chunks: list[str]
+    ) -> None:
+        """
+        Indexes the given chunks of the document with the given UUID, in a
+        single transaction.
+
+        Args:
+        - uuid (str): The UUID of the document.
+        - faiss_ids (list[int]): The faiss IDs of the chunks.
+        - page_numbers (list[int]): The page numbers of the chunks.
+        - text_chunks (list[str]): The text of the chunks.
+        """
+        with self._write_lock, self._db as conn:
+            row = conn.execute(
+                "SELECT rowid FROM chunks_fts ORDER BY rowid DESC LIMIT 1"
+            ).fetchone()
+            first_rowid = (row[0] if row else 0) + 1
+            rowids = range(first_rowid, first_rowid + len(faiss_ids))
+            conn.executemany(
+                "INSERT INTO chunks_fts "
+                "(rowid, text, document_uuid, faiss_id, page_number) "
+                "VALUES (?, ?, ?, ?, ?)",
+                zip(rowids, text_chunks, [uuid] * len(rowids), faiss_ids, page_numbers)
+            )
+            conn.executemany(
+                "INSERT INTO chunks_fts_rows (document_uuid, fts_rowid) "
+                "VALUES (?, ?)",
+                [(uuid, rowid) for rowid in rowids]
+            )
+
+    def remove(self, uuid: str) -> None:
+        with self._write_lock, self._db as conn:
+            conn.execute(
+                "DELETE FROM chunks_fts WHERE rowid IN ("
+                "SELECT fts_rowid FROM chunks_fts_rows WHERE document_uuid = ?)",
+                (uuid,)
+            )
+            conn.execute(
+                "DELETE FROM chunks_fts_rows WHERE document_uuid = ?", (uuid,))
+
+    def clear(self) -> None:
+        with self._write_lock, self._db as conn:
+            conn.execute("DELETE FROM chunks_fts")
+            conn.execute("DELETE FROM chunks_fts_rows")
+
+    def vacuum(self, min_free_ratio: float = 0.0) -> bool:
+        """
+        Merges the full-text index segments, which drops the entries of the
+        removed chunks, then vacuums the database file if at least
+        min_free_ratio of its pages are free.
+
+        Returns:
+        - bool: Whether the database was vacuumed.
+        """
+        with self._write_lock, self._db as conn:
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('optimize')")
+        return vacuum_database(self.db_path, min_free_ratio)
+
+    def search(
+        self,
+        query_text: str,
+        document_uuids: Optional[list[str]] = None,
+        top_k: int = 5,
+        phrase: bool = False
+    ) -> list[tuple[str, int, int, str, float]]:
+        """
+        Searches the chunks matching the given text, ranked by BM25.
+
+        Args:
+        - query_text (str): The text of the query.
+        - document_uuids (Optional[list[str]]): If given, only the chunks of
+            these documents are searched.
+        - top_k (int): The maximum number of chunks to return.
+        - phrase (bool): Whether the text must appear as an exact phrase.
+
+        Returns:
+        - list[tuple[str, int, int, str, float]]: The best matches first, as
+            (document_uuid, faiss_id, page_number, text, score) tuples where
+            the score is the BM25 relevance, higher is better.
+        """
+        expression = match_expression(query_text, phrase)
+        if expression is None or document_uuids == []:
+            return []
+        select_str = (
+            "SELECT document_uuid, faiss_id, page_number, text, rank "
+            "FROM chunks_fts WHERE chunks_fts MATCH ?"
+        )
+        with self._read_db as conn:
+            if (
+                document_uuids is not None
+                and len(document_uuids) <= _MAX_SCOPED_DOCUMENTS
+            ):
+                # The BM25 rank uses the statistics of the whole corpus, so
+                # the ranks of the separate matches compare
+                ranges = conn.execute(
+                    "SELECT document_uuid, MIN(fts_rowid), MAX(fts_rowid) "
+                    "FROM chunks_fts_rows WHERE document_uuid IN "
+                    f"({', '.join(['?' for _ in document_uuids])}) "
+                    "GROUP BY document_uuid",
+                    document_uuids
+                ).fetchall()
+                if not ranges:
+                    return []
+                query_str = " UNION ALL ".join([
+                    f"{select_str} AND rowid BETWEEN ? AND ? "
+                    "AND document_uuid = ?"
+                ] * len(ranges))
+                query_str = f"SELECT * FROM ({query_str})"
+                params = [
+                    param
+                    for uuid, first_rowid, last_rowid in ranges
+                    for param in (expression, first_rowid, last_rowid, uuid)
+                ]
+            else:
+                query_str = select_str
+                params = [expression]
+                if document_uuids is not None:
+                    query_str += (
+                        " AND document_uuid IN "
+                        f"({', '.join(['?' for _ in document_uuids])})"
+                    )
+                    params.extend(document_uuids)
+            query_str += " ORDER BY rank LIMIT ?"
+            params.append(top_k)
+            cursor = conn.execute(query_str, params)
+            # FTS5 ranks with the negated BM25 score
+            return [
+                (row[0], row[1], row[2], row[3], -row[4])
+                for row in cursor.fetchall()
+            ]
@@ -0,0 +1,57 @@
+import sqlite3
+import sys
+from typing import Callable
+
+from . import tables
+
+
+def _add_root_indexes(conn: sqlite3.Connection) -> None:
+    """
+    Adds the secondary indexes used by the document existence checks,
+    lookups by UUID and queries by faiss ID.
+    """
+    conn.execute(tables.root_faiss_id_index_str)
+    for unique_index_str, index_str in (
+        (tables.root_uuid_unique_index_str, tables.root_uuid_index_str),
+        (tables.root_hash_unique_index_str, tables.root_hash_index_str),
+    ):
+        try:
+            conn.execute(unique_index_str)
+        except sqlite3.IntegrityError as e:
+            # Databases written before the indexes existed may contain
+            # duplicates, the lookups still get a non-unique index
+            print(
+                f"Could not create unique index, falling back to a "
+                f"non-unique one: {e}", file=sys.stderr)
+            conn.execute(index_str)
+
+
+# The migrations of the root database, the database version (stored in
+# the user_version pragma) is the number of migrations applied. New
+# migrations must only be appended.
+_ROOT_MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _add_root_indexes,
+]
+
+
+def migrate_root(conn: sqlite3.Connection) -> None:
+    """
+    Upgrades the root database to the latest version by applying, each in
+    its own transaction, the migrations it is missing.
+
+    Args:
+    - conn (sqlite3.Connection): The connection to the root database.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for new_version, migration in enumerate(
+        _ROOT_MIGRATIONS[version:], 
+        start=version + 1
+    ):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {new_version}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Iterator
+
+
+def configure_connection(
+    conn: sqlite3.Connection,
+    mmap_size: int,
+    cache_size: int
+) -> None:
+    """
+    Applies the performance pragmas to the given connection. WAL journaling
+    lets readers run concurrently with a writer and, with synchronous=NORMAL,
+    only syncs to disk on checkpoints instead of on every transaction.
+
+    Args:
+    - conn (sqlite3.Connection): The connection to configure.
+    - mmap_size (int): The maximum number of bytes of the database file to
+        memory-map.
+    - cache_size (int): The page cache size, in KiB if negative or in pages
+        if positive (see the SQLite cache_size pragma).
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size={int(cache_size)}")
+
+
+def vacuum_database(db_path: Path, min_free_ratio: float = 0.0) -> bool:
+    """
+    Rebuilds the database at the given path with VACUUM if at least
+    min_free_ratio of its pages are free, i.e. were left by deleted rows.
+    A dedicated connection is used, so that the connections serving the
+    queries are not held for the duration: with WAL journaling readers
+    are not blocked, writers wait for the lock.
+
+    Args:
+    - db_path (Path): The path to the database file.
+    - min_free_ratio (float): The minimum fraction of free pages.
+
+    Returns:
+    - bool: Whether the database was vacuumed.
+    """
+    conn = sqlite3.connect(str(db_path), timeout=60)
+    try:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_count == 0 or free_count < min_free_ratio * page_count:
+            return False
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+class _PooledConnection:
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.users = 0
+        self.evicted = False
+
+
+class ConnectionPool:
+    """
+    Keeps the connections to the per-document databases open across calls,
+    so that each lookup does not pay the connection setup and schema parsing
+    costs. The pool is bounded: once full, the least recently used
+    connections are closed. Connections in use are never closed, they are
+    closed when released instead.
+    """
+    def __init__(
+        self,
+        max_connections: int,
+        mmap_size: int,
+        cache_size: int
+    ) -> None:
+        """
+        Initializes the ConnectionPool object with the given parameters.
+
+        Args:
+        - max_connections (int): The maximum number of idle connections
+            kept open.
+        - mmap_size (int): The mmap_size pragma of the connections.
+        - cache_size (int): The cache_size pragma of the connections.
+        """
+        self.max_connections = max_connections
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self._entries: OrderedDict[str, _PooledConnection] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(
+        self,
+        key: str,
+        db_path: Path
+    ) -> Iterator[sqlite3.Connection]:
+        """
+        Returns the pooled connection for the given key, opening it if
+        needed. The connection must only be used inside the with block.
+
+        Args:
+        - key (str): The key of the database, usually the document UUID.
+        - db_path (Path): The path to the database file.
+
+        Returns:
+        - Iterator[sqlite3.Connection]: The connection to the database.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # In python 3.12.7 sqlite3.threadsafety is 3, so the
+                # connection can be shared between threads
+                conn = sqlite3.connect(str(db_path), check_same_thread=False)
+                configure_connection(conn, self.mmap_size, self.cache_size)
+                entry = _PooledConnection(conn)
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+            entry.users += 1
+            self._evict()
+
+        try:
+            yield entry.conn
+        finally:
+            with self._lock:
+                entry.users -= 1
+                if entry.evicted and entry.users == 0:
+                    entry.conn.close()
+
+    def close(self, key: str) -> None:
+        """
+        Closes the connection for the given key, if open. Must be called
+        before the database file is removed.
+
+        Args:
+        - key (str): The key of the database, usually the document UUID.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._close(entry)
+
+    def close_all(self) -> None:
+        with self._lock:
+            for entry in self._entries.values():
+                self._close(entry)
+            self._entries.clear()
+
+    def _close(self, entry: _PooledConnection) -> None:
+        entry.evicted = True
+        if entry.users == 0:
+            entry.conn.close()
+
+    def _evict(self) -> None:
+        idle_keys = [
+            key for key, entry in self._entries.items() if entry.users == 0
+        ]
+        while len(self._entries) > self.max_connections and idle_keys:
+            self._close(self._entries.pop(idle_keys.pop(0)))
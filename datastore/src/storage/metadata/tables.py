@@ -18,6 +18,26 @@ root_insert_str = (
     f"({', '.join([col.split(" ")[0] for col in _root_table['columns'][1:]])}) "
     f"VALUES ({', '.join(['?' for _ in _root_table['columns'][1:]])})"
 )
+root_faiss_id_index_str = (
+    f"CREATE INDEX IF NOT EXISTS {_root_table['table_name']}_faiss_id_idx "
+    f"ON {_root_table['table_name']} (faiss_id)"
+)
+root_uuid_unique_index_str = (
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {_root_table['table_name']}_uuid_idx "
+    f"ON {_root_table['table_name']} (uuid)"
+)
+root_uuid_index_str = (
+    f"CREATE INDEX IF NOT EXISTS {_root_table['table_name']}_uuid_idx "
+    f"ON {_root_table['table_name']} (uuid)"
+)
+root_hash_unique_index_str = (
+    f"CREATE UNIQUE INDEX IF NOT EXISTS {_root_table['table_name']}_document_hash_idx "
+    f"ON {_root_table['table_name']} (document_hash)"
+)
+root_hash_index_str = (
+    f"CREATE INDEX IF NOT EXISTS {_root_table['table_name']}_document_hash_idx "
+    f"ON {_root_table['table_name']} (document_hash)"
+)
     
 _document_table = {
     "table_name": "metadata",
@@ -36,4 +56,27 @@ document_insert_str = (
     f"INSERT INTO {_document_table['table_name']} "
     f"({', '.join([col.split()[0] for col in _document_table['columns'][1:]])}) "
     f"VALUES ({', '.join(['?' for _ in _document_table['columns'][1:]])})"
-)
\ No newline at end of file
+)
+# Table of the consolidated chunk store, where the chunks of all the documents
+# are clustered by their primary key
+_chunk_table = {
+    "table_name": "chunks",
+    "columns": [
+        "document_uuid TEXT NOT NULL",
+        "faiss_id INTEGER NOT NULL",
+        "page_number INTEGER",
+        "text TEXT"
+    ],
+    "primary_key": ["document_uuid", "faiss_id"]
+}
+chunk_creation_str = (
+    f"CREATE TABLE IF NOT EXISTS {_chunk_table['table_name']} "
+    f"({', '.join(_chunk_table['columns'])}, "
+    f"PRIMARY KEY ({', '.join(_chunk_table['primary_key'])})) "
+    "WITHOUT ROWID"
+)
+chunk_insert_str = (
+    f"INSERT INTO {_chunk_table['table_name']} "
+    f"({', '.join([col.split()[0] for col in _chunk_table['columns']])}) "
+    f"VALUES ({', '.join(['?' for _ in _chunk_table['columns']])})"
+)
@@ -0,0 +1,163 @@
+import os
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Optional
+
+from api_models import Change, ChangesResponse
+from .metadata.pool import configure_connection
+
+
+# The roles of a datastore process. A leader accepts the writes and
+# publishes them in its change log, a follower applies the change log of
+# its leader and only serves reads.
+STANDALONE = "standalone"
+LEADER = "leader"
+FOLLOWER = "follower"
+ROLES = (STANDALONE, LEADER, FOLLOWER)
+
+# The operations of the change log
+ADD = "add"
+DELETE = "delete"
+CLEAR = "clear"
+
+_CURSOR_NAME = "replication.cursor"
+
+_changes_creation_str = (
+    "CREATE TABLE IF NOT EXISTS changes ("
+    "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "operation TEXT NOT NULL, "
+    "document_uuid TEXT)"
+)
+
+
+class ChangeLog:
+    """
+    Represents the ordered log of the writes of a leader datastore, stored
+    in an SQLite table. Each change has a sequence number, followers ask
+    for the changes after the last one they applied. Only the last
+    changes are kept, a follower further behind must resynchronize.
+    """
+
+    def __init__(
+        self,
+        data_root: str,
+        change_log_name: str = "changelog",
+        retention: int = 10_000,
+        mmap_size: int = 64 * 1024 * 1024,
+        cache_size: int = -8000
+    ) -> None:
+        """
+        Initializes the ChangeLog object with the given parameters.
+
+        Args:
+        - data_root (str): The root directory for the database file.
+        - change_log_name (str): The name of the change log database file.
+        - retention (int): The number of changes kept.
+        - mmap_size (int): The number of bytes of the database file that
+            SQLite memory-maps.
+        - cache_size (int): The SQLite page cache size, in KiB if negative
+            or in pages if positive.
+        """
+        self.retention = max(retention, 1)
+        self._db = sqlite3.connect(
+            str(Path(data_root) / f"{change_log_name}.db"),
+            check_same_thread=False
+        )
+        configure_connection(self._db, mmap_size, cache_size)
+        with self._db as conn:
+            conn.execute(_changes_creation_str)
+        # Appends are serialized so that the pruning sees its own insert
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def append(
+        self,
+        operation: str,
+        document_uuid: Optional[str] = None
+    ) -> int:
+        """
+        Appends a change to the log and drops the changes beyond the
+        retention. Only the UUID of an added document is logged, so that
+        the size of the log does not grow with the size of the documents.
+
+        Args:
+        - operation (str): The operation, one of ADD, DELETE or CLEAR.
+        - document_uuid (Optional[str]): The UUID of the document added or
+            deleted.
+
+        Returns:
+        - int: The sequence number of the change.
+        """
+        with self._lock, self._db as conn:
+            seq = conn.execute(
+                "INSERT INTO changes (operation, document_uuid) VALUES (?, ?)",
+                (operation, document_uuid)
+            ).lastrowid
+            conn.execute(
+                "DELETE FROM changes WHERE seq <= ?", (seq - self.retention,))
+        return seq
+
+    def read(self, after: int, limit: int = 100) -> ChangesResponse:
+        """
+        Reads the changes following the given sequence number.
+
+        Args:
+        - after (int): The sequence number of the last change applied by
+            the follower, 0 for none.
+        - limit (int): The maximum number of changes returned.
+
+        Returns:
+        - ChangesResponse: The changes, in order, with the sequence numbers
+            of the oldest change kept and of the last change.
+        """
+        with self._db as conn:
+            row = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'changes'"
+            ).fetchone()
+            last_seq = row[0] if row else 0
+            first_seq = conn.execute(
+                "SELECT MIN(seq) FROM changes").fetchone()[0]
+            rows = conn.execute(
+                "SELECT seq, operation, document_uuid FROM changes "
+                "WHERE seq > ? ORDER BY seq LIMIT ?",
+                (after, limit)
+            ).fetchall()
+        return ChangesResponse(
+            changes=[
+                Change(
+                    seq=seq,
+                    operation=operation,
+                    document_uuid=document_uuid
+                )
+                for seq, operation, document_uuid in rows
+            ],
+            first_seq=first_seq if first_seq is not None else last_seq + 1,
+            last_seq=last_seq
+        )
+
+
+def read_cursor(data_root: str) -> int:
+    """
+    Returns the sequence number of the last change a follower applied, 0
+    if it never applied any.
+    """
+    cursor_path = Path(data_root) / _CURSOR_NAME
+    if not cursor_path.exists():
+        return 0
+    return int(cursor_path.read_text().strip() or 0)
+
+def write_cursor(data_root: str, seq: int) -> None:
+    """
+    Atomically records the sequence number of the last change a follower
+    applied.
+    """
+    cursor_path = Path(data_root) / _CURSOR_NAME
+    tmp_path = cursor_path.with_name(f"{_CURSOR_NAME}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(str(seq))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, cursor_path)
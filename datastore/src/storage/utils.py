@@ -0,0 +1,98 @@
+import os
+
+
+def get_sub_index_cache_size():
+    return int(os.getenv("SUB_INDEX_CACHE_SIZE", 256 * 1024 * 1024))
+
+def get_index_read_only():
+    # INDEX_MMAP is the former name of the setting
+    value = os.getenv("INDEX_READ_ONLY", os.getenv("INDEX_MMAP", "false"))
+    return value.lower() in ("1", "true", "yes")
+
+def get_chunk_index_mode():
+    return os.getenv("CHUNK_INDEX_MODE", "per_document")
+
+def get_root_index_type():
+    return os.getenv("ROOT_INDEX_TYPE", "flat")
+
+def get_root_index_promotion_threshold():
+    return int(os.getenv("ROOT_INDEX_PROMOTION_THRESHOLD", 10_000))
+
+def get_root_index_params():
+    return {
+        "hnsw_m": int(os.getenv("ROOT_INDEX_HNSW_M", 32)),
+        "nlist": int(os.getenv("ROOT_INDEX_NLIST", 1024)),
+        "pq_m": int(os.getenv("ROOT_INDEX_PQ_M", 64)),
+        "ef_search": int(os.getenv("ROOT_INDEX_EF_SEARCH", 64)),
+        "nprobe": int(os.getenv("ROOT_INDEX_NPROBE", 16)),
+    }
+
+def get_checkpoint_interval():
+    return float(os.getenv("INDEX_CHECKPOINT_INTERVAL", 60))
+
+def get_index_encoding():
+    return os.getenv("INDEX_ENCODING", "flat")
+
+def get_index_rerank_factor():
+    return int(os.getenv("INDEX_RERANK_FACTOR", 0))
+
+def get_index_pq_m():
+    return int(os.getenv("INDEX_PQ_M", 64))
+
+def get_metadata_max_connections():
+    return int(os.getenv("METADATA_MAX_CONNECTIONS", 64))
+
+def get_sqlite_mmap_size():
+    return int(os.getenv("SQLITE_MMAP_SIZE", 64 * 1024 * 1024))
+
+def get_sqlite_cache_size():
+    return int(os.getenv("SQLITE_CACHE_SIZE", -8000))
+
+def get_chunk_store_mode():
+    return os.getenv("CHUNK_STORE_MODE", "per_document")
+
+def get_executor_workers():
+    # Same default as concurrent.futures.ThreadPoolExecutor
+    return int(os.getenv("DATASTORE_WORKERS", min(32, (os.cpu_count() or 1) + 4)))
+
+def get_lexical_index():
+    return os.getenv("LEXICAL_INDEX", "true").lower() in ("1", "true", "yes")
+
+def get_rrf_k():
+    return int(os.getenv("HYBRID_RRF_K", 60))
+
+def get_membership_bloom_filter():
+    return os.getenv("MEMBERSHIP_BLOOM_FILTER", "false").lower() in ("1", "true", "yes")
+
+def get_membership_bloom_capacity():
+    return int(os.getenv("MEMBERSHIP_BLOOM_CAPACITY", 1_000_000))
+
+def get_membership_bloom_error_rate():
+    return float(os.getenv("MEMBERSHIP_BLOOM_ERROR_RATE", 0.01))
+
+def get_compaction_interval():
+    return float(os.getenv("COMPACTION_INTERVAL", 300))
+
+def get_compaction_tombstone_ratio():
+    return float(os.getenv("COMPACTION_TOMBSTONE_RATIO", 0.2))
+
+def get_datastore_role():
+    return os.getenv("DATASTORE_ROLE", "standalone")
+
+def get_leader_url():
+    return os.getenv("DATASTORE_LEADER_URL", "http://datastore:8000").rstrip("/")
+
+def get_replication_poll_interval():
+    return float(os.getenv("REPLICATION_POLL_INTERVAL", 1))
+
+def get_replication_batch_size():
+    return int(os.getenv("REPLICATION_BATCH_SIZE", 100))
+
+def get_replication_log_retention():
+    return int(os.getenv("REPLICATION_LOG_RETENTION", 10_000))
+
+def get_data_root():
+    return os.getenv("DATA_ROOT", "/vector_index")
+
+def get_uploaded_files_path():
+    return os.getenv("UPLOADED_FILES_PATH", "/uploaded_files")
\ No newline at end of file
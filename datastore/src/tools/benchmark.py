@@ -0,0 +1,687 @@
+"""
+Benchmark of the datastore on a synthetic corpus of random unit-length
+embeddings. It measures the throughput and the p50/p99 latency of adding
+documents, querying the root index, querying the chunks of some documents,
+deleting documents and clearing the datastore.
+
+From the src directory of the datastore:
+
+    python -m tools.benchmark [--documents 1000] [--chunks 50 2000]
+        [--dim 768] [--url http://datastore:8000] [--output results.json]
+        [--baseline previous.json]
+
+Without --url, a DataStore runs in this process on an empty temporary data
+root, or on an empty --data-root, configured by the same environment
+variables as the service (INDEX_ENCODING, ROOT_INDEX_TYPE, ...). Index and
+storage configurations are compared by running the benchmark once per
+configuration. With --url, the requests are sent to a running datastore,
+which must be empty since the benchmark ends by deleting all its documents.
+
+The results are written as JSON. With --baseline, they are compared with a
+previous run and the command fails if an operation regressed.
+"""
+import argparse
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+import uuid
+
+import httpx
+import numpy as np
+
+from api_models import (
+    AddDocumentChunk,
+    AddDocumentRequest,
+    DocumentQueryRequest,
+    RootQueryRequest,
+    decode_embedding,
+    decode_embeddings,
+    encode_embeddings
+)
+
+
+# Prefixes of the environment variables configuring the datastore, recorded
+# with the in-process results
+_CONFIG_PREFIXES = (
+    "CHUNK_",
+    "DATASTORE_",
+    "HYBRID_",
+    "INDEX_",
+    "LEXICAL_",
+    "MEMBERSHIP_",
+    "METADATA_",
+    "ROOT_INDEX_",
+    "SQLITE_",
+    "SUB_INDEX_"
+)
+
+_WORDS = [f"w{i}" for i in range(1000)]
+
+
+class SyntheticCorpus:
+    """
+    Reproducible corpus of random documents with a random number of chunks
+    each. The documents are generated on demand from the seed and their
+    position, so that a corpus never has to fit in memory.
+    """
+
+    def __init__(
+        self,
+        document_count: int,
+        min_chunks: int,
+        max_chunks: int,
+        dim: int,
+        words_per_chunk: int = 50,
+        seed: int = 0
+    ) -> None:
+        """
+        Initializes the SyntheticCorpus object with the given parameters.
+
+        Args:
+        - document_count (int): The number of documents.
+        - min_chunks (int): The minimum number of chunks of a document.
+        - max_chunks (int): The maximum number of chunks of a document.
+        - dim (int): The length of the embeddings.
+        - words_per_chunk (int): The number of random words of the text of a
+            chunk, indexed by the full-text index.
+        - seed (int): The seed of the generated corpus.
+        """
+        if not 1 <= min_chunks <= max_chunks:
+            raise ValueError("The chunk counts must satisfy 1 <= min <= max!")
+        self.document_count = document_count
+        self.min_chunks = min_chunks
+        self.max_chunks = max_chunks
+        self.dim = dim
+        self.words_per_chunk = words_per_chunk
+        self.seed = seed
+
+    def _unit_vectors(self, rng: np.random.Generator, count: int) -> np.ndarray:
+        vectors = rng.standard_normal((count, self.dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def document_uuid(self, position: int) -> str:
+        rng = np.random.default_rng([self.seed, position, 0])
+        return str(uuid.UUID(bytes=rng.bytes(16), version=4))
+
+    def document_embedding(self, position: int) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, position, 1])
+        return self._unit_vectors(rng, 1)[0]
+
+    def _chunk_count(self, rng: np.random.Generator) -> int:
+        return int(rng.integers(self.min_chunks, self.max_chunks + 1))
+
+    def chunk_count(self) -> int:
+        """
+        Returns the total number of chunks of the documents.
+        """
+        return sum(
+            self._chunk_count(np.random.default_rng([self.seed, position, 2]))
+            for position in range(self.document_count)
+        )
+
+    def document(self, position: int) -> AddDocumentRequest:
+        """
+        Returns the document at the given position as the /add_document
+        request that adds it, with binary embeddings.
+        """
+        document_uuid = self.document_uuid(position)
+        rng = np.random.default_rng([self.seed, position, 2])
+        chunk_count = self._chunk_count(rng)
+        words = rng.choice(_WORDS, size=(chunk_count, self.words_per_chunk))
+        return AddDocumentRequest(
+            document_uuid=document_uuid,
+            document_hash_str=hashlib.sha256(document_uuid.encode()).hexdigest(),
+            document_filename=f"document_{position}.pdf",
+            document_embedding=encode_embeddings(
+                self.document_embedding(position)[None]),
+            document_summary=f"Synthetic document {position}",
+            document_chunks=[
+                AddDocumentChunk(text=" ".join(chunk_words), page_number=i // 4)
+                for i, chunk_words in enumerate(words)
+            ],
+            chunks_embeddings=encode_embeddings(
+                self._unit_vectors(rng, chunk_count))
+        )
+
+    def documents(self) -> Iterator[AddDocumentRequest]:
+        for position in range(self.document_count):
+            yield self.document(position)
+
+    def queries(
+        self,
+        count: int,
+        documents_per_query: int,
+        noise: float = 0.5
+    ) -> Iterator[tuple[np.ndarray, list[str]]]:
+        """
+        Generates queries close to random documents of the corpus.
+
+        Returns:
+        - Iterator[tuple[np.ndarray, list[str]]]: The embedding of each
+            query, a noisy copy of the embedding of a document, and the
+            UUIDs of documents_per_query random documents whose chunks it
+            queries.
+        """
+        rng = np.random.default_rng([self.seed, self.document_count, 3])
+        for _ in range(count):
+            position = int(rng.integers(self.document_count))
+            embedding = (
+                self.document_embedding(position)
+                + noise * self._unit_vectors(rng, 1)[0]
+            )
+            embedding /= np.linalg.norm(embedding)
+            positions = rng.choice(
+                self.document_count,
+                size=min(documents_per_query, self.document_count),
+                replace=False
+            )
+            yield embedding, [self.document_uuid(int(p)) for p in positions]
+
+    def deleted_uuids(self, fraction: float) -> list[str]:
+        """
+        Returns the UUIDs of a random fraction of the documents.
+        """
+        rng = np.random.default_rng([self.seed, self.document_count, 4])
+        positions = rng.choice(
+            self.document_count,
+            size=int(self.document_count * fraction),
+            replace=False
+        )
+        return [self.document_uuid(int(p)) for p in positions]
+
+    def description(self) -> dict[str, Any]:
+        return {
+            "documents": self.document_count,
+            "min_chunks": self.min_chunks,
+            "max_chunks": self.max_chunks,
+            "dim": self.dim,
+            "words_per_chunk": self.words_per_chunk,
+            "seed": self.seed
+        }
+
+
+def summarize(
+    latencies: list[Optional[float]],
+    wall_time: float
+) -> dict[str, Any]:
+    """
+    Summarizes the latencies of the calls of an operation.
+
+    Args:
+    - latencies (list[Optional[float]]): The latency of each call in
+        seconds, None for the calls that failed.
+    - wall_time (float): The time taken by all the calls, in seconds.
+
+    Returns:
+    - dict[str, Any]: The number of calls and of errors, the throughput in
+        calls per second, and the mean, p50, p99 and max latencies of the
+        successful calls in milliseconds.
+    """
+    succeeded = np.asarray(
+        [latency for latency in latencies if latency is not None]) * 1000
+    summary = {
+        "count": len(latencies),
+        "errors": len(latencies) - len(succeeded),
+        "wall_time_s": wall_time,
+        "throughput_per_s": len(succeeded) / wall_time if wall_time > 0 else None
+    }
+    for name, value in (
+        ("mean_ms", np.mean),
+        ("p50_ms", lambda x: np.percentile(x, 50)),
+        ("p99_ms", lambda x: np.percentile(x, 99)),
+        ("max_ms", np.max)
+    ):
+        summary[name] = float(value(succeeded)) if len(succeeded) else None
+    return summary
+
+
+def _time_call(func: Callable, *args) -> Optional[float]:
+    start = time.perf_counter()
+    try:
+        func(*args)
+    except Exception as e:
+        print(f"{func.__name__} failed: {e}", file=sys.stderr)
+        return None
+    return time.perf_counter() - start
+
+def measure_calls(
+    func: Callable,
+    calls: Iterable[tuple],
+    concurrency: int = 1
+) -> dict[str, Any]:
+    """
+    Calls the given function with each tuple of arguments, from concurrency
+    threads, and summarizes the latencies. The arguments are consumed
+    lazily, so that a large corpus never has to fit in memory.
+    """
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for args in calls:
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                latencies.extend(future.result() for future in done)
+            pending.add(executor.submit(_time_call, func, *args))
+        latencies.extend(future.result() for future in wait(pending).done)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def _time_request(
+    client: httpx.AsyncClient,
+    request: httpx.Request
+) -> Optional[float]:
+    start = time.perf_counter()
+    try:
+        response = await client.send(request)
+        response.raise_for_status()
+        # The deletions report their failures in the response body
+        body = response.json()
+        if isinstance(body, dict) and body.get("is_success") is False:
+            raise RuntimeError(body.get("error_message"))
+    except Exception as e:
+        print(f"{request.method} {request.url.path} failed: {e}", file=sys.stderr)
+        return None
+    return time.perf_counter() - start
+
+async def measure_requests(
+    client: httpx.AsyncClient,
+    requests: Iterable[httpx.Request],
+    concurrency: int = 1
+) -> dict[str, Any]:
+    """
+    Sends the given requests, at most concurrency at once, and summarizes
+    their latencies. The requests are built lazily.
+    """
+    latencies = []
+    start = time.perf_counter()
+    pending = set()
+    for request in requests:
+        if len(pending) >= concurrency:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            latencies.extend(task.result() for task in done)
+        pending.add(asyncio.create_task(_time_request(client, request)))
+    if pending:
+        done, _ = await asyncio.wait(pending)
+        latencies.extend(task.result() for task in done)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def _add_chunk_throughput(
+    summary: dict[str, Any],
+    corpus: SyntheticCorpus
+) -> None:
+    summary["chunks"] = corpus.chunk_count()
+    summary["chunks_per_s"] = (
+        summary["chunks"] / summary["wall_time_s"]
+        if summary["wall_time_s"] > 0 else None
+    )
+
+def _log(operation: str, summary: dict[str, Any]) -> None:
+    def ms(value: Optional[float]) -> str:
+        return f"{value:.2f}" if value is not None else "-"
+    throughput = summary["throughput_per_s"]
+    print(
+        f"{operation:<16} {summary['count']:>8} calls "
+        f"{summary['errors']:>4} errors "
+        f"{throughput if throughput is not None else 0:>10.1f}/s "
+        f"p50 {ms(summary['p50_ms'])} ms  p99 {ms(summary['p99_ms'])} ms",
+        file=sys.stderr
+    )
+
+
+def run_in_process(
+    corpus: SyntheticCorpus,
+    args: argparse.Namespace
+) -> dict[str, Any]:
+    """
+    Benchmarks a DataStore running in this process on an empty data root.
+
+    Returns:
+    - dict[str, Any]: The manifest of the filled datastore, the datastore
+        environment variables and the summary of each operation.
+    """
+    # The storage configuration is read from the environment when the
+    # package is imported, so the data root is set first
+    os.environ["DATA_ROOT"] = str(args.data_root)
+    os.environ["UPLOADED_FILES_PATH"] = str(args.data_root / "uploaded_files")
+    os.makedirs(os.environ["UPLOADED_FILES_PATH"], exist_ok=True)
+    from storage import DataStore
+
+    datastore = DataStore(corpus.dim)
+    results = {}
+    try:
+        def add_document(document: AddDocumentRequest) -> None:
+            datastore.add_document(
+                document.document_uuid,
+                document.document_hash_str,
+                document.document_filename,
+                decode_embedding(document.document_embedding, corpus.dim),
+                document.document_summary,
+                document.document_chunks,
+                decode_embeddings(document.chunks_embeddings, corpus.dim)
+            )
+
+        def query_root(embedding: np.ndarray) -> None:
+            datastore.query_root(embedding, top_k=args.top_k)
+
+        def query_documents(embedding: np.ndarray, uuids: list[str]) -> None:
+            datastore.query_documents(uuids, embedding, top_k=args.top_k)
+
+        results["add_document"] = measure_calls(
+            add_document,
+            ((document,) for document in corpus.documents()),
+            args.concurrency
+        )
+        _add_chunk_throughput(results["add_document"], corpus)
+        _log("add_document", results["add_document"])
+        manifest = datastore.manifest()
+
+        results["query_root"] = measure_calls(
+            query_root,
+            (
+                (embedding,)
+                for embedding, _ in corpus.queries(args.queries, args.top_k)
+            ),
+            args.concurrency
+        )
+        _log("query_root", results["query_root"])
+
+        results["query_documents"] = measure_calls(
+            query_documents,
+            corpus.queries(args.queries, args.top_k),
+            args.concurrency
+        )
+        _log("query_documents", results["query_documents"])
+
+        results["delete_document"] = measure_calls(
+            datastore.delete_document,
+            ((uuid,) for uuid in corpus.deleted_uuids(args.delete_fraction)),
+            args.concurrency
+        )
+        _log("delete_document", results["delete_document"])
+
+        results["clear"] = measure_calls(datastore.clear, [()])
+        _log("clear", results["clear"])
+    finally:
+        datastore.close()
+
+    return {
+        "manifest": manifest.model_dump(),
+        "environment": {
+            name: value for name, value in sorted(os.environ.items())
+            if name.startswith(_CONFIG_PREFIXES)
+        },
+        "results": results
+    }
+
+
+async def run_http(
+    corpus: SyntheticCorpus,
+    args: argparse.Namespace
+) -> dict[str, Any]:
+    """
+    Benchmarks a running datastore through its HTTP API, with binary
+    embeddings as sent by the backend.
+
+    Returns:
+    - dict[str, Any]: The manifest of the filled datastore and the summary
+        of each operation.
+    """
+    url = args.url.rstrip("/")
+    results = {}
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        response = await client.get(
+            f"{url}/document_info", params={"count_only": True})
+        response.raise_for_status()
+        if response.json()["document_count"] and not args.force:
+            raise RuntimeError(
+                f"The datastore at {url} is not empty, the benchmark ends by "
+                "deleting all its documents. Use --force to run it anyway.")
+
+        results["add_document"] = await measure_requests(
+            client,
+            (
+                client.build_request(
+                    "POST",
+                    f"{url}/add_document",
+                    json=document.model_dump(exclude_none=True)
+                )
+                for document in corpus.documents()
+            ),
+            args.concurrency
+        )
+        _add_chunk_throughput(results["add_document"], corpus)
+        _log("add_document", results["add_document"])
+        response = await client.get(f"{url}/manifest")
+        response.raise_for_status()
+        manifest = response.json()
+
+        results["query_root"] = await measure_requests(
+            client,
+            (
+                client.build_request(
+                    "POST",
+                    f"{url}/query_root",
+                    json=RootQueryRequest(
+                        query_embedding=encode_embeddings(embedding[None]),
+                        top_k=args.top_k
+                    ).model_dump()
+                )
+                for embedding, _ in corpus.queries(args.queries, args.top_k)
+            ),
+            args.concurrency
+        )
+        _log("query_root", results["query_root"])
+
+        results["query_documents"] = await measure_requests(
+            client,
+            (
+                client.build_request(
+                    "POST",
+                    f"{url}/query_document",
+                    json=DocumentQueryRequest(
+                        document_uuids=uuids,
+                        query_embedding=encode_embeddings(embedding[None]),
+                        top_k=args.top_k
+                    ).model_dump()
+                )
+                for embedding, uuids in corpus.queries(args.queries, args.top_k)
+            ),
+            args.concurrency
+        )
+        _log("query_documents", results["query_documents"])
+
+        results["delete_document"] = await measure_requests(
+            client,
+            (
+                client.build_request(
+                    "DELETE",
+                    f"{url}/delete_document",
+                    params={"document_uuid": document_uuid}
+                )
+                for document_uuid in corpus.deleted_uuids(args.delete_fraction)
+            ),
+            args.concurrency
+        )
+        _log("delete_document", results["delete_document"])
+
+        results["clear"] = await measure_requests(
+            client, [client.build_request("DELETE", f"{url}/delete_all")])
+        _log("clear", results["clear"])
+
+    return {"manifest": manifest, "results": results}
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    max_regression: float
+) -> list[str]:
+    """
+    Compares the results of a run with the results of a baseline run.
+
+    Args:
+    - results (dict[str, dict[str, Any]]): The summary of each operation.
+    - baseline (dict[str, dict[str, Any]]): The summary of each operation
+        in the baseline run.
+    - max_regression (float): The tolerated relative increase of the p99
+        latency and decrease of the throughput.
+
+    Returns:
+    - list[str]: A description of each regression, empty if none.
+    """
+    regressions = []
+    for operation, summary in results.items():
+        previous = baseline.get(operation)
+        if previous is None:
+            continue
+        p99, previous_p99 = summary.get("p99_ms"), previous.get("p99_ms")
+        if p99 is not None and previous_p99 and (
+                p99 > previous_p99 * (1 + max_regression)):
+            regressions.append(
+                f"{operation}: p99 {previous_p99:.2f} ms -> {p99:.2f} ms")
+        throughput = summary.get("throughput_per_s")
+        previous_throughput = previous.get("throughput_per_s")
+        if throughput is not None and previous_throughput and (
+                throughput < previous_throughput * (1 - max_regression)):
+            regressions.append(
+                f"{operation}: throughput {previous_throughput:.1f}/s -> "
+                f"{throughput:.1f}/s")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the datastore on a synthetic corpus."
+    )
+    parser.add_argument("--documents", default=1000, type=int)
+    parser.add_argument(
+        "--chunks",
+        nargs=2,
+        default=(50, 2000),
+        type=int,
+        metavar=("MIN", "MAX"),
+        help="Range of the number of chunks of a document."
+    )
+    parser.add_argument("--dim", default=768, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument(
+        "--queries",
+        default=1000,
+        type=int,
+        help="Number of calls of each query operation."
+    )
+    parser.add_argument(
+        "--top-k",
+        default=5,
+        type=int,
+        help="Results per query, and documents queried by query_documents."
+    )
+    parser.add_argument(
+        "--delete-fraction",
+        default=0.1,
+        type=float,
+        help="Fraction of the documents deleted one by one before the clear."
+    )
+    parser.add_argument(
+        "--concurrency",
+        default=1,
+        type=int,
+        help="Number of calls in flight at once."
+    )
+    parser.add_argument(
+        "--url",
+        help="Base URL of a running datastore, benchmarked over HTTP instead "
+             "of in this process."
+    )
+    parser.add_argument(
+        "--data-root",
+        type=Path,
+        help="Empty directory of the in-process datastore, a temporary "
+             "directory by default."
+    )
+    parser.add_argument("--timeout", default=300.0, type=float)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Benchmark a datastore over HTTP even if it stores documents, "
+             "which are all deleted."
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="File the JSON results are written to, stdout by default."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="JSON results of a previous run to compare with."
+    )
+    parser.add_argument(
+        "--max-regression",
+        default=0.2,
+        type=float,
+        help="Relative p99 increase or throughput decrease reported as a "
+             "regression."
+    )
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(
+        args.documents,
+        args.chunks[0],
+        args.chunks[1],
+        args.dim,
+        seed=args.seed
+    )
+    report = {
+        "mode": "http" if args.url else "in_process",
+        "target": args.url,
+        "timestamp": time.time(),
+        "corpus": corpus.description(),
+        "concurrency": args.concurrency,
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "delete_fraction": args.delete_fraction
+    }
+    if args.url:
+        report.update(asyncio.run(run_http(corpus, args)))
+    elif args.data_root is not None:
+        if args.data_root.exists() and any(args.data_root.iterdir()):
+            parser.error(f"The data root {args.data_root} is not empty")
+        args.data_root.mkdir(parents=True, exist_ok=True)
+        report["target"] = str(args.data_root)
+        report.update(run_in_process(corpus, args))
+    else:
+        with tempfile.TemporaryDirectory(prefix="datastore_benchmark_") as data_root:
+            args.data_root = Path(data_root)
+            report["target"] = data_root
+            report.update(run_in_process(corpus, args))
+
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(
+            report["results"], baseline["results"], args.max_regression)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
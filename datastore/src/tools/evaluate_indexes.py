@@ -0,0 +1,496 @@
+"""
+Recall versus latency evaluation of the index configurations, to choose
+the root index type, the encoding and the search parameters on a given
+corpus.
+
+From the src directory of the datastore:
+
+    python -m tools.evaluate_indexes [--documents 100000] [--dim 768]
+        [--data-root /vector_index --source root|chunks]
+        [--k 10] [--ef-search 16,32,64,128,256] [--nprobe 1,4,16,64,256]
+        [--output results.json]
+
+The corpus is either synthetic, clustered unit-length embeddings, or the
+embeddings stored in a datastore data root: its root index or its chunk
+indexes, as of their last checkpoint. Some corpus embeddings are held out
+as queries and their exact nearest neighbors are computed with a
+brute-force search. Every configuration is then built with the code of the
+datastore, the root index types (flat, hnsw, ivf_flat, ivf_pq) with each
+efSearch or nprobe and the sub-index encodings (sq_fp16, sq8, pq) with
+each re-ranking factor, and reports its recall@k, its single query
+latency, its size and its build time. The configurations that no other
+one beats on both recall and p50 latency are marked as Pareto optimal.
+
+The index parameters default to the ROOT_INDEX_* and INDEX_PQ_M
+environment variables of the datastore.
+"""
+import argparse
+import json
+from pathlib import Path
+import sys
+import time
+from typing import Any, Callable, Iterator
+
+import faiss
+import numpy as np
+
+from storage import utils
+from storage.index import encoding as index_encoding
+from storage.index import root_index
+from storage.index.utils import read_ids
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def _str_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def synthetic_corpus(
+    count: int,
+    dim: int,
+    clusters: int,
+    spread: float = 1.0,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    Generates unit-length embeddings around random cluster centers, since
+    real embeddings are not spread uniformly and approximate indexes
+    behave very differently on uniform data.
+
+    Args:
+    - count (int): The number of embeddings.
+    - dim (int): The length of the embeddings.
+    - clusters (int): The number of clusters.
+    - spread (float): The norm of the noise added to a cluster center
+        before normalization, larger values give looser clusters.
+    - seed (int): The seed of the generated corpus.
+
+    Returns:
+    - np.ndarray: The embeddings, one per row.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    noise = rng.standard_normal((count, dim), dtype=np.float32)
+    noise *= spread / np.linalg.norm(noise, axis=1, keepdims=True)
+    vectors = centers[rng.integers(clusters, size=count)] + noise
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def _stored_vectors(index: faiss.Index) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the embeddings stored in the given index and their IDs, as
+    decoded from their encoding.
+    """
+    # The downcast index does not own the index, which must stay referenced
+    downcast = faiss.downcast_index(index)
+    if isinstance(downcast, faiss.IndexIVF):
+        vectors, ids = [], []
+        invlists = downcast.invlists
+        for list_no in range(downcast.nlist):
+            list_size = invlists.list_size(list_no)
+            if list_size == 0:
+                continue
+            list_vectors = np.empty((list_size, index.d), dtype=np.float32)
+            for offset in range(list_size):
+                downcast.reconstruct_from_offset(
+                    list_no, offset, faiss.swig_ptr(list_vectors[offset]))
+            vectors.append(list_vectors)
+            ids.append(faiss.rev_swig_ptr(
+                invlists.get_ids(list_no), list_size).copy())
+        if not vectors:
+            return (
+                np.zeros((0, index.d), dtype=np.float32),
+                np.zeros(0, dtype=np.int64)
+            )
+        return np.concatenate(vectors), np.concatenate(ids)
+    if isinstance(downcast, faiss.IndexIDMap):
+        return root_index.index_vectors(index)
+    return index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal)
+
+def load_corpus(
+    data_root: Path,
+    source: str,
+    max_vectors: int,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    Reads the embeddings stored in a datastore data root, as of the last
+    checkpoint of its indexes. Embeddings stored with a lossy encoding are
+    read as their approximation.
+
+    Args:
+    - data_root (Path): The data root of the datastore.
+    - source (str): "root" for the document embeddings of the root index,
+        "chunks" for the chunk embeddings of the global chunk index or of
+        the per-document sub-indexes.
+    - max_vectors (int): The maximum number of embeddings returned, a
+        random sample is returned if there are more.
+    - seed (int): The seed of the sample.
+
+    Returns:
+    - np.ndarray: The embeddings, one per row.
+    """
+    if source == "root":
+        index_path = data_root / "root_index.faiss"
+        vectors, ids = _stored_vectors(faiss.read_index(str(index_path)))
+        # The deleted documents are only tombstoned until a compaction
+        tombstones = read_ids(index_path.with_suffix(".tombstones"))
+        vectors = vectors[~np.isin(ids, tombstones)]
+    elif source == "chunks":
+        index_path = data_root / "chunk_index.faiss"
+        if index_path.exists():
+            vectors, _ = _stored_vectors(faiss.read_index(str(index_path)))
+        else:
+            vectors = []
+            total = 0
+            for sub_index_path in sorted((data_root / "sub_index").glob("*.faiss")):
+                sub_vectors, _ = _stored_vectors(
+                    faiss.read_index(str(sub_index_path)))
+                vectors.append(sub_vectors)
+                total += len(sub_vectors)
+                # The sample is taken once enough embeddings are read
+                if total >= 2 * max_vectors:
+                    break
+            if not vectors:
+                raise ValueError(f"No chunk index found in {data_root}!")
+            vectors = np.concatenate(vectors)
+    else:
+        raise ValueError(f"Unknown corpus source {source}!")
+
+    if len(vectors) > max_vectors:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[np.sort(
+            rng.choice(len(vectors), size=max_vectors, replace=False))]
+    return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def split_queries(
+    vectors: np.ndarray,
+    query_count: int,
+    seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Holds out random embeddings of the corpus as queries.
+
+    Returns:
+    - tuple[np.ndarray, np.ndarray]: The embeddings indexed and the
+        embeddings of the queries.
+    """
+    rng = np.random.default_rng(seed)
+    is_query = np.zeros(len(vectors), dtype=bool)
+    is_query[rng.choice(len(vectors), size=query_count, replace=False)] = True
+    return vectors[~is_query], vectors[is_query]
+
+def ground_truth(base: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the positions in base of the exact k nearest neighbors of each
+    query, with a brute-force search.
+    """
+    index = faiss.IndexFlatL2(base.shape[1])
+    index.add(base)
+    _, ids = index.search(queries, k)
+    return ids
+
+def recall_at_k(ids: np.ndarray, true_ids: np.ndarray) -> float:
+    """
+    Returns the average fraction of the exact k nearest neighbors of each
+    query that are among the k results of the evaluated index.
+    """
+    k = true_ids.shape[1]
+    return float(np.mean([
+        len(np.intersect1d(found[found >= 0], expected)) / k
+        for found, expected in zip(ids, true_ids)
+    ]))
+
+
+def index_bytes(index: faiss.Index) -> int:
+    """
+    Returns the size of the serialized index, which also counts the graph
+    of an HNSW index and the centroids and codebooks of the quantizers.
+    """
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def configurations(
+    args: argparse.Namespace,
+    dim: int
+) -> Iterator[tuple[str, Callable, list[tuple[str, Callable]]]]:
+    """
+    Generates the evaluated configurations. Each one builds its index once
+    and is searched with every value of its search parameter.
+
+    Returns:
+    - Iterator: The name of each configuration, the function building its
+        index from the embeddings, and the label and setter of each value
+        of its search parameter.
+    """
+    params = {
+        "hnsw_m": args.hnsw_m,
+        "nlist": args.nlist,
+        "pq_m": args.pq_m,
+        "ef_search": args.ef_search[0],
+        "nprobe": args.nprobe[0]
+    }
+    for kind in args.types:
+        if kind not in root_index.INDEX_TYPES:
+            raise ValueError(f"Unknown root index type {kind}!")
+
+        def build(vectors: np.ndarray, kind: str = kind) -> faiss.Index:
+            return root_index.build_index(
+                kind,
+                dim,
+                vectors,
+                np.arange(len(vectors), dtype=np.int64),
+                params
+            )
+
+        if kind == root_index.HNSW:
+            sweep = [
+                (
+                    f"ef_search={ef_search}",
+                    lambda index, ef_search=ef_search: root_index.set_search_params(
+                        index, ef_search, params["nprobe"])
+                )
+                for ef_search in args.ef_search
+            ]
+        elif kind in (root_index.IVF_FLAT, root_index.IVF_PQ):
+            sweep = [
+                (
+                    f"nprobe={nprobe}",
+                    lambda index, nprobe=nprobe: root_index.set_search_params(
+                        index, params["ef_search"], nprobe)
+                )
+                for nprobe in args.nprobe
+            ]
+        else:
+            sweep = [("", lambda index: None)]
+        yield f"root:{kind}", build, sweep
+
+    for encoding in args.encodings:
+        if encoding not in index_encoding.ENCODINGS:
+            raise ValueError(f"Unknown index encoding {encoding}!")
+        for rerank_factor in args.rerank_factors:
+            if rerank_factor > 0 and encoding == index_encoding.FLAT:
+                continue
+
+            def build(
+                vectors: np.ndarray,
+                encoding: str = encoding,
+                rerank_factor: int = rerank_factor
+            ) -> faiss.Index:
+                return index_encoding.build_index(
+                    encoding, dim, vectors, rerank_factor, args.pq_m)
+
+            name = f"encoding:{encoding}"
+            if rerank_factor > 0:
+                name += f"+rerank{rerank_factor}"
+            yield name, build, [("", lambda index: None)]
+
+
+def evaluate(
+    index: faiss.Index,
+    queries: np.ndarray,
+    true_ids: np.ndarray
+) -> dict[str, Any]:
+    """
+    Searches the given index with each query on its own, as the datastore
+    does, and measures its recall@k and latency.
+
+    Returns:
+    - dict[str, Any]: The recall@k, and the mean, p50 and p99 latencies in
+        milliseconds.
+    """
+    k = true_ids.shape[1]
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids[i:i + 1] = index.search(queries[i:i + 1], k)
+        latencies[i] = time.perf_counter() - start
+    latencies *= 1000
+    return {
+        "recall": recall_at_k(ids, true_ids),
+        "mean_ms": float(np.mean(latencies)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99))
+    }
+
+def mark_pareto(results: list[dict[str, Any]]) -> None:
+    """
+    Marks the results that no other result beats on both recall and p50
+    latency.
+    """
+    for result in results:
+        result["pareto"] = not any(
+            other["recall"] >= result["recall"]
+            and other["p50_ms"] <= result["p50_ms"]
+            and (
+                other["recall"] > result["recall"]
+                or other["p50_ms"] < result["p50_ms"]
+            )
+            for other in results
+        )
+
+
+def run(
+    base: np.ndarray,
+    queries: np.ndarray,
+    args: argparse.Namespace
+) -> list[dict[str, Any]]:
+    """
+    Builds and evaluates every configuration on the given corpus.
+
+    Returns:
+    - list[dict[str, Any]]: The result of each configuration and search
+        parameter value.
+    """
+    true_ids = ground_truth(base, queries, args.k)
+    results = []
+    for name, build, sweep in configurations(args, base.shape[1]):
+        start = time.perf_counter()
+        try:
+            index = build(base)
+        except RuntimeError as e:
+            print(f"{name}: cannot be built: {e}", file=sys.stderr)
+            continue
+        build_time = time.perf_counter() - start
+        size = index_bytes(index)
+        for label, set_params in sweep:
+            set_params(index)
+            result = {
+                "configuration": name,
+                "search_params": label,
+                "build_time_s": build_time,
+                "index_bytes": size,
+                **evaluate(index, queries, true_ids)
+            }
+            results.append(result)
+            print(
+                f"{name:<26} {label:<16} recall@{args.k} {result['recall']:.4f} "
+                f"p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms  "
+                f"{size / 2**20:.1f} MiB",
+                file=sys.stderr
+            )
+        del index
+    mark_pareto(results)
+    return results
+
+
+def main() -> None:
+    root_params = utils.get_root_index_params()
+    parser = argparse.ArgumentParser(
+        description="Evaluates the recall and latency of index configurations."
+    )
+    parser.add_argument(
+        "--data-root",
+        type=Path,
+        help="Data root of a datastore whose embeddings are evaluated, a "
+             "synthetic corpus is generated otherwise."
+    )
+    parser.add_argument(
+        "--source",
+        default="root",
+        choices=("root", "chunks"),
+        help="Embeddings read from --data-root."
+    )
+    parser.add_argument("--max-vectors", default=200_000, type=int)
+    parser.add_argument(
+        "--documents",
+        default=100_000,
+        type=int,
+        help="Number of embeddings of the synthetic corpus."
+    )
+    parser.add_argument("--dim", default=768, type=int)
+    parser.add_argument("--clusters", default=256, type=int)
+    parser.add_argument(
+        "--spread",
+        default=1.0,
+        type=float,
+        help="Norm of the noise around the cluster centers, before "
+             "normalization."
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--queries", default=1000, type=int)
+    parser.add_argument("--k", default=10, type=int)
+    parser.add_argument(
+        "--types",
+        default=list(root_index.INDEX_TYPES),
+        type=_str_list,
+        help="Comma-separated root index types."
+    )
+    parser.add_argument(
+        "--encodings",
+        default=[
+            index_encoding.SQ_FP16, index_encoding.SQ8, index_encoding.PQ],
+        type=_str_list,
+        help="Comma-separated sub-index encodings."
+    )
+    parser.add_argument(
+        "--rerank-factors",
+        default=[0, 4],
+        type=_int_list,
+        help="Comma-separated re-ranking factors of the encodings."
+    )
+    parser.add_argument(
+        "--ef-search", default=[16, 32, 64, 128, 256], type=_int_list)
+    parser.add_argument(
+        "--nprobe", default=[1, 4, 16, 64, 256], type=_int_list)
+    parser.add_argument("--hnsw-m", default=root_params["hnsw_m"], type=int)
+    parser.add_argument("--nlist", default=root_params["nlist"], type=int)
+    parser.add_argument("--pq-m", default=root_params["pq_m"], type=int)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Number of threads of faiss, its default otherwise."
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="File the JSON results are written to, stdout by default."
+    )
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        faiss.omp_set_num_threads(args.threads)
+    if args.data_root is not None:
+        vectors = load_corpus(
+            args.data_root, args.source, args.max_vectors, args.seed)
+        corpus = {
+            "data_root": str(args.data_root),
+            "source": args.source
+        }
+    else:
+        vectors = synthetic_corpus(
+            args.documents, args.dim, args.clusters, args.spread, args.seed)
+        corpus = {
+            "clusters": args.clusters,
+            "spread": args.spread,
+            "seed": args.seed
+        }
+    if len(vectors) <= args.queries:
+        parser.error(
+            f"The corpus has {len(vectors)} embeddings, not enough for "
+            f"{args.queries} queries")
+    base, queries = split_queries(vectors, args.queries, args.seed)
+    corpus.update({"vectors": len(base), "dim": base.shape[1]})
+
+    report = {
+        "timestamp": time.time(),
+        "corpus": corpus,
+        "queries": len(queries),
+        "k": args.k,
+        "results": run(base, queries, args)
+    }
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
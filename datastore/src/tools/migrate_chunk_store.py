@@ -0,0 +1,106 @@
+"""
+Offline migration from the per-document chunk metadata databases to the
+consolidated chunk store (CHUNK_STORE_MODE=consolidated).
+
+The datastore must be stopped while the migration runs. From the src
+directory of the datastore:
+
+    python -m tools.migrate_chunk_store [--data-root /vector_index] [--delete]
+
+The migration is idempotent, documents already imported are overwritten, so
+it can be run again after an interruption.
+"""
+import argparse
+from pathlib import Path
+import sqlite3
+
+from storage.metadata import tables
+from storage.metadata.pool import configure_connection
+from storage import utils
+
+
+def migrate(
+    data_root: Path,
+    chunk_db_name: str = "chunk_metadata",
+    batch_size: int = 100,
+    delete: bool = False
+) -> tuple[int, int]:
+    """
+    Imports the chunks of every per-document database of the sub-index
+    directory into the consolidated chunk database, committing one
+    transaction per batch of documents.
+
+    Args:
+    - data_root (Path): The root directory of the datastore files.
+    - chunk_db_name (str): The name of the consolidated chunk database file.
+    - batch_size (int): The number of documents imported per transaction.
+    - delete (bool): Whether to remove the per-document databases once
+        their chunks are committed.
+
+    Returns:
+    - tuple[int, int]: The number of documents and chunks imported.
+    """
+    sub_index_path = data_root / "sub_index"
+    chunk_db = sqlite3.connect(str(data_root / f"{chunk_db_name}.db"))
+    configure_connection(
+        chunk_db, utils.get_sqlite_mmap_size(), utils.get_sqlite_cache_size())
+    with chunk_db as conn:
+        conn.execute(tables.chunk_creation_str)
+
+    insert_str = tables.chunk_insert_str.replace(
+        "INSERT INTO", "INSERT OR REPLACE INTO", 1)
+    db_paths = sorted(sub_index_path.glob("*.db"))
+    document_count = chunk_count = 0
+    try:
+        for start in range(0, len(db_paths), batch_size):
+            batch = db_paths[start:start + batch_size]
+            with chunk_db as conn:
+                for db_path in batch:
+                    document_uuid = db_path.stem
+                    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+                    try:
+                        rows = source.execute(
+                            "SELECT faiss_id, page_number, text FROM metadata"
+                        ).fetchall()
+                    finally:
+                        source.close()
+                    conn.executemany(
+                        insert_str,
+                        [(document_uuid, *row) for row in rows]
+                    )
+                    document_count += 1
+                    chunk_count += len(rows)
+
+            if delete:
+                for db_path in batch:
+                    db_path.unlink()
+                    for suffix in ("-wal", "-shm"):
+                        db_path.with_name(db_path.name + suffix).unlink(
+                            missing_ok=True)
+            print(f"Imported {document_count}/{len(db_paths)} documents")
+    finally:
+        chunk_db.close()
+    return document_count, chunk_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Imports the per-document chunk databases into the "
+                    "consolidated chunk store."
+    )
+    parser.add_argument("--data-root", default=utils.get_data_root(), type=Path)
+    parser.add_argument("--batch-size", default=100, type=int)
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Remove the per-document databases once imported."
+    )
+    args = parser.parse_args()
+
+    document_count, chunk_count = migrate(
+        args.data_root, batch_size=args.batch_size, delete=args.delete)
+    print(f"Migrated {chunk_count} chunks of {document_count} documents")
+
+
+if __name__ == "__main__":
+    main()
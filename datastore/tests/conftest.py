@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# The modules are imported from src, as main.py does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,54 @@
+import numpy as np
+
+from storage.index import log as index_log
+
+
+_EMBEDDING_LENGTH = 4
+
+
+def _embeddings(count: int) -> np.ndarray:
+    return np.arange(
+        count * _EMBEDDING_LENGTH, dtype=np.float32
+    ).reshape(count, _EMBEDDING_LENGTH)
+
+
+def test_replay_after_torn_record(tmp_path):
+    log_path = tmp_path / "index.log"
+    log = index_log.IndexLog(log_path, _EMBEDDING_LENGTH)
+    log.append(index_log.ADD, np.array([0, 1]), _embeddings(2))
+    log.close()
+    complete_size = log_path.stat().st_size
+
+    # A crash while the next record was being written
+    with open(log_path, "ab") as f:
+        f.write(index_log._HEADER.pack(index_log.ADD, 1, 1) + b"\x00" * 5)
+
+    log = index_log.IndexLog(log_path, _EMBEDDING_LENGTH)
+    assert len(log.replay()) == 1
+    assert log.size() == complete_size
+    log.append(index_log.REMOVE, np.array([0]))
+    log.append(index_log.ADD, np.array([2]), _embeddings(1))
+    log.close()
+
+    log = index_log.IndexLog(log_path, _EMBEDDING_LENGTH)
+    operations = log.replay()
+    log.close()
+    assert [operation for operation, _, _ in operations] == [
+        index_log.ADD, index_log.REMOVE, index_log.ADD
+    ]
+    assert operations[1][1].tolist() == [0]
+    assert operations[2][1].tolist() == [2]
+    np.testing.assert_array_equal(operations[2][2], _embeddings(1))
+
+
+def test_truncate_keeps_later_records(tmp_path):
+    log = index_log.IndexLog(tmp_path / "index.log", _EMBEDDING_LENGTH)
+    log.replay()
+    log.append(index_log.ADD, np.array([0]), _embeddings(1))
+    checkpoint_size = log.size()
+    log.append(index_log.CLEAR, np.array([], dtype=np.int64))
+    log.truncate(checkpoint_size)
+
+    operations = log.replay()
+    log.close()
+    assert [operation for operation, _, _ in operations] == [index_log.CLEAR]
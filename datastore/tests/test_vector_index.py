@@ -0,0 +1,47 @@
+import threading
+
+import numpy as np
+
+from storage.index import VectorIndex
+
+
+_EMBEDDING_LENGTH = 16
+
+
+def test_concurrent_root_queries_with_tombstones(tmp_path):
+    # The searches of the root index used to share the search parameters
+    # skipping the tombstones, which faiss modifies during the search
+    sub_index_path = tmp_path / "sub_index"
+    sub_index_path.mkdir()
+    vector_index = VectorIndex(
+        _EMBEDDING_LENGTH, str(tmp_path), "root_index", str(sub_index_path))
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((1000, _EMBEDDING_LENGTH))
+    ids = [
+        vector_index.add_to_root(embedding.tolist())
+        for embedding in embeddings
+    ]
+    removed = set(ids[::2])
+    vector_index.remove_from_root(sorted(removed))
+
+    errors = []
+
+    def query():
+        try:
+            for embedding in embeddings:
+                results = vector_index.query_root_batch(
+                    [embedding.tolist()] * 4, top_k=10)
+                for query_results in results:
+                    assert len(query_results) == 10
+                    found = {root_id for root_id, _ in query_results}
+                    assert not found & removed
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=query) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    vector_index.close()
+    assert errors == []
@@ -12,6 +12,7 @@ from docling_core.types.doc import ImageRefMode, PictureItem, TableItem
 
 from . import utils
 from api_models import ConvertDocumentResponse
+import metrics
 
 
 _UPLOADED_FILES_PATH = Path("/uploaded_files")
@@ -70,20 +71,22 @@ class DoclingDocumentConverter:
         if not document_path.exists():
             raise FileNotFoundError(f"Document {document_name} not found")
 
-        result = self.converter.convert(
-            document_path,
-            max_num_pages=self.max_num_pages,
-            max_file_size=self.max_file_size
-        )
+        with metrics.stage("conversion"):
+            result = self.converter.convert(
+                document_path,
+                max_num_pages=self.max_num_pages,
+                max_file_size=self.max_file_size
+            )
         
-        markdown_document = result.document.export_to_markdown()
-        chunks = batched(markdown_document, chunk_size)
-
-        result = ConvertDocumentResponse(
-            text_chunks=[
-                "".join(chunk) for chunk in chunks
-            ]
-        )
+        with metrics.stage("chunking"):
+            markdown_document = result.document.export_to_markdown()
+            chunks = batched(markdown_document, chunk_size)
+
+            result = ConvertDocumentResponse(
+                text_chunks=[
+                    "".join(chunk) for chunk in chunks
+                ]
+            )
 
         return result
     
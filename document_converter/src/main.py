@@ -3,10 +3,12 @@ from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor
 import time
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Response, status
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from converter import DoclingDocumentConverter
 import api_models
+import metrics
 
 
 @asynccontextmanager
@@ -22,6 +24,7 @@ app = FastAPI(
     lifespan=lifespan,
     title="Document Converter API",
 )
+metrics.instrument(app)
 
 @app.get("/health", response_model=api_models.HealthCheckResponse)
 async def health():
@@ -34,6 +37,15 @@ async def health():
     )
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the metrics of the document converter in the Prometheus text
+    format.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post("/convert_document", response_model=api_models.ConvertDocumentResponse)
 async def convert_document(request: api_models.ConvertDocumentRequest):
     """
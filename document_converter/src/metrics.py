@@ -0,0 +1,64 @@
+"""
+Prometheus metrics of the document converter, served by /metrics: the
+count and latency of the requests of each endpoint, and the latency of the
+stages of the conversions.
+"""
+import time
+
+from fastapi import FastAPI, Request
+from prometheus_client import Counter, Histogram
+
+
+# Latency buckets in seconds, up to the conversion of long documents
+BUCKETS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+    120.0, 300.0, 600.0
+)
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Number of HTTP requests, by endpoint and status code.",
+    ["method", "endpoint", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the HTTP requests, by endpoint.",
+    ["method", "endpoint"],
+    buckets=BUCKETS
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds",
+    "Latency of the stages of the conversions: conversion, the Docling "
+    "pipeline, and chunking, the markdown export and its split in chunks.",
+    ["stage"],
+    buckets=BUCKETS
+)
+
+
+def stage(name: str):
+    """
+    Returns a context manager timing the given stage.
+    """
+    return STAGE_DURATION.labels(name).time()
+
+
+def instrument(app: FastAPI) -> None:
+    """
+    Counts and times every request of the given app by endpoint. The
+    endpoint is the path template of the route, so that path parameters
+    do not create a time series each.
+    """
+    @app.middleware("http")
+    async def observe_request(request: Request, call_next):
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            REQUESTS.labels(request.method, endpoint, str(status_code)).inc()
+            REQUEST_DURATION.labels(request.method, endpoint).observe(
+                time.perf_counter() - start)